@@ -33,8 +33,7 @@ document.getElementById('loginForm')?.addEventListener('submit', async function(
         }
         
         const data = await response.json();
-        currentToken = data.access_token;
-        localStorage.setItem('token', currentToken);
+        storeTokens(data);
         
         // Get user profile
         await loadUserProfile();
@@ -71,8 +70,7 @@ document.getElementById('signupForm')?.addEventListener('submit', async function
         }
         
         const data = await response.json();
-        currentToken = data.access_token;
-        localStorage.setItem('token', currentToken);
+        storeTokens(data);
         
         // Get user profile
         await loadUserProfile();
@@ -83,9 +81,70 @@ document.getElementById('signupForm')?.addEventListener('submit', async function
     }
 });
 
+function storeTokens(data) {
+    currentToken = data.access_token;
+    localStorage.setItem('token', currentToken);
+    if (data.refresh_token) {
+        localStorage.setItem('refreshToken', data.refresh_token);
+    }
+}
+
+// Exchange the stored refresh token for a new access token (no password needed).
+// Concurrent callers share one request, so a burst of 401s rotates the token once.
+let refreshInFlight = null;
+
+function refreshAccessToken() {
+    if (!refreshInFlight) {
+        refreshInFlight = doRefreshAccessToken().finally(() => { refreshInFlight = null; });
+    }
+    return refreshInFlight;
+}
+
+async function doRefreshAccessToken() {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (!refreshToken) return false;
+    
+    const response = await fetch(`${API_BASE_URL}/auth/refresh`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ refresh_token: refreshToken })
+    });
+    
+    if (!response.ok) {
+        localStorage.removeItem('refreshToken');
+        return false;
+    }
+    
+    storeTokens(await response.json());
+    return true;
+}
+
+// True if the JWT is past (or within a minute of) its expiry, or unreadable
+function tokenExpired(token) {
+    try {
+        const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+        return !payload.exp || payload.exp * 1000 < Date.now() + 60000;
+    } catch (error) {
+        return true;
+    }
+}
+
+// fetch() with the current access token; on a 401 it refreshes once and retries
+async function apiFetch(url, options = {}) {
+    const send = () => fetch(url, {
+        ...options,
+        headers: { ...(options.headers || {}), 'Authorization': `Bearer ${currentToken}` }
+    });
+    const response = await send();
+    if (response.status !== 401 || !(await refreshAccessToken())) return response;
+    return send();
+}
+
 async function loadUserProfile() {
     try {
-        const response = await fetch(`${API_BASE_URL}/user/profile`, {
+        const response = await apiFetch(`${API_BASE_URL}/user/profile`, {
             headers: {
                 'Authorization': `Bearer ${currentToken}`
             }
@@ -120,6 +179,50 @@ function showMainApp() {
     document.getElementById('loginPage').style.display = 'none';
     document.getElementById('signupPage').style.display = 'none';
     document.getElementById('mainApp').style.display = 'block';
+    connectProgressStream();
+}
+
+// ============ LIVE PROGRESS ============
+// The server pushes XP, level and achievement updates as they are committed
+let progressSocket = null;
+let progressRetryDelay = 1000;
+
+async function connectProgressStream() {
+    if (!currentToken || progressSocket) return;
+    // The handshake can't answer 401 to a fetch, so renew a stale token first
+    if (tokenExpired(currentToken)) await refreshAccessToken();
+    if (!currentToken || progressSocket) return;
+    const url = `${API_BASE_URL.replace(/^http/, 'ws')}/ws/progress?token=${encodeURIComponent(currentToken)}`;
+    progressSocket = new WebSocket(url);
+    
+    progressSocket.onopen = function() {
+        progressRetryDelay = 1000;
+    };
+    
+    progressSocket.onmessage = function(event) {
+        const update = JSON.parse(event.data);
+        if (!currentUser) return;
+        if (update.total_xp !== null) currentUser.total_xp = update.total_xp;
+        if (update.current_level !== null) currentUser.current_level = update.current_level;
+        if (update.current_streak !== null) currentUser.current_streak = update.current_streak;
+        updateUserUI();
+        
+        if (update.level_up) {
+            alert(`🎉 Level up! You're now level ${update.current_level}! 🌟`);
+        }
+        for (const achievement of update.achievements) {
+            alert(`🏆 Achievement unlocked: ${achievement.name} (+${achievement.xp_reward} XP)`);
+        }
+    };
+    
+    progressSocket.onclose = function() {
+        progressSocket = null;
+        // Reconnect with backoff while logged in (renewing the token first if it has expired)
+        if (currentToken) {
+            setTimeout(connectProgressStream, progressRetryDelay);
+            progressRetryDelay = Math.min(progressRetryDelay * 2, 30000);
+        }
+    };
 }
 
 // ============ FILE UPLOAD ============
@@ -133,7 +236,7 @@ document.getElementById('fileInput')?.addEventListener('change', async function(
             formData.append('files', file);
         }
         
-        const response = await fetch(`${API_BASE_URL}/upload`, {
+        const response = await apiFetch(`${API_BASE_URL}/upload`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`
@@ -188,7 +291,7 @@ async function sendMessage() {
     chatMessages.scrollTop = chatMessages.scrollHeight;
     
     try {
-        const response = await fetch(`${API_BASE_URL}/chat`, {
+        const response = await apiFetch(`${API_BASE_URL}/chat`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`,
@@ -237,7 +340,7 @@ let languageChatActive = false;
 
 async function startLanguagePractice(language) {
     try {
-        const response = await fetch(`${API_BASE_URL}/language/start`, {
+        const response = await apiFetch(`${API_BASE_URL}/language/start`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`,
@@ -346,7 +449,7 @@ async function sendLanguageMessage() {
     chatMessages.scrollTop = chatMessages.scrollHeight;
     
     try {
-        const response = await fetch(`${API_BASE_URL}/language/chat`, {
+        const response = await apiFetch(`${API_BASE_URL}/language/chat`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`,
@@ -407,7 +510,7 @@ async function generateFlashcards() {
     }
     
     try {
-        const response = await fetch(`${API_BASE_URL}/flashcards/generate`, {
+        const response = await apiFetch(`${API_BASE_URL}/flashcards/generate`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`,
@@ -552,7 +655,7 @@ async function generateQuiz() {
     }
     
     try {
-        const response = await fetch(`${API_BASE_URL}/quiz/generate`, {
+        const response = await apiFetch(`${API_BASE_URL}/quiz/generate`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`,
@@ -640,7 +743,7 @@ async function submitQuiz() {
     }
     
     try {
-        const response = await fetch(`${API_BASE_URL}/quiz/submit`, {
+        const response = await apiFetch(`${API_BASE_URL}/quiz/submit`, {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${currentToken}`,
@@ -718,7 +821,7 @@ function showSection(sectionId) {
 // ============ PROGRESS TRACKING ============
 async function loadProgressData() {
     try {
-        const response = await fetch(`${API_BASE_URL}/user/profile`, {
+        const response = await apiFetch(`${API_BASE_URL}/user/profile`, {
             headers: {
                 'Authorization': `Bearer ${currentToken}`
             }
@@ -738,7 +841,7 @@ async function loadProgressData() {
 // ============ SESSION HISTORY ============
 async function loadSessionHistory() {
     try {
-        const response = await fetch(`${API_BASE_URL}/user/sessions`, {
+        const response = await apiFetch(`${API_BASE_URL}/user/sessions`, {
             headers: {
                 'Authorization': `Bearer ${currentToken}`
             }
@@ -778,10 +881,23 @@ async function loadSessionHistory() {
 // ============ LOGOUT ============
 document.getElementById('logoutBtn')?.addEventListener('click', function() {
     if (confirm('Are you sure you want to logout? 🥺')) {
+        const refreshToken = localStorage.getItem('refreshToken');
+        if (refreshToken) {
+            fetch(`${API_BASE_URL}/auth/logout`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ refresh_token: refreshToken })
+            }).catch(error => console.error('Logout error:', error));
+        }
+        
         currentToken = null;
         currentUser = null;
         currentSessionId = null;
+        if (progressSocket) progressSocket.close();
         localStorage.removeItem('token');
+        localStorage.removeItem('refreshToken');
         
         document.getElementById('loginEmail').value = '';
         document.getElementById('loginPassword').value = '';
@@ -995,6 +1111,10 @@ window.addEventListener('load', async function() {
     if (token) {
         currentToken = token;
         try {
+            // Rotate only when needed: every rotation is a write, and tabs share the refresh token
+            if (tokenExpired(token) && !(await refreshAccessToken())) {
+                throw new Error('Session expired');
+            }
             await loadUserProfile();
             showMainApp();
         } catch (error) {
@@ -1004,6 +1124,18 @@ window.addEventListener('load', async function() {
     }
 });
 
+// ============ STUDY SESSION HEARTBEAT ============
+// Time on task is measured from these pings; hidden tabs stay quiet so idle time isn't counted
+setInterval(function() {
+    if (!currentToken || !currentSessionId || document.visibilityState !== 'visible') return;
+    apiFetch(`${API_BASE_URL}/sessions/${currentSessionId}/heartbeat`, {
+        method: 'POST',
+        headers: {
+            'Authorization': `Bearer ${currentToken}`
+        }
+    }).catch(error => console.error('Heartbeat error:', error));
+}, 30000);
+
 // Make functions globally available
 window.sendMessage = sendMessage;
 window.startLanguagePractice = startLanguagePractice;
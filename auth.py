@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
-from typing import Optional
-import base64, json, hmac, hashlib, time
+from typing import Dict, Optional, Tuple
+import base64, json, hmac, hashlib, time, uuid
 
 # Minimal HS256-only JWT implementation (no external JWT lib required for dev)
 class JWTError(Exception):
@@ -13,32 +13,58 @@ def _b64url_decode(s: str) -> bytes:
     padding = '=' * (-len(s) % 4)
     return base64.urlsafe_b64decode(s + padding)
 
+_JWT_HEADER = _b64url_encode(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode())
+
 class _JWT:
-    @staticmethod
-    def encode(payload, key, algorithm='HS256'):
-        header = {"alg": "HS256", "typ": "JWT"}
+    """
+    HS256 encode/decode on the hot path of every request and token refresh.
+
+    The header segment is the same for every token, so it is encoded once.
+    The HMAC key schedule is computed once per key and copied for each
+    signature instead of being rebuilt from the raw key.
+    """
+
+    def __init__(self):
+        self._macs: Dict[str, "hmac.HMAC"] = {}
+
+    def _sign(self, signing_input: bytes, key: str) -> bytes:
+        mac = self._macs.get(key)
+        if mac is None:
+            mac = self._macs[key] = hmac.new(key.encode(), digestmod=hashlib.sha256)
+        mac = mac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, payload, key, algorithm='HS256'):
+        if algorithm != "HS256":
+            raise JWTError(f"Unsupported algorithm: {algorithm}")
         payload_copy = payload.copy()
         # Normalize datetime -> int timestamp
         if isinstance(payload_copy.get("exp"), datetime):
             payload_copy["exp"] = int(payload_copy["exp"].timestamp())
-        header_b = _b64url_encode(json.dumps(header, separators=(",",":")).encode())
         payload_b = _b64url_encode(json.dumps(payload_copy, default=str, separators=(",",":")).encode())
-        signing_input = f"{header_b}.{payload_b}".encode()
-        sig = hmac.new(key.encode(), signing_input, hashlib.sha256).digest()
-        sig_b = _b64url_encode(sig)
-        return f"{header_b}.{payload_b}.{sig_b}"
+        signing_input = f"{_JWT_HEADER}.{payload_b}"
+        sig_b = _b64url_encode(self._sign(signing_input.encode(), key))
+        return f"{signing_input}.{sig_b}"
 
-    @staticmethod
-    def decode(token, key, algorithms=None):
+    def decode(self, token, key, algorithms=None):
         try:
-            header_b, payload_b, sig_b = token.split('.')
+            signing_input, sig_b = token.rsplit('.', 1)
+            header_b, payload_b = signing_input.split('.')
+            # Tokens we minted carry the precomputed header; anything else must still be HS256
+            if header_b != _JWT_HEADER and json.loads(_b64url_decode(header_b)).get("alg") != "HS256":
+                raise JWTError("Unsupported algorithm")
+            signature = _b64url_decode(sig_b)
+        except JWTError:
+            raise
         except Exception:
             raise JWTError("Invalid token format")
-        signing_input = f"{header_b}.{payload_b}".encode()
-        expected_sig = hmac.new(key.encode(), signing_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(expected_sig, _b64url_decode(sig_b)):
+        if not hmac.compare_digest(self._sign(signing_input.encode(), key), signature):
             raise JWTError("Signature verification failed")
-        payload_json = json.loads(_b64url_decode(payload_b))
+        try:
+            payload_json = json.loads(_b64url_decode(payload_b))
+        except Exception:
+            raise JWTError("Invalid token payload")
         exp = payload_json.get("exp")
         if exp and int(time.time()) > int(exp):
             raise JWTError("Token expired")
@@ -49,20 +75,79 @@ jwt = _JWT()
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from config import settings
-from database import get_db
+from database import get_async_db, read_router
 from user import User
+from services.metrics import metrics
+from services.password_hasher import PasswordHasher, PasswordHasherBusy
+from services.principal_cache import PrincipalCache, UserPrincipal
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pinning min/max rounds to the configured cost makes verify_and_update
+# report a new hash whenever BCRYPT_ROUNDS changes, in either direction.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS
+)
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_QUEUE
+)
+metrics.register_gauge("password_hash_inflight", lambda: password_hasher.inflight)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+principal_cache = PrincipalCache(
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    max_entries=settings.PRINCIPAL_CACHE_SIZE
+)
+metrics.register_gauge("principal_cache", principal_cache.stats)
+metrics.register_gauge("read_router", read_router.stats)
+
+# Identity columns carried by UserPrincipal; changes to anything else (XP,
+# streaks, stats) don't invalidate cached principals.
+_PRINCIPAL_COLUMNS = UserPrincipal._fields
+
+@event.listens_for(User, "after_update")
+def _invalidate_principal_on_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _PRINCIPAL_COLUMNS):
+        principal_cache.invalidate_user(target.id)
+
+@event.listens_for(User, "after_delete")
+def _invalidate_principal_on_delete(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many sign-in attempts right now, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify on the hashing pool; returns ``(ok, new_hash)`` where ``new_hash`` should replace a stale hash."""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+async def get_password_hash_async(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -70,33 +155,70 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    # Token id: lets cached principals be keyed (and revoked) per token
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> Tuple[int, Optional[str]]:
+    """Verify a bearer token and return ``(user_id, token_id)``."""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
 
     sub = payload.get("sub")
     if sub is None:
-        raise credentials_exception
+        raise _credentials_exception()
 
     try:
-        user_id = int(sub)
+        return int(sub), payload.get("jti")
     except (TypeError, ValueError):
-        raise credentials_exception
+        raise _credentials_exception()
 
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """Full ORM user for endpoints that read or modify the user row."""
+    user_id, _ = _decode_token(token)
+    user = (await db.execute(select(User).where(User.id == user_id))).scalar_one_or_none()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> UserPrincipal:
+    """Cached, read-only identity for endpoints that only need to know who is calling."""
+    user_id, token_id = _decode_token(token)
+    principal = principal_cache.get(user_id, token_id)
+    if principal is not None:
+        return principal
+
+    row = (await db.execute(select(User.id, User.email, User.name).where(User.id == user_id))).first()
+    if row is None:
+        raise _credentials_exception()
+    principal = UserPrincipal(id=row.id, email=row.email, name=row.name)
+    principal_cache.put(token_id, principal)
+    return principal
+
+async def get_read_db(
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Session for read-only endpoints: a replica, or the request's primary session right after the caller wrote."""
+    replica = read_router.replica(current_user.id)
+    if replica is None:
+        yield db
+        return
+    async with replica() as replica_db:
+        yield replica_db
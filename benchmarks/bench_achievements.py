@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Queries per chat message spent on XP and achievements: legacy loop vs catalog.
+
+Usage:
+    python benchmarks/bench_achievements.py [--achievements 30] [--messages 500]
+
+Seeds a throwaway SQLite database with a catalog spread over the streak,
+quiz-count and XP criteria, then awards chat XP ``--messages`` times to a
+fresh user with each implementation. The legacy ``award_xp`` and
+``check_achievements`` are copied below. Reports SQL statements and
+commits per message and checks that both implementations grant the same
+badges.
+
+The catalog implementation only looks at XP thresholds crossed by each
+award. Streak and quiz badges are checked where those stats change.
+The XP ledger's write-behind buffer is turned off so every award is folded
+inside its own request, as the legacy code did.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+
+from database import Base  # noqa: E402
+import user, session  # noqa: E402,F401  (register all mappers)
+from models.user import User  # noqa: E402
+from models.gamification import Achievement, UserAchievement  # noqa: E402
+from config import settings  # noqa: E402
+from gamification_service import GamificationService, achievement_catalog  # noqa: E402
+
+XP_PER_MESSAGE = 10
+
+
+class LegacyGamificationService:
+    @staticmethod
+    def award_xp(db: Session, user_id: int, xp_amount: int, action_type: str) -> int:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return 0
+        user.total_xp += xp_amount  # type: ignore
+        user.total_points += xp_amount  # type: ignore
+        user.current_level = (user.total_xp // 1000) + 1  # type: ignore
+        db.commit()
+        LegacyGamificationService.check_achievements(db, user)
+        return xp_amount
+
+    @staticmethod
+    def check_achievements(db: Session, user: User):
+        achievements = db.query(Achievement).all()
+        for achievement in achievements:
+            existing = db.query(UserAchievement).filter(
+                UserAchievement.user_id == user.id,
+                UserAchievement.achievement_id == achievement.id
+            ).first()
+            if existing:
+                continue
+            earned = False
+            if achievement.criteria_type == 'streak' and user.current_streak >= achievement.criteria_value:  # type: ignore
+                earned = True
+            elif achievement.criteria_type == 'quiz_count' and user.quizzes_completed >= achievement.criteria_value:  # type: ignore
+                earned = True
+            elif achievement.criteria_type == 'xp' and user.total_xp >= achievement.criteria_value:  # type: ignore
+                earned = True
+            if earned:
+                db.add(UserAchievement(user_id=user.id, achievement_id=achievement.id))  # type: ignore
+                user.badges_earned += 1  # type: ignore
+                user.total_xp += achievement.xp_reward  # type: ignore
+                db.commit()
+
+
+def seed(SessionLocal, achievements: int):
+    db = SessionLocal()
+    kinds = ["xp", "streak", "quiz_count"]
+    for i in range(achievements):
+        kind = kinds[i % 3]
+        value = {"xp": 250 * (i // 3 + 1), "streak": i // 3 + 1, "quiz_count": 5 * (i // 3 + 1)}[kind]
+        db.add(Achievement(name=f"{kind}-{value}", criteria_type=kind, criteria_value=value, xp_reward=50))
+    db.commit()
+    db.close()
+
+
+def run(name, service, SessionLocal, counters, messages):
+    db = SessionLocal()
+    student = User(email=f"{name}@example.com", name=name, hashed_password="x",
+                   total_xp=0, total_points=0, current_streak=0, quizzes_completed=0, badges_earned=0)
+    db.add(student)
+    db.commit()
+    user_id = student.id
+    db.close()
+
+    counters.update(statements=0, commits=0)
+    start = time.perf_counter()
+    for _ in range(messages):
+        # A fresh session per message, like a request
+        db = SessionLocal()
+        service.award_xp(db, user_id, XP_PER_MESSAGE, "chat")
+        db.commit()
+        db.close()
+    elapsed = time.perf_counter() - start
+
+    db = SessionLocal()
+    granted = sorted(a for (a,) in db.query(UserAchievement.achievement_id).filter(UserAchievement.user_id == user_id))
+    final = db.query(User).filter(User.id == user_id).one()
+    print(
+        f"{name:<8} statements/msg={counters['statements'] / messages:>6.2f}  "
+        f"commits/msg={counters['commits'] / messages:>5.2f}  "
+        f"ms/msg={elapsed / messages * 1000:>6.2f}  badges={len(granted)}  total_xp={final.total_xp}"
+    )
+    db.close()
+    return granted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--achievements", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+    settings.XP_LEDGER_WRITE_BEHIND = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(bind=engine, autoflush=False)
+        counters = {"statements": 0, "commits": 0}
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count_statement(*args):
+            counters["statements"] += 1
+
+        @event.listens_for(engine, "commit")
+        def count_commit(*args):
+            counters["commits"] += 1
+
+        seed(SessionLocal, args.achievements)
+        print(f"{args.achievements} achievements, {args.messages} chat messages of {XP_PER_MESSAGE} XP\n")
+
+        legacy = run("legacy", LegacyGamificationService, SessionLocal, counters, args.messages)
+        achievement_catalog.invalidate()
+        current = run("catalog", GamificationService, SessionLocal, counters, args.messages)
+        assert legacy == current, "implementations granted different badges"
+        print("\nsame badges granted: yes")
+
+
+if __name__ == "__main__":
+    main()
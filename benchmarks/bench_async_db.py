@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Request throughput under concurrency: sync Session vs AsyncSession handlers.
+
+Usage:
+    python benchmarks/bench_async_db.py [--requests 600] [--concurrency 32] [--latency-ms 2] [--writes 0.2]
+
+Seeds a throwaway SQLite database and sends ``--requests`` requests,
+``--concurrency`` at a time. A ``--writes`` fraction of them record chat XP,
+the rest read the user's sessions. The "sync" handlers are copies of the previous
+``async def`` routes that used ``get_db``. The "async" ones are the real
+``/user/sessions`` route and ``GamificationService.record_activity_async`` on
+``get_async_db``. Reports requests per second, latency percentiles, and the
+latency of a ``/ping`` probe. The sync pool holds a connection for every
+concurrent request; with fewer, the sync handlers deadlock (see
+``make_app``).
+
+``--latency-ms`` adds a server round trip to every SQL statement, since
+SQLite answers in microseconds and Postgres doesn't. The driver sleeps in
+the thread that runs the statement. With the sync driver that thread is the
+event loop, and every other request waits. With aiosqlite it is the
+driver's own thread.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Depends, FastAPI  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+import httpx  # noqa: E402
+
+from config import settings  # noqa: E402
+from database import Base, get_async_db, get_db  # noqa: E402
+import user, session, gamification  # noqa: E402,F401  (register all mappers)
+from models.user import User  # noqa: E402
+from models.session import StudySession  # noqa: E402
+from gamification_service import GamificationService  # noqa: E402
+from services.daily_activity import daily_rollover  # noqa: E402
+from services.leaderboard import leaderboards  # noqa: E402
+from utils.auth import UserPrincipal, create_access_token, get_current_principal  # noqa: E402
+import progress  # noqa: E402
+
+
+def make_app(db_path: str, latency: float, pool_size: int, concurrency: int):
+    # A sync handler that finds the pool empty blocks the event loop in
+    # checkout, so the requests holding connections can't finish and return
+    # them. Size the sync pool so the "before" run measures speed, not that.
+    engine = create_engine(
+        f"sqlite:///{db_path}", connect_args={"check_same_thread": False}, pool_size=concurrency + 1, max_overflow=0
+    )
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}", pool_size=pool_size, max_overflow=0, connect_args={"timeout": 30}
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    def round_trip(statement):
+        time.sleep(latency)
+
+    if latency:
+        @event.listens_for(engine, "connect")
+        def slow_sync(dbapi_connection, record):
+            dbapi_connection.set_trace_callback(round_trip)
+
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def slow_async(dbapi_connection, record):
+            dbapi_connection.run_async(lambda connection: connection.set_trace_callback(round_trip))
+
+    def override_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(progress.router, prefix="/api")
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_async_db] = override_async_db
+    for service in (leaderboards, daily_rollover):
+        service.session_factory = SessionLocal
+
+    @app.get("/sync/user/sessions")
+    async def sync_sessions(
+        current_user: UserPrincipal = Depends(get_current_principal),
+        db: Session = Depends(get_db)
+    ):
+        # Previous behaviour: sync Session inside an async handler
+        sessions = db.query(StudySession).filter(
+            StudySession.user_id == current_user.id
+        ).order_by(StudySession.start_time.desc()).limit(20).all()
+        return [{"id": s.id, "start_time": s.start_time.isoformat(), "xp_earned": s.xp_earned} for s in sessions]
+
+    @app.post("/sync/activity")
+    async def sync_activity(
+        current_user: UserPrincipal = Depends(get_current_principal),
+        db: Session = Depends(get_db)
+    ):
+        result = GamificationService.record_activity(db, current_user.id, settings.XP_PER_CHAT, "chat")
+        db.commit()
+        return {"xp_earned": result.xp_earned}
+
+    @app.post("/async/activity")
+    async def async_activity(
+        current_user: UserPrincipal = Depends(get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+    ):
+        result = await GamificationService.record_activity_async(db, current_user.id, settings.XP_PER_CHAT, "chat")
+        await db.commit()
+        return {"xp_earned": result.xp_earned}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app, SessionLocal
+
+
+def seed(SessionLocal, users: int):
+    db = SessionLocal()
+    rows = [User(email=f"student{i}@example.com", name=f"student{i}", hashed_password="x") for i in range(users)]
+    db.add_all(rows)
+    db.flush()
+    for row in rows:
+        for _ in range(5):
+            db.add(StudySession(user_id=row.id, session_type="chat"))
+    db.commit()
+    tokens = [create_access_token({"sub": str(row.id)}) for row in rows]
+    db.close()
+    return tokens
+
+
+async def load(app: FastAPI, prefix: str, tokens, requests: int, concurrency: int, writes: float):
+    paths = {
+        "sync": ("/sync/user/sessions", "/sync/activity"),
+        "async": ("/api/user/sessions", "/async/activity"),
+    }[prefix]
+    rng = random.Random(7)
+    plan = [(rng.random() < writes, tokens[i % len(tokens)]) for i in range(requests)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        # Warm the principal cache and the leaderboard so both runs start equal
+        for token in tokens:
+            await client.get(paths[0], headers={"Authorization": f"Bearer {token}"})
+        done = asyncio.Event()
+        probes = []
+        latencies = []
+        queue = list(reversed(plan))
+
+        async def probe():
+            due = time.perf_counter()
+            while not done.is_set():
+                await client.get("/ping")
+                probes.append(time.perf_counter() - due)
+                due = time.perf_counter() + 0.01
+                await asyncio.sleep(0.01)
+
+        async def worker():
+            while queue:
+                write, token = queue.pop()
+                headers = {"Authorization": f"Bearer {token}"}
+                start = time.perf_counter()
+                if write:
+                    response = await client.post(paths[1], headers=headers)
+                else:
+                    response = await client.get(paths[0], headers=headers)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+    return latencies, probes, elapsed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(name, latencies, probes, elapsed):
+    print(
+        f"{name:<6} req/s={len(latencies) / elapsed:>7.0f}  "
+        f"p50={statistics.median(latencies) * 1000:>7.1f}ms  p99={percentile(latencies, 0.99) * 1000:>7.1f}ms  "
+        f"ping p99={percentile(probes, 0.99) * 1000:>7.1f}ms  wall={elapsed:>5.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--pool-size", type=int, default=10, help="async engine connections")
+    parser.add_argument("--writes", type=float, default=0.2, help="fraction of requests that record XP")
+    args = parser.parse_args()
+
+    # Fold every award in its request, so writes do their full work in both runs
+    settings.XP_LEDGER_WRITE_BEHIND = False
+    print(
+        f"{args.requests} requests ({args.writes:.0%} writes), concurrency={args.concurrency}, "
+        f"+{args.latency_ms}ms per statement, async pool={args.pool_size}\n"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app, SessionLocal = make_app(
+            os.path.join(tmp, "bench.db"), args.latency_ms / 1000, args.pool_size, args.concurrency
+        )
+        tokens = seed(SessionLocal, args.users)
+        for name in ("sync", "async"):
+            report(name, *asyncio.run(load(app, name, tokens, args.requests, args.concurrency, args.writes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+JWT encode/decode throughput: current ``auth._JWT`` vs the previous implementation.
+
+Usage:
+    python benchmarks/bench_jwt.py [--iterations 100000]
+
+The previous implementation is copied below verbatim, so the comparison
+keeps working after ``auth.py`` changes. Both sign the same payloads with
+the same key and must produce identical tokens.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import _JWT  # noqa: E402
+
+KEY = "bench-secret-key-0123456789abcdef0123456789abcdef"
+
+
+def _b64url_encode(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode('ascii')
+
+
+def _b64url_decode(s: str) -> bytes:
+    padding = '=' * (-len(s) % 4)
+    return base64.urlsafe_b64decode(s + padding)
+
+
+class LegacyJWT:
+    @staticmethod
+    def encode(payload, key, algorithm='HS256'):
+        header = {"alg": "HS256", "typ": "JWT"}
+        payload_copy = payload.copy()
+        if isinstance(payload_copy.get("exp"), datetime):
+            payload_copy["exp"] = int(payload_copy["exp"].timestamp())
+        header_b = _b64url_encode(json.dumps(header, separators=(",", ":")).encode())
+        payload_b = _b64url_encode(json.dumps(payload_copy, default=str, separators=(",", ":")).encode())
+        signing_input = f"{header_b}.{payload_b}".encode()
+        sig = hmac.new(key.encode(), signing_input, hashlib.sha256).digest()
+        sig_b = _b64url_encode(sig)
+        return f"{header_b}.{payload_b}.{sig_b}"
+
+    @staticmethod
+    def decode(token, key, algorithms=None):
+        header_b, payload_b, sig_b = token.split('.')
+        signing_input = f"{header_b}.{payload_b}".encode()
+        expected_sig = hmac.new(key.encode(), signing_input, hashlib.sha256).digest()
+        if not hmac.compare_digest(expected_sig, _b64url_decode(sig_b)):
+            raise ValueError("Signature verification failed")
+        payload_json = json.loads(_b64url_decode(payload_b))
+        exp = payload_json.get("exp")
+        if exp and int(time.time()) > int(exp):
+            raise ValueError("Token expired")
+        return payload_json
+
+
+def bench(name, impl, payloads, iterations):
+    start = time.perf_counter()
+    tokens = [impl.encode(payloads[i % len(payloads)], KEY) for i in range(iterations)]
+    encode_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for token in tokens:
+        impl.decode(token, KEY)
+    decode_s = time.perf_counter() - start
+
+    print(
+        f"{name:<10} encode={iterations / encode_s:>9.0f}/s ({encode_s / iterations * 1e6:5.2f}us)  "
+        f"decode={iterations / decode_s:>9.0f}/s ({decode_s / iterations * 1e6:5.2f}us)"
+    )
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    exp = datetime.utcnow() + timedelta(minutes=30)
+    payloads = [{"sub": str(i), "exp": exp, "jti": f"{i:032x}"} for i in range(1000)]
+
+    legacy = bench("legacy", LegacyJWT, payloads, args.iterations)
+    current = bench("current", _JWT(), payloads, args.iterations)
+    assert legacy == current, "token bytes differ between implementations"
+    print("\ntokens identical: yes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Leaderboard queries at scale: in-memory order statistics vs sorting per query.
+
+Usage:
+    python benchmarks/bench_leaderboard.py [--users 1000000] [--ops 20000] [--naive 5]
+
+Builds a board of ``--users`` users with random XP and times the load, then
+``--ops`` each of XP updates, "my rank", top-10 and "around me" (radius 5)
+queries. ``--naive`` "my rank" lookups that sort all scores, which is what
+``ORDER BY total_xp`` does on every profile view, are timed for comparison.
+Ranks are cross-checked against a brute-force count. No database is needed.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.leaderboard import Leaderboard  # noqa: E402
+
+
+def timed(label: str, ops: int, fn) -> None:
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {ops:>7} ops  {elapsed / ops * 1e6:>10.1f} us/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--naive", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    scores = {user_id: int(rng.paretovariate(1.2) * 100) for user_id in range(1, args.users + 1)}
+    user_ids = list(scores)
+
+    start = time.perf_counter()
+    board = Leaderboard(scores)
+    print(f"load           {args.users:>7} users {time.perf_counter() - start:>9.2f} s\n")
+
+    timed("update", args.ops, lambda: board.add(rng.choice(user_ids), rng.randint(5, 50)))
+    timed("my rank", args.ops, lambda: board.rank(rng.choice(user_ids)))
+    timed("top 10", args.ops, lambda: board.top(10))
+    timed("around me", args.ops, lambda: board.around(rng.choice(user_ids), 5))
+
+    def naive_rank():
+        user_id = rng.choice(user_ids)
+        ordered = sorted(user_ids, key=lambda uid: (-board.score(uid), uid))
+        ahead = next(i for i, uid in enumerate(ordered) if board.score(uid) == board.score(user_id))
+        return ahead + 1
+
+    timed("naive rank", args.naive, naive_rank)
+
+    for user_id in rng.sample(user_ids, 3):
+        expected = 1 + sum(1 for uid in user_ids if board.score(uid) > board.score(user_id))
+        assert board.rank(user_id) == expected, (user_id, board.rank(user_id), expected)
+    top = board.top(10)
+    assert [e.score for e in top] == sorted((board.score(uid) for uid in user_ids), reverse=True)[:10]
+    print("\nranks match brute force: yes")
+
+
+if __name__ == "__main__":
+    main()
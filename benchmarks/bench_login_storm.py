@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Login storm: latency of an unrelated endpoint while many users sign in at once.
+
+Usage:
+    python benchmarks/bench_login_storm.py [--logins 64] [--rounds 12]
+
+Runs the real /login route (bcrypt on the bounded hashing pool) and a copy
+of the previous handler that verified inline on the event loop, each against
+a throwaway SQLite database, while a probe hits /ping every 10ms. Reports
+probe latency percentiles, login wall time and how many logins were turned
+away with 429.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Depends, FastAPI, HTTPException  # noqa: E402
+from fastapi.security import OAuth2PasswordRequestForm  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+import httpx  # noqa: E402
+
+from config import settings  # noqa: E402
+from database import Base, get_async_db, get_db  # noqa: E402
+import user, session, gamification  # noqa: E402,F401  (register all mappers)
+from models.user import User  # noqa: E402
+import auth  # noqa: E402
+import routes_auth  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def make_app(db_path: str) -> FastAPI:
+    # No pool limit: the storm should queue on bcrypt, not on connections
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False}, poolclass=NullPool)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    def override_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(routes_auth.router, prefix="/api/auth")
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_async_db] = override_async_db
+
+    @app.post("/api/auth/legacy-login")
+    async def legacy_login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+        # Previous behaviour: bcrypt inline on the event loop
+        found = db.query(User).filter(User.email == form_data.username).first()
+        if not found or not auth.verify_password(form_data.password, str(found.hashed_password)):
+            raise HTTPException(status_code=401)
+        return {"ok": True}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    db = SessionLocal()
+    hashed = auth.get_password_hash(PASSWORD)
+    for i in range(8):
+        db.add(User(email=f"student{i}@example.com", name=f"student{i}", hashed_password=hashed))
+    db.commit()
+    db.close()
+    return app
+
+
+async def storm(app: FastAPI, path: str, logins: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/ping")
+        done = asyncio.Event()
+        probes = []
+
+        async def probe():
+            # Measured from when the probe was due, so time spent waiting on
+            # a blocked event loop counts against it
+            due = time.perf_counter()
+            while not done.is_set():
+                await client.get("/ping")
+                probes.append(time.perf_counter() - due)
+                due = time.perf_counter() + 0.01
+                await asyncio.sleep(0.01)
+
+        async def login(i):
+            form = {"username": f"student{i % 8}@example.com", "password": PASSWORD}
+            response = await client.post(path, data=form)
+            return response.status_code
+
+        probe_task = asyncio.create_task(probe())
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        codes = await asyncio.gather(*(login(i) for i in range(logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+    return probes, codes, elapsed
+
+
+def report(name, probes, codes, elapsed):
+    ordered = sorted(probes)
+    p50 = statistics.median(ordered)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{name:<24} probes={len(ordered):>4}  "
+        f"ping p50={p50 * 1000:>7.1f}ms  p99={p99 * 1000:>7.1f}ms  max={ordered[-1] * 1000:>7.1f}ms  "
+        f"logins={codes.count(200):>3} ok / {codes.count(429):>3} 429  wall={elapsed:>5.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=settings.BCRYPT_ROUNDS)
+    args = parser.parse_args()
+
+    settings.BCRYPT_ROUNDS = args.rounds
+    auth.pwd_context.update(
+        bcrypt__default_rounds=args.rounds, bcrypt__min_rounds=args.rounds, bcrypt__max_rounds=args.rounds
+    )
+    print(
+        f"{args.logins} concurrent logins, bcrypt rounds={args.rounds}, "
+        f"pool={auth.password_hasher.max_workers} workers + {auth.password_hasher.max_pending} queued\n"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+        report("inline (legacy)", *asyncio.run(storm(app, "/api/auth/legacy-login", args.logins)))
+        report("hashing pool", *asyncio.run(storm(app, "/api/auth/login", args.logins)))
+    auth.password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
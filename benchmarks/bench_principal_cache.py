@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+DB round-trips per authenticated request: ORM user lookup vs cached principal.
+
+Usage:
+    python benchmarks/bench_principal_cache.py [--users 50] [--requests 2000]
+
+Signs a token for each of ``--users`` users and spreads ``--requests``
+requests over them. One endpoint depends on ``get_current_user`` and the
+other on ``get_current_principal``. Every SQL statement on the throwaway
+SQLite database is counted. Halfway through, one user is renamed, to show
+that invalidation costs exactly one extra lookup.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Depends, FastAPI  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+import httpx  # noqa: E402
+
+from database import Base, get_async_db  # noqa: E402
+import user, session, gamification  # noqa: E402,F401  (register all mappers)
+from models.user import User  # noqa: E402
+import auth  # noqa: E402
+
+
+def make_app(db_path: str):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    statements = {"count": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def count(*args):
+        statements["count"] += 1
+
+    async def override_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.dependency_overrides[get_async_db] = override_db
+
+    @app.get("/whoami/user")
+    async def whoami_user(current_user: User = Depends(auth.get_current_user)):
+        return {"id": current_user.id, "name": current_user.name}
+
+    @app.get("/whoami/principal")
+    async def whoami_principal(current_user: auth.UserPrincipal = Depends(auth.get_current_principal)):
+        return {"id": current_user.id, "name": current_user.name}
+
+    return app, SessionLocal, statements
+
+
+async def run(app, path, tokens, requests, on_halfway=None):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        for i in range(requests):
+            if i == requests // 2 and on_halfway:
+                on_halfway()
+            response = await client.get(path, headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"})
+            response.raise_for_status()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app, SessionLocal, statements = make_app(os.path.join(tmp, "bench.db"))
+        db = SessionLocal()
+        users = [User(email=f"s{i}@example.com", name=f"s{i}", hashed_password="x") for i in range(args.users)]
+        db.add_all(users)
+        db.commit()
+        tokens = [auth.create_access_token({"sub": str(u.id)}) for u in users]
+        first_id = users[0].id
+        db.close()
+
+        def rename():
+            db = SessionLocal()
+            db.query(User).filter(User.id == first_id).one().name = "renamed"  # type: ignore
+            db.commit()
+            db.close()
+
+        for name, path, halfway in (
+            ("get_current_user", "/whoami/user", None),
+            ("get_current_principal", "/whoami/principal", rename),
+        ):
+            statements["count"] = 0
+            elapsed = asyncio.run(run(app, path, tokens, args.requests, halfway))
+            queries = statements["count"] - (2 if halfway else 0)  # the rename's SELECT + UPDATE
+            print(
+                f"{name:<24} queries={queries:>6}  queries/request={queries / args.requests:>5.3f}  "
+                f"req/s={args.requests / elapsed:>7.0f}"
+            )
+        print(f"\nprincipal cache: {auth.principal_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Quiz submissions per second: per-question ORM grading vs set-based grading.
+
+Usage:
+    python benchmarks/bench_quiz_submit.py [--quizzes 300] [--questions 20] [--latency-ms 1]
+
+Seeds a throwaway SQLite database with ``--quizzes`` generated quizzes of
+``--questions`` questions each, stored by ``services.quizzes.create_quiz``.
+Each run grades every quiz, one transaction per submission:
+
+- ``orm``: the usual ORM approach. Load the quiz and its questions, set
+  ``user_answer``/``is_correct`` on each, count in Python, update the
+  quiz and the user, and flush.
+- ``bulk``: ``services.quizzes.grade_quiz``.
+
+Reports submissions per second and statements executed per submission,
+counting each row of an ``executemany`` and the ``BEGIN``/``COMMIT``.
+``--latency-ms`` adds a server round trip to each of them, since SQLite
+answers in microseconds and a networked database doesn't.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import Session, selectinload, sessionmaker  # noqa: E402
+
+from database import Base, configure_sqlite  # noqa: E402
+import user, session, gamification  # noqa: E402,F401  (register all mappers)
+from models.user import User  # noqa: E402
+from models.session import Quiz, StudySession  # noqa: E402
+from services.quizzes import create_quiz, grade_quiz  # noqa: E402
+
+
+def grade_quiz_orm(db: Session, user_id: int, quiz_id: int, answers) -> float:
+    quiz = db.query(Quiz).options(selectinload(Quiz.questions)).filter(Quiz.id == quiz_id).one()
+    correct = 0
+    for question in quiz.questions:
+        question.user_answer = answers.get(question.id)
+        question.is_correct = question.user_answer == question.correct_answer
+        correct += question.is_correct
+    quiz.completed = True
+    quiz.correct_answers = correct
+    quiz.total_questions = len(quiz.questions)
+    quiz.score = correct * 100.0 / len(quiz.questions)
+    account = db.get(User, user_id)
+    done = account.quizzes_completed or 0
+    account.quiz_accuracy = ((account.quiz_accuracy or 0) * done + quiz.score) / (done + 1)
+    account.quizzes_completed = done + 1
+    db.flush()
+    return quiz.score
+
+
+def make_engine(db_path: str, latency: float):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    configure_sqlite(engine)
+    statements = [0]
+
+    def round_trip(statement):
+        statements[0] += 1
+        if latency:
+            time.sleep(latency)
+
+    @event.listens_for(engine, "connect")
+    def trace(dbapi_connection, record):
+        dbapi_connection.set_trace_callback(round_trip)
+
+    return engine, statements
+
+
+def seed(engine, quizzes: int, questions: int):
+    Base.metadata.create_all(bind=engine)
+    db = Session(engine)
+    account = User(email="student@example.com", name="student", hashed_password="x")
+    db.add(account)
+    db.flush()
+    study = StudySession(user_id=account.id, session_type="upload")
+    db.add(study)
+    db.flush()
+    rng = random.Random(7)
+    plan = []
+    for _ in range(quizzes):
+        quiz_id, question_ids = create_quiz(db, study.id, [
+            {
+                "question": f"Question {i}", "option_a": "a", "option_b": "b", "option_c": "c", "option_d": "d",
+                "correct": f"Option {rng.choice('ABCD')}",
+            }
+            for i in range(questions)
+        ])
+        plan.append((quiz_id, {qid: f"Option {rng.choice('ABCD')}" for qid in question_ids}))
+    user_id = account.id
+    db.commit()
+    db.close()
+    return user_id, plan
+
+
+def run(engine, statements, user_id, plan, grade):
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    statements[0] = 0
+    start = time.perf_counter()
+    for quiz_id, answers in plan:
+        db = SessionLocal()
+        grade(db, user_id, quiz_id, answers)
+        db.commit()
+        db.close()
+    return len(plan) / (time.perf_counter() - start), statements[0] / len(plan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quizzes", type=int, default=300)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{args.quizzes} submissions of {args.questions} questions, +{args.latency_ms}ms per statement\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, grade in (("orm", grade_quiz_orm), ("bulk", grade_quiz)):
+            db_path = os.path.join(tmp, f"{name}.db")
+            engine, statements = make_engine(db_path, 0)
+            user_id, plan = seed(engine, args.quizzes, args.questions)
+            engine.dispose()
+            engine, statements = make_engine(db_path, args.latency_ms / 1000)
+            rate, per = run(engine, statements, user_id, plan, grade)
+            print(f"{name:<5} {rate:>7.0f} submissions/s  {per:>5.1f} statements/submission")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Compare the structured splitter against langchain's RecursiveCharacterTextSplitter.
+
+Usage:
+    python benchmarks/bench_splitter.py [--pages 400] [--repeat 3]
+
+Reports chunks/sec, MB/sec and total chunk count for each splitter on a
+synthetic textbook-like document (headings, paragraphs, form-feed pages).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.text_splitter import StructuredTextSplitter, count_tokens  # noqa: E402
+
+WORDS = (
+    "cell membrane protein energy enzyme reaction gradient transport diffusion "
+    "osmosis nucleus ribosome synthesis molecule structure function organism "
+    "photosynthesis respiration glucose oxygen carbon water light chlorophyll"
+).split()
+
+
+def make_document(pages: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    out = []
+    for page in range(pages):
+        blocks = []
+        if page % 6 == 0:
+            blocks.append(f"Chapter {page // 6 + 1}")
+        if page % 2 == 0:
+            blocks.append(f"{page // 6 + 1}.{page % 6 + 1} {rng.choice(WORDS).title()} and {rng.choice(WORDS)}")
+        for _ in range(rng.randint(3, 7)):
+            sentences = []
+            for _ in range(rng.randint(2, 8)):
+                words = [rng.choice(WORDS) for _ in range(rng.randint(6, 22))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            blocks.append(" ".join(sentences))
+        out.append("\n\n".join(blocks))
+    return "\f".join(out)
+
+
+def bench(name, split, text, repeat):
+    best = None
+    chunks = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = split(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tokens = [count_tokens(c) for c in chunks]
+    print(
+        f"{name:<28} chunks={len(chunks):>6}  "
+        f"avg_tokens={sum(tokens) / max(1, len(tokens)):>6.1f}  "
+        f"embedded_tokens={sum(tokens):>8}  "
+        f"time={best * 1000:>8.1f}ms  "
+        f"chunks/s={len(chunks) / best:>9.0f}  "
+        f"MB/s={len(text) / best / 1e6:>6.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = make_document(args.pages)
+    print(f"document: {args.pages} pages, {len(text) / 1e6:.2f} MB, {count_tokens(text)} tokens\n")
+
+    structured = StructuredTextSplitter(chunk_tokens=256, min_chunk_tokens=64)
+    bench("structured (256 tok)", lambda t: structured.split_text(t), text, args.repeat)
+
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        print("langchain not installed; skipping RecursiveCharacterTextSplitter")
+        return
+    recursive = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    bench("recursive (1000c / 200c)", recursive.split_text, text, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
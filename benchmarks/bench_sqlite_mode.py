@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+Mixed read/write load on SQLite: default settings vs SQLite mode.
+
+Usage:
+    python benchmarks/bench_sqlite_mode.py [--requests 2000] [--concurrency 32] [--writes 0.3]
+
+Seeds a throwaway SQLite file and sends ``--requests`` requests,
+``--concurrency`` at a time. A ``--writes`` fraction of them record chat XP
+through ``GamificationService.record_activity``. The rest read the user's
+sessions through the real ``/user/sessions`` route. Runs twice, each on a
+fresh copy of the database:
+
+- ``default``: the driver's defaults (rollback journal, no pragmas), and
+  every write commits on its request's own connection.
+- ``sqlite``: ``configure_sqlite`` pragmas (WAL, synchronous=NORMAL,
+  busy_timeout, mmap, cache), and writes go through a ``WriteQueue``.
+
+Reports requests per second, latency percentiles, and how many requests
+failed with "database is locked". In the ``sqlite`` run it also reports the
+number of write batches the queue committed.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Depends, FastAPI  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+import httpx  # noqa: E402
+
+from config import settings  # noqa: E402
+from database import Base, configure_sqlite, get_async_db, get_db  # noqa: E402
+import user, session, gamification  # noqa: E402,F401  (register all mappers)
+from models.user import User  # noqa: E402
+from models.session import StudySession  # noqa: E402
+from gamification_service import GamificationService  # noqa: E402
+from services.daily_activity import daily_rollover  # noqa: E402
+from services.leaderboard import leaderboards  # noqa: E402
+from services.write_queue import WriteQueue  # noqa: E402
+from utils.auth import UserPrincipal, create_access_token, get_current_principal  # noqa: E402
+import progress  # noqa: E402
+
+
+def make_app(db_path: str, tuned: bool, pool_size: int, batch: int):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", pool_size=pool_size, max_overflow=0)
+    if tuned:
+        configure_sqlite(engine)
+        configure_sqlite(async_engine)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    queue = WriteQueue(engine=engine, enabled=tuned, max_batch=batch)
+
+    def override_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_async_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(progress.router, prefix="/api")
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_async_db] = override_async_db
+    for service in (leaderboards, daily_rollover):
+        service.session_factory = SessionLocal
+
+    @app.post("/activity")
+    async def activity(
+        current_user: UserPrincipal = Depends(get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+    ):
+        def award(db: Session) -> int:
+            return GamificationService.record_activity(db, current_user.id, settings.XP_PER_CHAT, "chat").xp_earned
+
+        return {"xp_earned": await queue.submit(db, award)}
+
+    return app, engine, async_engine, queue
+
+
+def seed(db_path: str, users: int):
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    rows = [User(email=f"student{i}@example.com", name=f"student{i}", hashed_password="x") for i in range(users)]
+    db.add_all(rows)
+    db.flush()
+    for row in rows:
+        for _ in range(5):
+            db.add(StudySession(user_id=row.id, session_type="chat"))
+    db.commit()
+    tokens = [create_access_token({"sub": str(row.id)}) for row in rows]
+    db.close()
+    engine.dispose()
+    return tokens
+
+
+async def load(app: FastAPI, tokens, requests: int, concurrency: int, writes: float):
+    rng = random.Random(7)
+    plan = [(rng.random() < writes, tokens[i % len(tokens)]) for i in range(requests)]
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        # Warm the principal cache and the leaderboard so both runs start equal
+        for token in tokens:
+            await client.get("/api/user/sessions", headers={"Authorization": f"Bearer {token}"})
+        latencies = []
+        failures = {"read": 0, "write": 0}
+        queue = list(reversed(plan))
+
+        async def worker():
+            while queue:
+                write, token = queue.pop()
+                headers = {"Authorization": f"Bearer {token}"}
+                start = time.perf_counter()
+                try:
+                    if write:
+                        response = await client.post("/activity", headers=headers)
+                    else:
+                        response = await client.get("/api/user/sessions", headers=headers)
+                    ok = response.status_code == 200
+                except OperationalError:
+                    # "database is locked", raised through the dependency teardown
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    failures["write" if write else "read"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, failures, elapsed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(name, latencies, failures, elapsed, queue):
+    batches = f"  batches={queue.batches}" if queue.enabled else ""
+    print(
+        f"{name:<8} ok/s={len(latencies) / elapsed:>6.0f}  "
+        f"p50={statistics.median(latencies) * 1000:>7.1f}ms  p99={percentile(latencies, 0.99) * 1000:>7.1f}ms  "
+        f"locked: reads={failures['read']} writes={failures['write']}  wall={elapsed:>5.2f}s{batches}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=10, help="async engine connections")
+    parser.add_argument("--writes", type=float, default=0.3, help="fraction of requests that record XP")
+    parser.add_argument("--batch", type=int, default=settings.SQLITE_WRITE_BATCH, help="write units per commit")
+    args = parser.parse_args()
+
+    # Fold every award in its request, so writes do their full work in both runs
+    settings.XP_LEDGER_WRITE_BEHIND = False
+    print(
+        f"{args.requests} requests ({args.writes:.0%} writes), concurrency={args.concurrency}, "
+        f"async pool={args.pool_size}\n"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seeded = os.path.join(tmp, "seed.db")
+        tokens = seed(seeded, args.users)
+        for name, tuned in (("default", False), ("sqlite", True)):
+            db_path = os.path.join(tmp, f"{name}.db")
+            shutil.copy(seeded, db_path)
+            app, engine, async_engine, queue = make_app(db_path, tuned, args.pool_size, args.batch)
+            report(name, *asyncio.run(load(app, tokens, args.requests, args.concurrency, args.writes)), queue)
+            asyncio.run(async_engine.dispose())
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
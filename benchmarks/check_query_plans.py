@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Query-plan check: every hot query must be answered from an index.
+
+Usage:
+    python benchmarks/check_query_plans.py [--url sqlite:///...] [--no-migrate]
+
+Runs ``EXPLAIN`` on the queries made on every request and fails if any of
+them scans a whole table or sorts rows that an index could return in order.
+
+By default a throwaway SQLite file is built with ``migrations.upgrade``.
+Pass ``--url`` to check another database. It is migrated first unless
+``--no-migrate`` is given, which inspects an existing database as it is,
+for example a copy of ``local_dev.db``. A query that can't be planned
+because a table or column is missing counts as a failure.
+
+On SQLite, any ``SCAN`` of a table and any ``USE TEMP B-TREE FOR ORDER BY``
+counts as a failure. On Postgres, sequential scans and sorts are disabled
+for the session, so the planner uses an index whenever one fits, and any
+remaining ``Seq Scan`` or ``Sort`` node counts as a failure. Exits non-zero
+on any failure.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, select, tuple_  # noqa: E402
+from sqlalchemy.exc import DBAPIError  # noqa: E402
+
+import user, session, gamification  # noqa: E402,F401  (register all tables)
+from models.user import RefreshToken, User  # noqa: E402
+from models.session import ChatArchiveSegment, ChatMessage, Quiz, QuizQuestion, StudyMaterial, StudySession  # noqa: E402
+from models.gamification import Achievement, DailyUserActivity, UserAchievement, XPEvent  # noqa: E402
+import migrations  # noqa: E402
+
+
+def hot_queries():
+    """(name, statement) for each query on a request path, with representative parameters."""
+    now = datetime.utcnow()
+    return [
+        ("user by email (login)", select(User).where(User.email == "student@example.com")),
+        ("session ownership", select(StudySession).where(StudySession.id == 1, StudySession.user_id == 1)),
+        ("recent sessions", select(StudySession).where(
+            StudySession.user_id == 1
+        ).order_by(StudySession.start_time.desc()).limit(20)),
+        ("chat context", select(ChatMessage).where(
+            ChatMessage.session_id == 1
+        ).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(6)),
+        ("chat history page", select(ChatMessage).where(
+            ChatMessage.session_id == 1, tuple_(ChatMessage.timestamp, ChatMessage.id) < (now, 1000)
+        ).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(51)),
+        ("chat archive segment", select(ChatArchiveSegment).where(
+            ChatArchiveSegment.session_id == 1,
+            tuple_(ChatArchiveSegment.first_timestamp, ChatArchiveSegment.first_id) < (now, 1000)
+        ).order_by(ChatArchiveSegment.first_timestamp.desc(), ChatArchiveSegment.first_id.desc()).limit(1)),
+        ("session materials", select(StudyMaterial).where(StudyMaterial.session_id == 1)),
+        ("quiz questions", select(QuizQuestion).where(QuizQuestion.quiz_id == 1)),
+        ("held achievements", select(UserAchievement.achievement_id).where(
+            UserAchievement.user_id == 1, UserAchievement.achievement_id.in_([1, 2, 3])
+        )),
+        ("recent achievements", select(Achievement.name, UserAchievement.earned_at).join(
+            UserAchievement, UserAchievement.achievement_id == Achievement.id
+        ).where(UserAchievement.user_id == 1)),
+        ("session totals", select(
+            StudySession.session_type, func.count(StudySession.id)
+        ).where(StudySession.user_id == 1).group_by(StudySession.session_type)),
+        ("quiz stats", select(func.count(Quiz.id), func.avg(Quiz.score)).join(
+            StudySession, StudySession.id == Quiz.session_id
+        ).where(StudySession.user_id == 1, Quiz.completed.is_(True))),
+        ("activity history", select(DailyUserActivity).where(
+            DailyUserActivity.user_id == 1, DailyUserActivity.day >= date.today() - timedelta(days=7)
+        )),
+        ("xp events of a user", select(XPEvent).where(
+            XPEvent.user_id == 1, XPEvent.created_at >= now - timedelta(days=1)
+        )),
+        ("refresh token", select(RefreshToken).where(RefreshToken.token_hash == "0" * 64)),
+    ]
+
+
+def _execute_explain(connection, prefix: str, statement):
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    return connection.exec_driver_sql(prefix + str(compiled), params).all()
+
+
+def sqlite_problems(connection, statement):
+    plan = [row[-1] for row in _execute_explain(connection, "EXPLAIN QUERY PLAN ", statement)]
+    problems = [
+        detail for detail in plan
+        if (detail.startswith("SCAN ") and not detail.startswith("SCAN CONSTANT")) or "TEMP B-TREE FOR ORDER BY" in detail
+    ]
+    return plan, problems
+
+
+def _disable_scans(connection):
+    connection.exec_driver_sql("SET enable_seqscan = off")
+    connection.exec_driver_sql("SET enable_sort = off")
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+
+def postgres_problems(connection, statement):
+    raw = _execute_explain(connection, "EXPLAIN (FORMAT JSON) ", statement)[0][0]
+    root = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+    nodes = list(_plan_nodes(root))
+    plan = [f"{node['Node Type']} {node.get('Relation Name', '')}".strip() for node in nodes]
+    problems = [entry for entry in plan if entry.startswith(("Seq Scan", "Sort"))]
+    return plan, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="database to check (default: a throwaway SQLite file)")
+    parser.add_argument("--no-migrate", action="store_true", help="check the database as it is")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.url or f"sqlite:///{os.path.join(tmp, 'plans.db')}")
+        if not args.no_migrate:
+            migrations.upgrade(engine)
+
+        postgres = engine.dialect.name == "postgresql"
+        failed = 0
+        with engine.connect() as connection:
+            if postgres:
+                _disable_scans(connection)
+            for name, statement in hot_queries():
+                try:
+                    plan, problems = (postgres_problems if postgres else sqlite_problems)(connection, statement)
+                except DBAPIError as e:
+                    # Missing table or column: the schema is behind the models
+                    if postgres:
+                        connection.rollback()
+                        _disable_scans(connection)
+                    plan = problems = [str(e.orig).splitlines()[0]]
+                failed += bool(problems)
+                print(f"{'FAIL' if problems else 'ok':<5} {name:<24} {' | '.join(plan)}")
+        engine.dispose()
+
+    print(f"\n{failed} of {len(hot_queries())} hot queries fall back to a scan or sort")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
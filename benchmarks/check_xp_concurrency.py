@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Concurrency check: overlapping XP awards for one user must not lose updates.
+
+Usage:
+    python benchmarks/check_xp_concurrency.py [--threads 8] [--awards 200] [--url sqlite:///...]
+
+Each thread opens its own session per award, like a request, and commits
+once. The legacy read-modify-write ``award_xp`` (copied below) runs first,
+then ``GamificationService.record_activity`` folding each award in its
+request, then the same through the write-behind XP ledger (flushed before
+the total is read). The script reports the final
+``total_xp`` against the expected total and exits non-zero if the current
+implementation lost any XP or the ledger's events don't add up to the total. By default a throwaway SQLite file is used.
+Pass ``--url`` to run against Postgres.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+
+from database import Base  # noqa: E402
+import user, session, gamification  # noqa: E402,F401  (register all mappers)
+from models.user import User  # noqa: E402
+from models.gamification import XPEvent  # noqa: E402
+from gamification_service import GamificationService  # noqa: E402
+from services.xp_ledger import xp_ledger  # noqa: E402
+
+XP = 10
+
+
+def legacy_award_xp(db: Session, user_id: int, xp_amount: int) -> None:
+    user = db.query(User).filter(User.id == user_id).first()
+    user.total_xp += xp_amount  # type: ignore
+    user.total_points += xp_amount  # type: ignore
+    user.current_level = (user.total_xp // 1000) + 1  # type: ignore
+    db.commit()
+
+
+def atomic_award_xp(db: Session, user_id: int, xp_amount: int) -> None:
+    GamificationService.record_activity(db, user_id, xp_amount, "chat", write_behind=False)
+    db.commit()
+
+
+def ledger_award_xp(db: Session, user_id: int, xp_amount: int) -> None:
+    GamificationService.record_activity(db, user_id, xp_amount, "chat", write_behind=True)
+    db.commit()
+
+
+def hammer(SessionLocal, award, user_id: int, threads: int, awards: int):
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def worker():
+        barrier.wait()
+        for _ in range(awards):
+            for attempt in range(50):
+                db = SessionLocal()
+                try:
+                    award(db, user_id, XP)
+                    break
+                except OperationalError:
+                    # SQLite "database is locked": the request would be retried or fail,
+                    # but must never silently drop XP
+                    db.rollback()
+                    time.sleep(0.001 * (attempt + 1))
+                finally:
+                    db.close()
+            else:
+                errors.append("gave up")
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--awards", type=int, default=200, help="awards per thread")
+    parser.add_argument("--url", default=None)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    url = args.url or f"sqlite:///{os.path.join(tmp.name, 'check.db')}"
+    connect_args = {"check_same_thread": False, "timeout": 30} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args, pool_size=args.threads, max_overflow=0)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    xp_ledger.session_factory = SessionLocal
+
+    expected = args.threads * args.awards * XP
+    print(f"{args.threads} threads x {args.awards} awards x {XP} XP = {expected} XP expected\n")
+
+    ok = True
+    for name, award in (("legacy", legacy_award_xp), ("atomic", atomic_award_xp), ("ledger", ledger_award_xp)):
+        db = SessionLocal()
+        student = User(email=f"{name}-{time.time()}@example.com", name=name, hashed_password="x",
+                       total_xp=0, total_points=0, current_streak=0)
+        db.add(student)
+        db.commit()
+        user_id = student.id
+        db.close()
+
+        elapsed, gave_up = hammer(SessionLocal, award, user_id, args.threads, args.awards)
+        xp_ledger.flush()
+
+        db = SessionLocal()
+        total = db.query(User.total_xp).filter(User.id == user_id).scalar()
+        logged = db.query(func.coalesce(func.sum(XPEvent.amount), 0)).filter(XPEvent.user_id == user_id).scalar()
+        db.close()
+        lost = expected - total
+        print(f"{name:<8} total_xp={total:>7}  ledger={logged:>7}  lost={lost:>6}  gave_up={gave_up}  time={elapsed:.2f}s")
+        if name != "legacy" and (lost or gave_up or logged != total):
+            ok = False
+
+    tmp.cleanup()
+    print("\nno lost XP: " + ("yes" if ok else "NO"))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from database import get_db
-from models.user import User
+from typing import List, Optional
+from datetime import datetime
+import base64
+from database import get_async_db
 from models.session import ChatMessage, StudySession
 from services.rag_service import RAGService
+from services.chat_archive import Cursor, chat_archiver, history_page
 from services.gamification_service import GamificationService
-from utils.auth import get_current_user
+from services.write_queue import write_queue
+from utils.auth import UserPrincipal, get_current_principal, get_read_db
 from config import settings
 
 router = APIRouter()
@@ -21,18 +27,41 @@ class ChatResponse(BaseModel):
     response: str
     xp_earned: int
 
+class ChatHistoryMessage(BaseModel):
+    id: int
+    message_type: str
+    content: str
+    timestamp: datetime
+
+class ChatHistoryResponse(BaseModel):
+    session_id: int
+    messages: List[ChatHistoryMessage]  # oldest first
+    next_cursor: Optional[str] = None  # pass as ``before`` for the page before this one
+
+def _encode_cursor(cursor: Cursor) -> str:
+    timestamp, message_id = cursor
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{message_id}".encode()).decode().rstrip("=")
+
+def _decode_cursor(value: str) -> Cursor:
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         # Verify session belongs to user
-        session = db.query(StudySession).filter(
+        session = (await db.execute(select(StudySession).where(
             StudySession.id == request.session_id,
             StudySession.user_id == current_user.id
-        ).first()
+        ))).scalar_one_or_none()
         
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
@@ -43,43 +72,55 @@ async def chat(
             session_id=request.session_id
         )
         
-        # Save messages
-        user_msg = ChatMessage(
-            session_id=request.session_id,
-            message_type="user",
-            content=request.query
-        )
-        ai_msg = ChatMessage(
-            session_id=request.session_id,
-            message_type="ai",
-            content=response
-        )
-        
-        db.add(user_msg)
-        db.add(ai_msg)
-        
-        # Award XP
-        xp_earned = gamification_service.award_xp(
-            db=db,
-            user_id=current_user.id,
-            xp_amount=settings.XP_PER_CHAT,
-            action_type="chat"
-        )
-
-        # Persist messages and update session XP using a DB update to avoid
-        # static type-checker issues with SQLAlchemy descriptors.
-        db.add(user_msg)
-        db.add(ai_msg)
-        db.flush()
-
-        db.query(StudySession).filter(StudySession.id == session.id).update({
-            "xp_earned": StudySession.xp_earned + xp_earned
-        })
+        def save_exchange(db: Session) -> int:
+            # Messages, XP and the session's XP total commit together
+            db.add_all([
+                ChatMessage(session_id=request.session_id, message_type="user", content=request.query),
+                ChatMessage(session_id=request.session_id, message_type="ai", content=response),
+            ])
+            xp_earned = gamification_service.record_activity(
+                db=db,
+                user_id=current_user.id,
+                xp_amount=settings.XP_PER_CHAT,
+                action_type="chat",
+                session_id=request.session_id
+            ).xp_earned
+            db.execute(update(StudySession).where(StudySession.id == request.session_id).values(
+                xp_earned=StudySession.xp_earned + xp_earned
+            ))
+            return xp_earned
 
-        db.commit()
+        xp_earned = await write_queue.submit(db, save_exchange)
+        chat_archiver.ensure_scheduled()
 
         return ChatResponse(response=response, xp_earned=xp_earned)
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/chat/history", response_model=ChatHistoryResponse)
+async def chat_history(
+    session_id: int,
+    before: Optional[str] = None,
+    limit: int = Query(settings.CHAT_HISTORY_PAGE_SIZE, ge=1, le=200),
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """A page of a session's messages, archived ones included; page back with ``next_cursor``"""
+    cursor = _decode_cursor(before) if before else None
+    owned = (await db.execute(select(StudySession.id).where(
+        StudySession.id == session_id,
+        StudySession.user_id == current_user.id
+    ))).first()
+    if not owned:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    messages, more = await db.run_sync(history_page, session_id, limit, cursor)
+    oldest = messages[-1] if messages else None
+    return ChatHistoryResponse(
+        session_id=session_id,
+        messages=[ChatHistoryMessage(**m) for m in reversed(messages)],
+        next_cursor=_encode_cursor((oldest["timestamp"], oldest["id"])) if more and oldest else None
+    )
+
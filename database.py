@@ -1,3 +1,3 @@
-from database_quest import engine, SessionLocal, Base, get_db, init_db
+from database_quest import engine, async_engine, SessionLocal, AsyncSessionLocal, Base, get_db, get_async_db, init_db, configure_sqlite, ReadRouter, read_router
 
-__all__ = ["engine", "SessionLocal", "Base", "get_db", "init_db"]
+__all__ = ["engine", "async_engine", "SessionLocal", "AsyncSessionLocal", "Base", "get_db", "get_async_db", "init_db", "configure_sqlite", "ReadRouter", "read_router"]
@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from typing import Dict, List, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from config_quest import settings
 import importlib
+import itertools
+import threading
+import time
 
 # Try to create engine using configured DATABASE_URL. If the required DB driver
 # isn't installed (e.g. psycopg2 for Postgres), fall back to a local sqlite
@@ -10,11 +16,13 @@ import importlib
 
 def _make_engine():
     try:
+        if make_url(settings.DATABASE_URL).get_backend_name() == "sqlite":
+            return create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
         engine = create_engine(
             settings.DATABASE_URL,
             pool_pre_ping=True,
-            pool_size=10,
-            max_overflow=20
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW
         )
         return engine
     except ModuleNotFoundError as exc:
@@ -22,11 +30,151 @@ def _make_engine():
         print("WARNING: DB driver not found; falling back to sqlite for development.")
         return create_engine("sqlite:///./local_dev.db", connect_args={"check_same_thread": False})
 
+# SQLite mode: single-node deployments run on the sqlite file, so every
+# connection gets WAL (readers don't block the writer or each other),
+# synchronous=NORMAL (fsync at checkpoints rather than every commit), a busy
+# timeout instead of immediate "database is locked", and a larger page cache
+# plus mmap for reads. Writes are serialized by services.write_queue.
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+    cursor.close()
+
+def configure_sqlite(engine) -> None:
+    """Apply the SQLite-mode pragmas to every new connection of a sync or async ``engine``."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _sqlite_pragmas)
+
 engine = _make_engine()
+configure_sqlite(engine)
+
+# Request handlers use an AsyncSession so queries don't block the event loop.
+# It talks to the same database as the sync engine (which may have fallen
+# back to sqlite above) through an asyncio driver: asyncpg for Postgres,
+# aiosqlite for sqlite. A missing asyncio driver is an error rather than
+# another fallback: only the sync engine falls back, and the async engine
+# follows whatever the sync engine ended up on.
+_ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def _async_url(url):
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+def _make_async_engine():
+    url = _async_url(engine.url)
+    try:
+        if url.get_backend_name() == "sqlite":
+            return create_async_engine(url)
+        return create_async_engine(
+            url, pool_pre_ping=True, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW
+        )
+    except ModuleNotFoundError as exc:
+        # Falling back here would split handlers and background jobs across two databases
+        raise RuntimeError(
+            f"Async driver for {url.drivername} is not installed; the async engine must use the same "
+            f"database as the sync engine ({engine.url.render_as_string()})"
+        ) from exc
+
+async_engine = _make_async_engine()
+configure_sqlite(async_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attribute access after commit would otherwise be a
+# lazy load, which an AsyncSession can't do implicitly
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+# Read replicas: read-only endpoints depend on auth.get_read_db, which asks
+# ReadRouter for the next of DATABASE_REPLICA_URLS in turn. Writes always go
+# to the primary. A user whose write committed less than
+# DB_READ_YOUR_WRITES_SECONDS ago reads from the primary too, so they see it
+# before the replicas catch up. That window is kept per process, like the
+# principal cache; a user whose requests land on another worker may briefly
+# read from a replica that is behind.
+
+_STICKY_KEY = "read_router_sticky"
+
+def _make_replica_sessionmakers() -> List[async_sessionmaker]:
+    sessionmakers = []
+    for replica_url in settings.DATABASE_REPLICA_URLS:
+        url = _async_url(make_url(replica_url))
+        try:
+            if url.get_backend_name() == "sqlite":
+                replica = create_async_engine(url)
+            else:
+                replica = create_async_engine(
+                    url,
+                    pool_pre_ping=True,
+                    pool_size=settings.DB_REPLICA_POOL_SIZE,
+                    max_overflow=settings.DB_REPLICA_MAX_OVERFLOW
+                )
+        except ModuleNotFoundError:
+            print(f"WARNING: async DB driver not found for replica {url.host}; reading from the primary instead.")
+            continue
+        configure_sqlite(replica)
+        sessionmakers.append(
+            async_sessionmaker(replica, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+        )
+    return sessionmakers
+
+class ReadRouter:
+    def __init__(self, replicas: List[async_sessionmaker], sticky_seconds: float = 5.0):
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.primary_reads = 0
+        self.replica_reads = 0
+        self._next = itertools.count()
+        self._sticky: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def stick(self, user_id: int) -> None:
+        """Send ``user_id``'s reads to the primary for the next ``sticky_seconds``."""
+        now = time.monotonic()
+        with self._lock:
+            self._sticky[user_id] = now + self.sticky_seconds
+            if len(self._sticky) > 1000:
+                self._sticky = {uid: until for uid, until in self._sticky.items() if until > now}
+
+    def stick_on_commit(self, db: Session, user_id: int) -> None:
+        """``stick(user_id)`` once ``db`` commits."""
+        if self.replicas:
+            db.info.setdefault(_STICKY_KEY, set()).add(user_id)
+
+    def _on_commit(self, db: Session) -> None:
+        for user_id in db.info.pop(_STICKY_KEY, ()):
+            self.stick(user_id)
+
+    def _on_rollback(self, db: Session) -> None:
+        db.info.pop(_STICKY_KEY, None)
+
+    def is_sticky(self, user_id: int) -> bool:
+        return self._sticky.get(user_id, 0.0) > time.monotonic()
+
+    def replica(self, user_id: Optional[int] = None) -> Optional[async_sessionmaker]:
+        """The next replica to read from, or ``None`` to read from the primary."""
+        if not self.replicas or (user_id is not None and self.is_sticky(user_id)):
+            self.primary_reads += 1
+            return None
+        self.replica_reads += 1
+        return self.replicas[next(self._next) % len(self.replicas)]
+
+    def stats(self) -> Dict:
+        return {
+            "replicas": len(self.replicas),
+            "sticky_users": len(self._sticky),
+            "primary_reads": self.primary_reads,
+            "replica_reads": self.replica_reads,
+        }
+
+read_router = ReadRouter(_make_replica_sessionmakers(), settings.DB_READ_YOUR_WRITES_SECONDS)
+event.listen(Session, "after_commit", read_router._on_commit)
+event.listen(Session, "after_rollback", read_router._on_rollback)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -34,5 +182,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # create_all plus the versioned migrations, which also reach existing tables
+    from migrations import upgrade
+    upgrade(engine)
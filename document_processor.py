@@ -1,57 +1,263 @@
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
+from services.material_sidecar import (
+    PAGE_SEPARATOR,
+    MaterialSidecar,
+    normalize_text,
+    open_sidecar,
+    sidecar_path,
+    write_sidecar,
+)
+from services.rag_service import invalidate_session_cache
+from services.metrics import DEFAULT_SIZE_BUCKETS, metrics as metrics_registry
+from services.text_splitter import StructuredTextSplitter, count_tokens
+from contextlib import contextmanager
 from config import settings
+from typing import Dict, List, Optional
 import os
+import time
+
+
+class IngestMetrics:
+    """
+    Per-material ingestion timers and counters.
+
+    Stages nest: time spent in an inner stage (e.g. ``embed`` called from
+    inside ``index``) is subtracted from the outer one, so every stage reports
+    self time and the stage totals add up to the wall time of the ingest.
+    """
+
+    COUNTERS = ("pages", "chars", "chunks", "tokens_embedded", "bytes_written")
+
+    def __init__(self, file_type: str):
+        self.file_type = file_type
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {name: 0 for name in self.COUNTERS}
+        self.error: Optional[str] = None
+        self._stack: List[List[float]] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        # [wall, cpu] spent in nested stages, subtracted on exit
+        self._stack.append([0.0, 0.0])
+        try:
+            yield
+        finally:
+            nested_wall, nested_cpu = self._stack.pop()
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            stats = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0})
+            stats["wall_s"] += wall - nested_wall
+            stats["cpu_s"] += cpu - nested_cpu
+            stats["calls"] += 1
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+
+    def add(self, counter: str, amount: int) -> None:
+        self.counters[counter] += amount
+
+    def to_dict(self) -> Dict:
+        return {
+            "file_type": self.file_type,
+            "stages": self.stages,
+            "counters": self.counters,
+            "total_wall_s": sum(s["wall_s"] for s in self.stages.values()),
+            "error": self.error,
+        }
+
+    def publish(self) -> None:
+        """Fold this material's numbers into the process-wide histograms."""
+        labels = {"file_type": self.file_type}
+        for name, stats in self.stages.items():
+            stage_labels = {"file_type": self.file_type, "stage": name}
+            metrics_registry.observe("ingest_stage_wall_seconds", stats["wall_s"], stage_labels)
+            metrics_registry.observe("ingest_stage_cpu_seconds", stats["cpu_s"], stage_labels)
+        for name, value in self.counters.items():
+            metrics_registry.observe(f"ingest_{name}", value, labels, DEFAULT_SIZE_BUCKETS)
+        metrics_registry.inc("ingest_materials_total", labels={**labels, "ok": str(self.error is None).lower()})
+
+
+class _TimedEmbeddings(Embeddings):
+    """Wraps the embedding model so vector store calls report an ``embed`` stage."""
+
+    def __init__(self, inner: Embeddings, metrics: IngestMetrics):
+        self.inner = inner
+        self.metrics = metrics
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.metrics.stage("embed"):
+            vectors = self.inner.embed_documents(texts)
+        self.metrics.add("tokens_embedded", sum(count_tokens(t) for t in texts))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
 
 class DocumentProcessor:
     def __init__(self):
         self.embeddings = OpenAIEmbeddings(
             openai_api_key=settings.OPENAI_API_KEY
         )
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+        self.text_splitter = StructuredTextSplitter(
+            chunk_tokens=settings.CHUNK_TOKENS,
+            min_chunk_tokens=settings.CHUNK_MIN_TOKENS
         )
-    
-    async def process_document(self, file_path: str, session_id: int) -> bool:
+
+    @property
+    def splitter_config(self) -> dict:
+        return self.text_splitter.config
+
+    async def process_document(
+        self,
+        file_path: str,
+        session_id: int,
+        metrics: Optional[IngestMetrics] = None
+    ) -> bool:
+        metrics = metrics or IngestMetrics(os.path.splitext(file_path)[1].lstrip('.'))
         try:
-            # Load document based on file type
-            if file_path.endswith('.pdf'):
-                loader = PyPDFLoader(file_path)
-            elif file_path.endswith('.docx'):
-                loader = Docx2txtLoader(file_path)
-            elif file_path.endswith('.txt'):
-                loader = TextLoader(file_path)
-            else:
+            chunks = self._load_chunks(file_path, metrics)
+            if chunks is None:
                 return False
-            
-            documents = loader.load()
-            
-            # Split into chunks
-            chunks = self.text_splitter.split_documents(documents)
-            
-            # Create or update vector store
-            vectorstore_path = f"{settings.CHROMA_PERSIST_DIR}/session_{session_id}"
-            
+
+            self._index_chunks(chunks, session_id, metrics)
+            return True
+
+        except Exception as e:
+            metrics.error = str(e)
+            print(f"Document processing error: {e}")
+            return False
+
+    async def reembed_document(
+        self,
+        file_path: str,
+        session_id: int,
+        metrics: Optional[IngestMetrics] = None
+    ) -> bool:
+        """Re-embed a material from its sidecar without parsing or re-splitting it."""
+        sidecar = open_sidecar(file_path)
+        if sidecar is None:
+            return await self.process_document(file_path, session_id, metrics)
+        metrics = metrics or IngestMetrics(os.path.splitext(file_path)[1].lstrip('.'))
+        try:
+            with sidecar:
+                chunks = self._documents_from_sidecar(sidecar, file_path, metrics)
+            self._index_chunks(chunks, session_id, metrics)
+            return True
+        except Exception as e:
+            metrics.error = str(e)
+            print(f"Document re-embedding error: {e}")
+            return False
+
+    def _load_chunks(self, file_path: str, metrics: IngestMetrics) -> Optional[List[Document]]:
+        # Reuse the extracted-text sidecar when the upload hasn't changed, so
+        # re-ingesting never parses the original document again.
+        pages = None
+        sidecar = open_sidecar(file_path)
+        if sidecar is not None:
+            with sidecar:
+                if sidecar.splitter == self.splitter_config:
+                    return self._documents_from_sidecar(sidecar, file_path, metrics)
+                with metrics.stage("sidecar_read"):
+                    pages = sidecar.pages()
+
+        if pages is None:
+            with metrics.stage("parse"):
+                pages = self._extract_pages(file_path)
+            if pages is None:
+                return None
+
+        self._write_chunks(file_path, pages, metrics)
+        sidecar = open_sidecar(file_path)
+        with sidecar:
+            return self._documents_from_sidecar(sidecar, file_path, metrics)
+
+    def _extract_pages(self, file_path: str) -> Optional[List[str]]:
+        # Load document based on file type
+        if file_path.endswith('.pdf'):
+            loader = PyPDFLoader(file_path)
+        elif file_path.endswith('.docx'):
+            loader = Docx2txtLoader(file_path)
+        elif file_path.endswith('.txt'):
+            loader = TextLoader(file_path)
+        else:
+            return None
+
+        return [normalize_text(doc.page_content) for doc in loader.load()]
+
+    def _write_chunks(self, file_path: str, pages: List[str], metrics: IngestMetrics) -> None:
+        """Split normalized pages and persist the boundaries in the material's sidecar."""
+        with metrics.stage("split"):
+            chunks = self.text_splitter.split(PAGE_SEPARATOR.join(pages))
+            boundaries = [(chunk.start, chunk.end, chunk.heading) for chunk in chunks]
+
+        with metrics.stage("sidecar_write"):
+            write_sidecar(file_path, pages, boundaries, splitter=self.splitter_config)
+        metrics.add("bytes_written", os.path.getsize(sidecar_path(file_path)))
+
+    def _documents_from_sidecar(
+        self,
+        sidecar: MaterialSidecar,
+        file_path: str,
+        metrics: IngestMetrics
+    ) -> List[Document]:
+        with metrics.stage("sidecar_read"):
+            chunks = [
+                Document(
+                    page_content=text,
+                    metadata={
+                        "source": file_path,
+                        "page": meta["page"],
+                        "heading": meta["heading"] or "",
+                        "chunk_hash": meta["hash"]
+                    }
+                )
+                for text, meta in sidecar.iter_chunks()
+            ]
+        metrics.add("pages", sidecar.page_count)
+        metrics.add("chars", len(sidecar.text()))
+        metrics.add("chunks", len(chunks))
+        return chunks
+
+    def _index_chunks(self, chunks: List[Document], session_id: int, metrics: IngestMetrics) -> None:
+        # Create or update vector store
+        vectorstore_path = f"{settings.CHROMA_PERSIST_DIR}/session_{session_id}"
+        size_before = _tree_size(vectorstore_path)
+        embeddings = _TimedEmbeddings(self.embeddings, metrics)
+
+        with metrics.stage("index"):
             if os.path.exists(vectorstore_path):
                 vectorstore = Chroma(
                     persist_directory=vectorstore_path,
-                    embedding_function=self.embeddings
+                    embedding_function=embeddings
                 )
                 vectorstore.add_documents(chunks)
             else:
                 vectorstore = Chroma.from_documents(
                     documents=chunks,
-                    embedding=self.embeddings,
+                    embedding=embeddings,
                     persist_directory=vectorstore_path
                 )
-            
+
+        with metrics.stage("persist"):
             vectorstore.persist()
-            return True
-        
-        except Exception as e:
-            print(f"Document processing error: {e}")
-            return False
+        # Cached vector store handles and study packs now describe stale content
+        invalidate_session_cache(session_id)
+        metrics.add("bytes_written", max(0, _tree_size(vectorstore_path) - size_before))
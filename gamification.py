@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, ForeignKey, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -29,6 +29,11 @@ class UserAchievement(Base):
     # Relationships
     user = relationship("User", back_populates="achievements")
     achievement = relationship("Achievement", back_populates="user_achievements")
+    
+    __table_args__ = (
+        # Grants insert with ON CONFLICT DO NOTHING against this key
+        Index("uq_user_achievements_user_achievement", "user_id", "achievement_id", unique=True),
+    )
 
 
 class Exam(Base):
@@ -42,3 +47,40 @@ class Exam(Base):
     exam_date = Column(DateTime, nullable=False)
     duration_minutes = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class XPEvent(Base):
+    """Append-only XP ledger; ``users.total_xp`` is a fold over these rows."""
+    __tablename__ = "xp_events"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    action_type = Column(String, nullable=False)  # 'chat', 'upload', 'quiz', 'achievement', 'opening_balance', ...
+    amount = Column(Integer, nullable=False)
+    session_id = Column(Integer, ForeignKey("study_sessions.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_xp_events_user_created", "user_id", "created_at"),
+    )
+
+
+class DailyUserActivity(Base):
+    """
+    Per-user, per-day activity rollup, maintained incrementally as activity
+    is recorded so dashboards read one row per day instead of raw events.
+    """
+    __tablename__ = "daily_user_activity"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    xp = Column(Integer, default=0, nullable=False)
+    events = Column(Integer, default=0, nullable=False)
+    minutes = Column(Float, default=0, nullable=False)
+    chats = Column(Integer, default=0, nullable=False)
+    quizzes = Column(Integer, default=0, nullable=False)
+    uploads = Column(Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_daily_user_activity_day", "day"),
+    )
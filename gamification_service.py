@@ -1,81 +1,534 @@
+from sqlalchemy import and_, case, event, func, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from models.user import User
-from models.gamification import Achievement, UserAchievement
-from datetime import datetime, timedelta
+from models.session import StudySession
+from models.gamification import Achievement, DailyUserActivity, UserAchievement, XPEvent
+from config import settings
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+import bisect
+import threading
+import time
+
+if TYPE_CHECKING:
+    from services.xp_ledger import XPEventRecord
+
+# Which user column each achievement criteria type is measured against
+CRITERIA_STATS = {
+    "streak": "current_streak",
+    "quiz_count": "quizzes_completed",
+    "xp": "total_xp",
+}
+
+
+class AchievementRule(NamedTuple):
+    id: int
+    criteria_type: str
+    criteria_value: int
+    xp_reward: int
+    name: str = ""
+
+
+class AchievementCatalog:
+    """
+    In-process copy of the achievements table, grouped by criteria type and
+    sorted by threshold so the rules a stat value satisfies are a prefix.
+
+    Reloaded on first use after any change to ``Achievement`` rows in this
+    process, and at least every ``ttl_seconds`` to pick up changes made by
+    other workers.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        # criteria_type -> (rules sorted by threshold, their thresholds)
+        self._rules: Optional[Dict[str, Tuple[List[AchievementRule], List[int]]]] = None
+        self._loaded_at = 0.0
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._rules = None
+            self._version += 1
+
+    def _load(self, db: Session) -> Dict[str, Tuple[List[AchievementRule], List[int]]]:
+        with self._lock:
+            if self._rules is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return self._rules
+            version = self._version
+
+        rows = db.query(
+            Achievement.id, Achievement.criteria_type, Achievement.criteria_value, Achievement.xp_reward, Achievement.name
+        ).all()
+        grouped: Dict[str, List[AchievementRule]] = {}
+        for row in rows:
+            if row.criteria_type in CRITERIA_STATS and row.criteria_value is not None:
+                grouped.setdefault(row.criteria_type, []).append(
+                    AchievementRule(row.id, row.criteria_type, row.criteria_value, row.xp_reward or 0, row.name)
+                )
+        rules = {}
+        for criteria_type, group in grouped.items():
+            group.sort(key=lambda rule: rule.criteria_value)
+            rules[criteria_type] = (group, [rule.criteria_value for rule in group])
+
+        with self._lock:
+            # Don't cache a snapshot that an invalidation raced past
+            if version == self._version:
+                self._rules = rules
+                self._loaded_at = time.monotonic()
+        return rules
+
+    def satisfied(self, db: Session, criteria_type: str, low: Optional[int], high: int) -> List[AchievementRule]:
+        """Rules of ``criteria_type`` with ``low < criteria_value <= high`` (``low=None``: no lower bound)."""
+        rules, thresholds = self._load(db).get(criteria_type, ([], []))
+        start = 0 if low is None else bisect.bisect_right(thresholds, low)
+        return rules[start:bisect.bisect_right(thresholds, high)]
+
+
+achievement_catalog = AchievementCatalog(ttl_seconds=settings.ACHIEVEMENT_CATALOG_TTL_SECONDS)
+
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(Achievement, _event, lambda mapper, connection, target: achievement_catalog.invalidate())
+
+
+class ActivityResult(NamedTuple):
+    xp_earned: int
+    # None when the award was buffered by the write-behind ledger and not folded yet
+    total_xp: Optional[int]
+    current_level: Optional[int]
+    current_streak: Optional[int]
+    achievements: List[int]
+
+
+# User counters that record_activity may bump alongside XP
+ACTIVITY_COUNTERS = ("materials_uploaded", "quizzes_completed", "study_sessions")
+
+# Those counters that achievements are measured against, with their criteria type
+COUNTER_CRITERIA = {
+    column: criteria_type for criteria_type, column in CRITERIA_STATS.items() if column in ACTIVITY_COUNTERS
+}
+
+# daily_user_activity columns fed by each activity, besides xp and events
+ROLLUP_COUNTERS = ("minutes", "chats", "quizzes", "uploads")
+COUNTER_ROLLUPS = {"materials_uploaded": "uploads", "quizzes_completed": "quizzes"}
+CHAT_ACTIONS = ("chat", "language_chat")
+
 
 class GamificationService:
+    """
+    XP, streak and achievement accounting.
+    
+    Nothing here commits: every method only adds statements to the caller's
+    transaction, so a request does its gamification work and its own writes
+    in one commit. Counters are incremented in SQL (``total_xp = total_xp + :x``)
+    rather than read-modify-written in Python, so overlapping requests from
+    the same user can't lose XP.
+    
+    Every award is also an ``XPEvent`` row. With ``XP_LEDGER_WRITE_BEHIND``
+    the events are buffered by ``services.xp_ledger`` and folded into the
+    user totals in batches by ``apply_events``.
+    
+    Handlers holding an ``AsyncSession`` use the ``*_async`` variants, which
+    run the same code on the session's sync facade through the async driver.
+    """
+    
     @staticmethod
-    def award_xp(db: Session, user_id: int, xp_amount: int, action_type: str) -> int:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return 0
+    def _update_user(db: Session, user_id: int, values: Dict) -> Optional[Tuple]:
+        """
+        Apply ``values`` to one user row and return the new XP, level and
+        streak, followed by the ``COUNTER_CRITERIA`` counters.
+        """
+        columns = (User.total_xp, User.current_level, User.current_streak) + tuple(
+            getattr(User, column) for column in COUNTER_CRITERIA
+        )
+        statement = update(User).where(User.id == user_id).values(**values).execution_options(synchronize_session=False)
+        if db.get_bind().dialect.update_returning:
+            return db.execute(statement.returning(*columns)).first()
+        # No RETURNING: the row is write-locked by the UPDATE until commit, so reading it back is safe
+        if not db.execute(statement).rowcount:
+            return None
+        return db.query(*columns).filter(User.id == user_id).first()
+    
+    @staticmethod
+    def _study_time_values(minutes, day: date) -> Dict:
+        """Add ``minutes`` to ``study_time_today`` for ``day``, starting over if it held another day's."""
+        return {
+            "study_time_today": case(
+                (User.study_day == day, func.coalesce(User.study_time_today, 0) + minutes), else_=minutes
+            ),
+            "study_day": day,
+        }
+    
+    @staticmethod
+    def _counter_values(counters: Optional[Dict[str, int]], minutes: float = 0) -> Dict:
+        values = {}
+        for name, amount in (counters or {}).items():
+            if name not in ACTIVITY_COUNTERS:
+                raise ValueError(f"Unknown activity counter: {name}")
+            values[name] = getattr(User, name) + amount
+        if minutes:
+            values.update(GamificationService._study_time_values(minutes, datetime.utcnow().date()))
+        return values
+    
+    @staticmethod
+    def _counter_changes(counters: Optional[Dict[str, int]], values: Tuple) -> Dict[str, Tuple[Optional[int], int]]:
+        """
+        Criteria changes for the ``COUNTER_CRITERIA`` counters that
+        ``counters`` bumped, given their new ``values`` from ``_update_user``.
+        """
+        changes: Dict[str, Tuple[Optional[int], int]] = {}
+        for column, value in zip(COUNTER_CRITERIA, values):
+            amount = (counters or {}).get(column)
+            if amount:
+                new = int(value or 0)
+                changes[COUNTER_CRITERIA[column]] = (new - amount, new)
+        return changes
+    
+    @staticmethod
+    def _rollup_counts(
+        action_type: str,
+        counters: Optional[Dict[str, int]],
+        minutes: float
+    ) -> Tuple[Tuple[str, float], ...]:
+        """The ``daily_user_activity`` increments one activity contributes."""
+        counts: Dict[str, float] = {}
+        if action_type in CHAT_ACTIONS:
+            counts["chats"] = 1
+        for name, amount in (counters or {}).items():
+            if name in COUNTER_ROLLUPS:
+                counts[COUNTER_ROLLUPS[name]] = amount
+        if minutes:
+            counts["minutes"] = minutes
+        return tuple(counts.items())
+    
+    @staticmethod
+    def _fold(
+        db: Session,
+        user_id: int,
+        xp_amount: int,
+        active_at: Optional[datetime],
+        counters: Optional[Dict[str, int]] = None,
+        minutes: float = 0
+    ) -> Optional[ActivityResult]:
+        """
+        Add ``xp_amount`` to the user's totals and, when ``active_at`` is set,
+        advance the streak for that day, in a single atomic ``UPDATE``. Then
+        grant any achievements whose thresholds were crossed. Returns None if
+        the user doesn't exist.
+        """
+        from services.event_bus import event_bus
+        
+        values = {
+            "total_xp": User.total_xp + xp_amount,
+            "total_points": User.total_points + xp_amount,
+            # Calculate level (every 1000 XP = 1 level); SET sees the pre-update row
+            "current_level": (User.total_xp + xp_amount) // 1000 + 1,
+        }
+        values.update(GamificationService._counter_values(counters, minutes))
         
-        user.total_xp += xp_amount  # type: ignore
-        user.total_points += xp_amount  # type: ignore
+        if active_at is not None:
+            day = datetime(active_at.year, active_at.month, active_at.day)
+            values["current_streak"] = case(
+                (and_(User.last_active_date >= day, User.current_streak > 0), User.current_streak),
+                (User.last_active_date >= day - timedelta(days=1), User.current_streak + 1),
+                else_=1
+            )
+            values["last_active_date"] = active_at
         
-        # Calculate level (every 1000 XP = 1 level)
-        user.current_level = (user.total_xp // 1000) + 1  # type: ignore
+        row = GamificationService._update_user(db, user_id, values)
+        if row is None:
+            return None
+        total_xp, current_level, current_streak = (int(v or 0) for v in row[:3])
         
-        db.commit()
+        # Thresholds crossed by this activity; a streak only ever grows by one or resets
+        changes: Dict[str, Tuple[Optional[int], int]] = {"xp": (total_xp - xp_amount, total_xp)}
+        if active_at is not None:
+            changes["streak"] = (current_streak - 1, current_streak)
+        changes.update(GamificationService._counter_changes(counters, row[3:]))
+        granted = GamificationService._grant_achievements(db, user_id, changes)
         
-        # Check for achievements
-        GamificationService.check_achievements(db, user)
+        # Rewards raised XP, and with it the level, in the same transaction
+        reward = sum(rule.xp_reward for rule in granted)
+        total_xp += reward
+        current_level = total_xp // 1000 + 1
         
-        return xp_amount
+        # Live update for the user's open tabs, sent once this transaction commits
+        event_bus.publish_on_commit(db, user_id, {
+            "xp_delta": xp_amount + reward,
+            "total_xp": total_xp,
+            "current_level": current_level,
+            "current_streak": current_streak,
+            "level_up": current_level > (total_xp - reward - xp_amount) // 1000 + 1,
+            "achievements": [{"id": rule.id, "name": rule.name, "xp_reward": rule.xp_reward} for rule in granted],
+        })
+        
+        return ActivityResult(xp_amount, total_xp, current_level, current_streak, [rule.id for rule in granted])
     
     @staticmethod
-    def update_streak(db: Session, user_id: int) -> int:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return 0
+    def apply_events(db: Session, events: List["XPEventRecord"]) -> Dict[int, ActivityResult]:
+        """
+        Append ``events`` to the ledger and fold them into user totals and
+        daily rollups: one ``UPDATE`` per distinct user, one insert for the
+        events and one upsert for the rollups. The caller commits.
+        """
+        results = {}
+        for user_id, (amount, active_at) in GamificationService._append_events(db, events).items():
+            result = GamificationService._fold(db, user_id, amount, active_at)
+            if result is not None:
+                results[user_id] = result
+        return results
+    
+    @staticmethod
+    def _append_events(db: Session, events: List["XPEventRecord"]) -> Dict[int, Tuple[int, Optional[datetime]]]:
+        """
+        Insert ``events`` and add them to the daily rollups; returns each
+        user's XP sum and latest streak-counting activity time.
+        """
+        # Imported here: the services package imports this module
+        from services.daily_activity import daily_rollover
+        from services.dashboard import dashboards
+        from services.leaderboard import leaderboards
+        from services.upsert import upsert_add
         
-        today = datetime.utcnow().date()
-        last_active_dt = user.last_active_date
-        last_active = last_active_dt.date() if last_active_dt is not None else None  # type: ignore
+        if not events:
+            return {}
+        daily_rollover.ensure_scheduled()
+        db.execute(insert(XPEvent), [
+            {
+                "user_id": e.user_id,
+                "action_type": e.action_type,
+                "amount": e.amount,
+                "session_id": e.session_id,
+                "created_at": e.created_at,
+            }
+            for e in events
+        ])
         
-        if last_active:
-            days_diff = (today - last_active).days
-            if days_diff == 1:
-                user.current_streak += 1  # type: ignore
-            elif days_diff > 1:
-                user.current_streak = 1  # type: ignore
-        else:
-            user.current_streak = 1  # type: ignore
+        session_ids = {e.session_id for e in events if e.session_id is not None}
+        languages = dict(
+            db.query(StudySession.id, StudySession.language).filter(
+                StudySession.id.in_(session_ids), StudySession.language.isnot(None)
+            )
+        ) if session_ids else {}
         
-        user.last_active_date = datetime.utcnow()  # type: ignore
-        db.commit()
+        per_user: Dict[int, Tuple[int, Optional[datetime]]] = {}
+        per_language: Dict[Tuple[str, int], int] = {}
+        daily: Dict[Tuple[int, date], Dict] = {}
+        for e in events:
+            language = languages.get(e.session_id)
+            if language is not None:
+                per_language[(language, e.user_id)] = per_language.get((language, e.user_id), 0) + e.amount
+            
+            amount, latest = per_user.get(e.user_id, (0, None))
+            if e.streak and (latest is None or e.created_at > latest):
+                latest = e.created_at
+            per_user[e.user_id] = (amount + e.amount, latest)
+            
+            rollup = daily.get((e.user_id, e.created_at.date()))
+            if rollup is None:
+                rollup = {"user_id": e.user_id, "day": e.created_at.date(), "xp": 0, "events": 0}
+                rollup.update((name, 0) for name in ROLLUP_COUNTERS)
+                daily[(e.user_id, e.created_at.date())] = rollup
+            rollup["xp"] += e.amount
+            rollup["events"] += 1
+            for name, amount in e.rollup:
+                rollup[name] += amount
+        
+        upsert_add(
+            db, DailyUserActivity, ("user_id", "day"), daily.values(), ("xp", "events") + ROLLUP_COUNTERS
+        )
         
-        return user.current_streak  # type: ignore
+        for user_id, (amount, _) in per_user.items():
+            leaderboards.record(db, user_id, amount)
+            dashboards.invalidate_on_commit(db, user_id)
+        for (language, user_id), amount in per_language.items():
+            leaderboards.record(db, user_id, amount, language)
+        return per_user
+    
+    @staticmethod
+    def record_activity(
+        db: Session,
+        user_id: int,
+        xp_amount: int,
+        action_type: str,
+        update_streak: bool = True,
+        counters: Optional[Dict[str, int]] = None,
+        session_id: Optional[int] = None,
+        write_behind: Optional[bool] = None,
+        minutes: float = 0
+    ) -> ActivityResult:
+        """
+        Award XP, advance the daily streak, bump activity counters and add
+        ``minutes`` of study time, then grant any achievements whose
+        thresholds were crossed. The day's ``daily_user_activity`` row gets
+        the same increments. The caller commits.
+        
+        With write-behind (``XP_LEDGER_WRITE_BEHIND`` unless ``write_behind``
+        says otherwise) only the counters are updated now; the XP event is
+        buffered once the caller commits and folded by the ledger flush, so
+        the returned totals are ``None``.
+        """
+        from database import read_router
+        from services.xp_ledger import XPEventRecord, xp_ledger
+        
+        # The user's next reads come from the primary until replicas catch up
+        read_router.stick_on_commit(db, user_id)
+        record = XPEventRecord(
+            user_id, action_type, xp_amount, session_id, datetime.utcnow(), update_streak,
+            GamificationService._rollup_counts(action_type, counters, minutes)
+        )
+        if write_behind is None:
+            write_behind = settings.XP_LEDGER_WRITE_BEHIND
+        if not write_behind:
+            result = GamificationService._fold(
+                db, user_id, xp_amount, record.created_at if update_streak else None, counters, minutes
+            )
+            if result is None:
+                return ActivityResult(0, 0, 1, 0, [])
+            GamificationService._append_events(db, [record])
+            return result
+        
+        xp_ledger.enqueue(db, record)
+        values = GamificationService._counter_values(counters, minutes)
+        granted: List[AchievementRule] = []
+        if values:
+            from services.dashboard import dashboards
+            from services.event_bus import event_bus
+            
+            row = GamificationService._update_user(db, user_id, values)
+            dashboards.invalidate_on_commit(db, user_id)
+            # Counter thresholds (quiz_count) are crossed now; XP ones when the ledger folds the award
+            changes = GamificationService._counter_changes(counters, row[3:]) if row is not None else {}
+            if changes:
+                granted = GamificationService._grant_achievements(db, user_id, changes)
+            if granted:
+                event_bus.publish_on_commit(db, user_id, {
+                    "xp_delta": sum(rule.xp_reward for rule in granted),
+                    "achievements": [{"id": rule.id, "name": rule.name, "xp_reward": rule.xp_reward} for rule in granted],
+                })
+        return ActivityResult(xp_amount, None, None, None, [rule.id for rule in granted])
     
     @staticmethod
-    def check_achievements(db: Session, user: User):
-        achievements = db.query(Achievement).all()
-        
-        for achievement in achievements:
-            # Check if user already has this achievement
-            existing = db.query(UserAchievement).filter(
-                UserAchievement.user_id == user.id,
-                UserAchievement.achievement_id == achievement.id
+    async def record_activity_async(
+        db: AsyncSession,
+        user_id: int,
+        xp_amount: int,
+        action_type: str,
+        update_streak: bool = True,
+        counters: Optional[Dict[str, int]] = None,
+        session_id: Optional[int] = None,
+        write_behind: Optional[bool] = None,
+        minutes: float = 0
+    ) -> ActivityResult:
+        """``record_activity`` on an ``AsyncSession``. The caller commits."""
+        return await db.run_sync(
+            GamificationService.record_activity, user_id, xp_amount, action_type,
+            update_streak, counters, session_id, write_behind, minutes
+        )
+    
+    @staticmethod
+    async def check_achievements_async(
+        db: AsyncSession,
+        user_id: int,
+        changes: Optional[Dict[str, Tuple[Optional[int], int]]] = None
+    ) -> List[int]:
+        return await db.run_sync(GamificationService.check_achievements, user_id, changes)
+    
+    @staticmethod
+    def award_xp(db: Session, user_id: int, xp_amount: int, action_type: str) -> int:
+        result = GamificationService.record_activity(db, user_id, xp_amount, action_type, update_streak=False)
+        return result.xp_earned
+    
+    @staticmethod
+    def update_streak(db: Session, user_id: int) -> int:
+        result = GamificationService.record_activity(db, user_id, 0, "streak", write_behind=False)
+        return result.current_streak or 0
+    
+    @staticmethod
+    def check_achievements(
+        db: Session,
+        user_id: int,
+        changes: Optional[Dict[str, Tuple[Optional[int], int]]] = None
+    ) -> List[int]:
+        """
+        Grant achievements the user now qualifies for; returns the new achievement ids.
+        
+        ``changes`` maps criteria types to ``(old, new)`` stat values, and only
+        thresholds crossed by that change are considered, so a call that
+        crosses none costs no queries. Without it every criteria type is
+        checked against the user's current stats. The caller commits.
+        """
+        return [rule.id for rule in GamificationService._grant_achievements(db, user_id, changes)]
+    
+    @staticmethod
+    def _grant_achievements(
+        db: Session,
+        user_id: int,
+        changes: Optional[Dict[str, Tuple[Optional[int], int]]]
+    ) -> List[AchievementRule]:
+        if changes is None:
+            stats = db.query(*(getattr(User, column) for column in CRITERIA_STATS.values())).filter(
+                User.id == user_id
             ).first()
+            if stats is None:
+                return []
+            changes = {
+                criteria_type: (None, int(value or 0))
+                for criteria_type, value in zip(CRITERIA_STATS, stats)
+            }
+        
+        from services.upsert import insert_missing
+        
+        granted: List[AchievementRule] = []
+        # Rewards are XP too, so they can cross further xp thresholds: repeat until nothing new
+        while True:
+            candidates = {
+                rule.id: rule
+                for criteria_type, (old, new) in changes.items()
+                for rule in achievement_catalog.satisfied(db, criteria_type, old, new)
+            }
+            if not candidates:
+                return granted
             
-            if existing:
-                continue
+            # One query for everything the user already holds among the candidates
+            earned = {
+                achievement_id for (achievement_id,) in db.query(UserAchievement.achievement_id).filter(
+                    UserAchievement.user_id == user_id,
+                    UserAchievement.achievement_id.in_(list(candidates))
+                )
+            }
+            new_rules = [rule for rule in candidates.values() if rule.id not in earned]
+            if not new_rules:
+                return granted
             
-            # Check criteria
-            earned = False
-            if achievement.criteria_type == 'streak' and user.current_streak >= achievement.criteria_value:  # type: ignore
-                earned = True
-            elif achievement.criteria_type == 'quiz_count' and user.quizzes_completed >= achievement.criteria_value:  # type: ignore
-                earned = True
-            elif achievement.criteria_type == 'xp' and user.total_xp >= achievement.criteria_value:  # type: ignore
-                earned = True
+            # One multi-row insert for all grants, one atomic update for their rewards.
+            # A concurrent grant of the same achievement wins the unique key, and only
+            # the rows inserted here are rewarded.
+            now = datetime.utcnow()
+            inserted = insert_missing(db, UserAchievement, ("user_id", "achievement_id"), [
+                {"user_id": user_id, "achievement_id": rule.id, "earned_at": now}
+                for rule in new_rules
+            ])
+            new_rules = [rule for rule in new_rules if (user_id, rule.id) in inserted]
+            if not new_rules:
+                return granted
+            granted.extend(new_rules)
+            reward = sum(rule.xp_reward for rule in new_rules)
+            row = GamificationService._update_user(db, user_id, {
+                "badges_earned": User.badges_earned + len(new_rules),
+                "total_xp": User.total_xp + reward,
+                "total_points": User.total_points + reward,
+                "current_level": (User.total_xp + reward) // 1000 + 1,
+            })
+            if not reward or row is None:
+                return granted
+            from services.xp_ledger import XPEventRecord
             
-            if earned:
-                user_achievement = UserAchievement(
-                    user_id=user.id,  # type: ignore
-                    achievement_id=achievement.id
-                )
-                db.add(user_achievement)
-                user.badges_earned += 1  # type: ignore
-                user.total_xp += achievement.xp_reward  # type: ignore
-                db.commit()
+            # Rewards go through the ledger too, so totals can be rebuilt from it
+            GamificationService._append_events(
+                db, [XPEventRecord(user_id, "achievement", reward, None, now, False)]
+            )
+            total_xp = int(row[0] or 0)
+            changes = {"xp": (total_xp - reward, total_xp)}
@@ -1,14 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
-from database import get_db
-from models.user import User
+from database import get_async_db, read_router
 from models.session import StudySession, ChatMessage
 from services.agora_ai_service import agora_ai_service
+from services.chat_archive import chat_archiver, history_page
 from services.rag_service import RAGService
 from services.gamification_service import GamificationService
-from utils.auth import get_current_user
+from services.write_queue import write_queue
+from utils.auth import UserPrincipal, get_current_principal, get_read_db
 from config import settings
 
 router = APIRouter()
@@ -32,19 +35,23 @@ class LanguageChatRequest(BaseModel):
 @router.post("/start")
 async def start_language_session(
     request: LanguageStartRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         # Create session
-        session = StudySession(
-            user_id=current_user.id,
-            session_type="language",
-            language=request.language
-        )
-        db.add(session)
-        db.commit()
-        db.refresh(session)
+        def create_session(db: Session) -> int:
+            session = StudySession(
+                user_id=current_user.id,
+                session_type="language",
+                language=request.language
+            )
+            db.add(session)
+            db.flush()
+            read_router.stick_on_commit(db, current_user.id)
+            return int(session.id)  # type: ignore
+        
+        session_id = await write_queue.submit(db, create_session)
         
         # Get Agora AI Language Session
         ai_session = await agora_ai_service.start_language_session(
@@ -57,7 +64,7 @@ async def start_language_session(
             raise HTTPException(status_code=500, detail="Failed to start language session")
         
         return {
-            "session_id": session.id,
+            "session_id": session_id,
             "ai_tutor_name": ai_session.get("ai_tutor_name"),
             "language": request.language,
             "proficiency_level": request.proficiency_level,
@@ -68,14 +75,14 @@ async def start_language_session(
         }
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/exercise")
 async def get_language_exercise(
     request: LanguageExerciseRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         exercise = await agora_ai_service.generate_language_exercise(
@@ -98,8 +105,8 @@ async def get_pronunciation_feedback(
     phrase: str,
     language: str,
     session_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         feedback = await agora_ai_service.get_pronunciation_feedback(
@@ -120,31 +127,30 @@ async def get_pronunciation_feedback(
 @router.post("/chat")
 async def language_tutor_chat(
     request: LanguageChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db),
+    read_db: AsyncSession = Depends(get_read_db)
 ):
     """Chat with AI language tutor with RAG support from uploaded materials"""
     try:
         # Verify session
-        session = db.query(StudySession).filter(
+        session = (await db.execute(select(StudySession).where(
             StudySession.id == request.session_id,
             StudySession.user_id == current_user.id
-        ).first()
+        ))).scalar_one_or_none()
         
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        # Get conversation history for context
-        recent_messages = db.query(ChatMessage).filter(
-            ChatMessage.session_id == request.session_id
-        ).order_by(ChatMessage.created_at.desc()).limit(6).all()
+        # Get conversation history for context (the archive too, for a session resumed after a long break)
+        recent_messages, _ = await read_db.run_sync(history_page, request.session_id, 6)
         
         conversation_history = []
         for msg in reversed(recent_messages):
-            role = "user" if msg.message_type == "user" else "assistant"
+            role = "user" if msg["message_type"] == "user" else "assistant"
             conversation_history.append({
                 "role": role,
-                "content": msg.content
+                "content": msg["content"]
             })
         
         # Get AI tutor response with RAG
@@ -155,35 +161,26 @@ async def language_tutor_chat(
             conversation_history=conversation_history
         )
         
-        # Save messages
-        user_msg = ChatMessage(
-            session_id=request.session_id,
-            message_type="user",
-            content=request.message
-        )
-        ai_msg = ChatMessage(
-            session_id=request.session_id,
-            message_type="ai",
-            content=response
-        )
-        
-        db.add(user_msg)
-        db.add(ai_msg)
-        
-        # Award XP for language practice
-        xp_earned = gamification_service.award_xp(
-            db=db,
-            user_id=int(current_user.id),
-            xp_amount=settings.XP_PER_CHAT,
-            action_type="language_chat"
-        )
-        
-        # Update session
-        db.query(StudySession).filter(StudySession.id == session.id).update({
-            "xp_earned": StudySession.xp_earned + xp_earned
-        })
-        
-        db.commit()
+        # Save messages, award XP for language practice and update the session
+        def save_exchange(db: Session) -> int:
+            db.add_all([
+                ChatMessage(session_id=request.session_id, message_type="user", content=request.message),
+                ChatMessage(session_id=request.session_id, message_type="ai", content=response),
+            ])
+            xp_earned = gamification_service.record_activity(
+                db=db,
+                user_id=int(current_user.id),
+                xp_amount=settings.XP_PER_CHAT,
+                action_type="language_chat",
+                session_id=request.session_id
+            ).xp_earned
+            db.execute(update(StudySession).where(StudySession.id == request.session_id).values(
+                xp_earned=StudySession.xp_earned + xp_earned
+            ))
+            return xp_earned
+        
+        xp_earned = await write_queue.submit(db, save_exchange)
+        chat_archiver.ensure_scheduled()
         
         return {
             "response": response,
@@ -192,5 +189,5 @@ async def language_tutor_chat(
         }
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,9 @@
+"""study_materials.ingest_metrics: per-stage ingest timings, added after the first schema."""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection) -> None:
+    columns = {column["name"] for column in inspect(connection).get_columns("study_materials")}
+    if "ingest_metrics" not in columns:
+        connection.execute(text("ALTER TABLE study_materials ADD COLUMN ingest_metrics JSON"))
@@ -0,0 +1,33 @@
+"""
+Indexes for the lookups made on every request. Until now only primary keys
+and ``users.email`` were indexed, so each of these scanned its whole table.
+
+* recent chat messages of a session, newest first;
+* a user's sessions, newest first (``/user/sessions``);
+* whether a user holds an achievement;
+* a user's quizzes, through their sessions (dashboard);
+* a quiz's questions;
+* a session's materials.
+
+Names match the ``Index`` declarations on the models, so a database built by
+``create_all`` already has them and this is a no-op there. On Postgres
+``CREATE INDEX`` blocks writes to the table while it builds. Apply this to a
+large production database at a quiet time, or create the indexes
+``CONCURRENTLY`` by hand first.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+INDEXES = (
+    ("ix_chat_messages_session_timestamp", "chat_messages", "session_id, timestamp"),
+    ("ix_study_sessions_user_start", "study_sessions", "user_id, start_time DESC"),
+    ("ix_user_achievements_user_achievement", "user_achievements", "user_id, achievement_id"),
+    ("ix_quizzes_session", "quizzes", "session_id"),
+    ("ix_quiz_questions_quiz", "quiz_questions", "quiz_id"),
+    ("ix_study_materials_session", "study_materials", "session_id"),
+)
+
+
+def upgrade(connection: Connection) -> None:
+    for name, table, columns in INDEXES:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
@@ -0,0 +1,15 @@
+"""
+Chat history is paged by keyset on ``(session_id, timestamp, id)``, so the
+session/timestamp index gains ``id`` as a tie-breaker and replaces the one
+from 0002. ``chat_archive_segments`` is a new table, which ``create_all``
+creates.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection) -> None:
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_timestamp_id ON chat_messages (session_id, timestamp, id)"
+    ))
+    connection.execute(text("DROP INDEX IF EXISTS ix_chat_messages_session_timestamp"))
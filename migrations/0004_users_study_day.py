@@ -0,0 +1,24 @@
+"""
+users.study_day: the UTC day ``study_time_today`` belongs to. Writers stamp
+it with the minutes, and the rollover resets only rows stamped before today.
+Values still present are today's (the rollover already reset older ones,
+except for users without ``last_active_date``, which it never matched), so
+they are stamped with today.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection) -> None:
+    columns = {column["name"] for column in inspect(connection).get_columns("users")}
+    if "study_day" not in columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN study_day DATE"))
+    connection.execute(
+        text(
+            "UPDATE users SET study_day = :today "
+            "WHERE study_day IS NULL AND study_time_today != 0 AND last_active_date IS NOT NULL"
+        ),
+        {"today": datetime.utcnow().date()},
+    )
@@ -0,0 +1,9 @@
+"""refresh_tokens.grace_used_at: marks the one grace-window sibling a rotated token may get."""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection) -> None:
+    columns = {column["name"] for column in inspect(connection).get_columns("refresh_tokens")}
+    if "grace_used_at" not in columns:
+        connection.execute(text("ALTER TABLE refresh_tokens ADD COLUMN grace_used_at TIMESTAMP"))
@@ -0,0 +1,33 @@
+"""
+user_achievements(user_id, achievement_id) becomes unique.
+
+Two concurrent requests could each see an achievement as not yet held and
+both insert it, rewarding it twice. Duplicates are removed first, keeping the
+earliest grant, and the affected users' ``badges_earned`` is recounted. XP
+already paid for a duplicate stays in ``xp_events`` and isn't clawed back.
+The unique index then replaces the plain one from 0002.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+
+def upgrade(connection: Connection) -> None:
+    duplicated = [user_id for (user_id,) in connection.execute(text(
+        "SELECT DISTINCT user_id FROM user_achievements "
+        "GROUP BY user_id, achievement_id HAVING COUNT(*) > 1"
+    ))]
+    if duplicated:
+        connection.execute(text(
+            "DELETE FROM user_achievements WHERE id NOT IN "
+            "(SELECT MIN(id) FROM user_achievements GROUP BY user_id, achievement_id)"
+        ))
+        for user_id in duplicated:
+            connection.execute(text(
+                "UPDATE users SET badges_earned = "
+                "(SELECT COUNT(*) FROM user_achievements WHERE user_id = :user_id) WHERE id = :user_id"
+            ), {"user_id": user_id})
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_achievements_user_achievement "
+        "ON user_achievements (user_id, achievement_id)"
+    ))
+    connection.execute(text("DROP INDEX IF EXISTS ix_user_achievements_user_achievement"))
@@ -0,0 +1,94 @@
+"""
+Versioned schema migrations.
+
+``Base.metadata.create_all`` creates missing tables but never changes one
+that already exists. A database created by an older checkout, such as
+``local_dev.db``, therefore silently lacks newer columns and indexes.
+
+Each module in this package named ``NNNN_description.py`` defines
+``upgrade(connection)``. ``upgrade(engine)`` first creates any missing
+tables. It then applies, in version order, every migration whose version
+isn't recorded in ``schema_migrations``. Each migration runs in its own
+transaction.
+
+Migrations are plain DDL and don't import the models, since the models keep
+changing after a migration is written. The DDL must be idempotent
+(``IF NOT EXISTS``, column checks). A fresh database already has everything
+``create_all`` made by the time its migrations are first applied.
+
+    python -m migrations [upgrade|status] [--url sqlite:///...]
+"""
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import importlib
+import pkgutil
+import re
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+_MODULE_NAME = re.compile(r"^(\d{4})_\w+$")
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", String(4), primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: str
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def migrations() -> List[Migration]:
+    """Every migration in this package, oldest first."""
+    found = []
+    for module in pkgutil.iter_modules(__path__):
+        match = _MODULE_NAME.match(module.name)
+        if match:
+            upgrade_fn = importlib.import_module(f"{__name__}.{module.name}").upgrade
+            found.append(Migration(match.group(1), module.name, upgrade_fn))
+    return sorted(found)
+
+
+def _applied(engine: Engine) -> Dict[str, datetime]:
+    with engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        rows = connection.execute(select(schema_migrations.c.version, schema_migrations.c.applied_at))
+        return {version: applied_at for version, applied_at in rows}
+
+
+def upgrade(engine: Engine) -> List[str]:
+    """Create missing tables and apply pending migrations; returns the names applied."""
+    from database_quest import Base
+    
+    Base.metadata.create_all(bind=engine)
+    applied = _applied(engine)
+    names = []
+    for migration in migrations():
+        if migration.version in applied:
+            continue
+        try:
+            with engine.begin() as connection:
+                migration.upgrade(connection)
+                connection.execute(schema_migrations.insert().values(
+                    version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another process starting up recorded it first
+            continue
+        names.append(migration.name)
+    return names
+
+
+def status(engine: Engine) -> List[Tuple[Migration, Optional[datetime]]]:
+    """Each migration with when it was applied, or None if it is pending."""
+    applied = _applied(engine)
+    return [(migration, applied.get(migration.version)) for migration in migrations()]
+
+
+__all__ = ["Migration", "migrations", "schema_migrations", "status", "upgrade"]
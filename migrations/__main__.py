@@ -0,0 +1,30 @@
+import argparse
+
+from sqlalchemy import create_engine
+
+from migrations import status, upgrade
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m migrations", description="Apply or list schema migrations")
+    parser.add_argument("command", nargs="?", choices=("upgrade", "status"), default="upgrade")
+    parser.add_argument("--url", help="database URL (default: the configured engine)")
+    args = parser.parse_args()
+
+    from database import engine
+    import user, session, gamification  # noqa: F401  (register all tables)
+    if args.url:
+        engine = create_engine(args.url)
+
+    if args.command == "upgrade":
+        applied = upgrade(engine)
+        for name in applied:
+            print(f"applied {name}")
+        print(f"{engine.url.render_as_string(hide_password=True)} is up to date ({len(applied)} applied)")
+    else:
+        for migration, applied_at in status(engine):
+            print(f"{migration.name:<40} {applied_at.isoformat(sep=' ') if applied_at else 'pending'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
-from gamification import Achievement, UserAchievement, Exam
+from gamification import Achievement, UserAchievement, Exam, XPEvent, DailyUserActivity
 
-__all__ = ["Achievement", "UserAchievement", "Exam"]
+__all__ = ["Achievement", "UserAchievement", "Exam", "XPEvent", "DailyUserActivity"]
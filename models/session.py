@@ -2,6 +2,7 @@ from session import (
     StudySession,
     StudyMaterial,
     ChatMessage,
+    ChatArchiveSegment,
     Quiz,
     QuizQuestion,
 )
@@ -10,6 +11,7 @@ __all__ = [
     "StudySession",
     "StudyMaterial",
     "ChatMessage",
+    "ChatArchiveSegment",
     "Quiz",
     "QuizQuestion",
 ]
@@ -1,41 +1,52 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models.user import User
 from models.session import StudySession
-from utils.auth import get_current_user
+from services.daily_activity import activity_history
+from services.leaderboard import leaderboards
+from utils.auth import UserPrincipal, get_current_principal, get_read_db
 
 router = APIRouter()
 
 @router.get("/user/profile")
 async def get_user_profile(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    read_db: AsyncSession = Depends(get_read_db),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    user = (await read_db.execute(select(User).where(User.id == current_user.id))).scalar_one_or_none()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
     return {
-        "user_id": current_user.id,
-        "name": current_user.name,
-        "email": current_user.email,
-        "total_xp": current_user.total_xp,
-        "total_points": current_user.total_points,
-        "current_level": current_user.current_level,
-        "current_streak": current_user.current_streak,
-        "study_time_today": current_user.study_time_today,
-        "quizzes_completed": current_user.quizzes_completed,
-        "badges_earned": current_user.badges_earned,
-        "materials_uploaded": current_user.materials_uploaded,
-        "study_sessions": current_user.study_sessions,
-        "quiz_accuracy": current_user.quiz_accuracy
+        "user_id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "total_xp": user.total_xp,
+        "total_points": user.total_points,
+        "current_level": user.current_level,
+        "current_streak": user.current_streak,
+        # Live rank from the in-memory leaderboard; global_rank is its periodic snapshot.
+        # The board is loaded once, from the primary, and then follows its commits.
+        "global_rank": (await db.run_sync(leaderboards.board)).rank(user.id) or user.global_rank,
+        "study_time_today": user.study_time_today,
+        "quizzes_completed": user.quizzes_completed,
+        "badges_earned": user.badges_earned,
+        "materials_uploaded": user.materials_uploaded,
+        "study_sessions": user.study_sessions,
+        "quiz_accuracy": user.quiz_accuracy
     }
 
 @router.get("/user/sessions")
 async def get_user_sessions(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    sessions = db.query(StudySession).filter(
+    sessions = (await db.execute(select(StudySession).where(
         StudySession.user_id == current_user.id
-    ).order_by(StudySession.start_time.desc()).limit(20).all()
+    ).order_by(StudySession.start_time.desc()).limit(20))).scalars().all()
     
     return [
         {
@@ -48,3 +59,12 @@ async def get_user_sessions(
         }
         for s in sessions
     ]
+
+@router.get("/user/activity")
+async def get_user_activity(
+    days: int = Query(7, ge=1, le=366),
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Per-day XP, study minutes, chats, quizzes and uploads, oldest first"""
+    return {"days": await db.run_sync(activity_history, current_user.id, days)}
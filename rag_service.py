@@ -1,6 +1,6 @@
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from services.text_splitter import StructuredTextSplitter
 
 # Initialize ChromaDB
 embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
@@ -8,7 +8,7 @@ vector_store = Chroma(persist_directory="./chroma_db", embedding_function=embedd
 
 def store_in_vector_db(text, filename):
     # Split text into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    text_splitter = StructuredTextSplitter(chunk_tokens=256)
     chunks = text_splitter.split_text(text)
     
     # Store in ChromaDB
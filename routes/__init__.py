@@ -1,3 +1,3 @@
 """Routes package exposing sub-routers."""
 
-__all__ = ["auth", "chat", "upload", "quiz", "language", "progress"]
+__all__ = ["auth", "chat", "upload", "quiz", "language", "progress", "metrics", "study_pack", "leaderboard", "dashboard", "heartbeat", "realtime"]
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from database import get_async_db
+from services.dashboard import dashboards
+from utils.auth import UserPrincipal, get_current_principal
+
+router = APIRouter()
+
+@router.get("/performance-dashboard")
+async def get_performance_dashboard(
+    if_none_match: Optional[str] = Header(None),
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """The current user's dashboard snapshot; 304 when the client's copy is current"""
+    snapshot = await db.run_sync(dashboards.get, current_user.id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # The snapshot is per user and changes as they study: revalidate every time
+    headers = {"ETag": snapshot.etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and snapshot.etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+__all__ = ["router"]
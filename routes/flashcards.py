@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List
-from database import get_db
-from models.user import User
+from database import get_async_db
 from services.rag_service import RAGService
 from services.gamification_service import GamificationService
-from utils.auth import get_current_user
+from services.write_queue import write_queue
+from utils.auth import UserPrincipal, get_current_principal
 from config import settings
 
 router = APIRouter()
@@ -24,8 +25,8 @@ class FlashcardResponse(BaseModel):
 @router.post("/flashcards/generate", response_model=FlashcardResponse)
 async def generate_flashcards(
     request: FlashcardGenerateRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate flashcards from uploaded study materials"""
     try:
@@ -39,14 +40,16 @@ async def generate_flashcards(
             raise HTTPException(status_code=500, detail="Failed to generate flashcards")
         
         # Award XP for generating flashcards
-        xp_earned = gamification_service.award_xp(
-            db=db,
-            user_id=int(current_user.id),
-            xp_amount=settings.XP_PER_CHAT,  # Same as chat
-            action_type="flashcard"
-        )
+        def award(db: Session) -> None:
+            gamification_service.record_activity(
+                db=db,
+                user_id=int(current_user.id),
+                xp_amount=settings.XP_PER_CHAT,  # Same as chat
+                action_type="flashcard",
+                session_id=request.session_id
+            )
         
-        db.commit()
+        await write_queue.submit(db, award)
         
         return FlashcardResponse(
             flashcards=flashcards,
@@ -54,5 +57,5 @@ async def generate_flashcards(
         )
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.session import StudySession
+from services.session_heartbeats import heartbeats
+from utils.auth import UserPrincipal, get_current_principal, get_read_db
+
+router = APIRouter()
+
+@router.post("/sessions/{session_id}/heartbeat", status_code=204)
+async def session_heartbeat(
+    session_id: int,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Mark the session as active now; time on task is written in periodic batches"""
+    owner = heartbeats.owner(session_id)
+    if owner is None:
+        # First heartbeat since the session was opened (or closed as idle) on this worker
+        owner = await db.scalar(select(StudySession.user_id).where(StudySession.id == session_id))
+    if owner != current_user.id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    heartbeats.beat(session_id, current_user.id)
+    return Response(status_code=204)
+
+__all__ = ["router"]
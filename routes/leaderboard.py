@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from typing import List, Optional
+from database import get_async_db
+from models.user import User
+from services.leaderboard import LeaderboardEntry, leaderboards
+from utils.auth import UserPrincipal, get_current_principal, get_read_db
+
+router = APIRouter()
+
+class LeaderboardRow(BaseModel):
+    rank: int
+    user_id: int
+    name: str
+    xp: int
+
+class LeaderboardResponse(BaseModel):
+    language: Optional[str]
+    total_users: int
+    entries: List[LeaderboardRow]
+
+class MyRankResponse(LeaderboardResponse):
+    rank: Optional[int]
+    xp: int
+
+async def _rows(db: AsyncSession, entries: List[LeaderboardEntry]) -> List[LeaderboardRow]:
+    # One query for the names on this page
+    names = {}
+    if entries:
+        result = await db.execute(select(User.id, User.name).where(User.id.in_([e.user_id for e in entries])))
+        names = dict(result.all())
+    return [
+        LeaderboardRow(rank=e.rank, user_id=e.user_id, name=names.get(e.user_id, ""), xp=e.score)
+        for e in entries
+    ]
+
+@router.get("/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    language: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: UserPrincipal = Depends(get_current_principal),
+    read_db: AsyncSession = Depends(get_read_db),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Top users by XP, globally or for one language"""
+    board = await db.run_sync(leaderboards.board, language)
+    return LeaderboardResponse(language=language, total_users=len(board), entries=await _rows(read_db, board.top(limit)))
+
+@router.get("/leaderboard/me", response_model=MyRankResponse)
+async def get_my_rank(
+    language: Optional[str] = None,
+    radius: int = Query(5, ge=0, le=50),
+    current_user: UserPrincipal = Depends(get_current_principal),
+    read_db: AsyncSession = Depends(get_read_db),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """The current user's rank with ``radius`` neighbours above and below"""
+    board = await db.run_sync(leaderboards.board, language)
+    return MyRankResponse(
+        language=language,
+        total_users=len(board),
+        rank=board.rank(current_user.id),
+        xp=board.score(current_user.id) or 0,
+        entries=await _rows(read_db, board.around(current_user.id, radius))
+    )
+
+__all__ = ["router"]
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from services.metrics import metrics
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics():
+    """Process-local histograms, counters and gauges (ingest stages, caches, ...)"""
+    return metrics.snapshot()
+
+__all__ = ["router"]
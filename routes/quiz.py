@@ -1,5 +1,153 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import List
+from database import get_async_db
+from models.session import Quiz, StudySession
+from services.rag_service import RAGService
+from services.gamification_service import GamificationService
+from services.quizzes import create_quiz, grade_quiz, normalize_answer
+from services.write_queue import write_queue
+from utils.auth import UserPrincipal, get_current_principal
+from config import settings
 
 router = APIRouter()
+rag_service = RAGService()
+gamification_service = GamificationService()
+
+class QuizGenerateRequest(BaseModel):
+    session_id: int
+    num_questions: int = 5
+    difficulty: str = "medium"
+
+class QuizQuestionOut(BaseModel):
+    id: int
+    question: str
+    option_a: str
+    option_b: str
+    option_c: str
+    option_d: str
+
+class QuizResponse(BaseModel):
+    quiz_id: int
+    session_id: int
+    questions: List[QuizQuestionOut]
+
+class QuizAnswer(BaseModel):
+    question_id: int
+    answer: str  # "A".."D"
+
+class QuizSubmitRequest(BaseModel):
+    quiz_id: int
+    answers: List[QuizAnswer]
+
+class QuizResultResponse(BaseModel):
+    quiz_id: int
+    score: float
+    correct_answers: int
+    total_questions: int
+    xp_earned: int
+
+@router.post("/quiz/generate", response_model=QuizResponse)
+async def generate_quiz(
+    request: QuizGenerateRequest,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Generate a quiz from the session's materials and store it for grading"""
+    owned = (await db.execute(select(StudySession.id).where(
+        StudySession.id == request.session_id,
+        StudySession.user_id == current_user.id
+    ))).first()
+    if not owned:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    questions = await rag_service.generate_quiz(
+        session_id=request.session_id,
+        num_questions=request.num_questions,
+        difficulty=request.difficulty
+    )
+    if not questions:
+        raise HTTPException(status_code=500, detail="Failed to generate quiz")
+
+    # Quiz row plus one multi-row insert for its questions
+    quiz_id, question_ids = await write_queue.submit(
+        db, lambda db: create_quiz(db, request.session_id, questions)
+    )
+
+    return QuizResponse(
+        quiz_id=quiz_id,
+        session_id=request.session_id,
+        questions=[
+            QuizQuestionOut(
+                id=question_id,
+                question=q["question"],
+                option_a=q["option_a"],
+                option_b=q["option_b"],
+                option_c=q["option_c"],
+                option_d=q["option_d"]
+            )
+            for question_id, q in zip(question_ids, questions)
+        ]
+    )
+
+@router.post("/quiz/submit", response_model=QuizResultResponse)
+async def submit_quiz(
+    request: QuizSubmitRequest,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Grade a quiz in a few set-based statements and award quiz XP"""
+    answers = {}
+    for item in request.answers:
+        answer = normalize_answer(item.answer)
+        if answer is None:
+            raise HTTPException(status_code=400, detail=f"Invalid answer for question {item.question_id}")
+        answers[item.question_id] = answer
+
+    quiz = (await db.execute(select(Quiz.completed).join(
+        StudySession, StudySession.id == Quiz.session_id
+    ).where(
+        Quiz.id == request.quiz_id,
+        StudySession.user_id == current_user.id
+    ))).first()
+    if not quiz:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    if quiz.completed:
+        raise HTTPException(status_code=409, detail="Quiz already submitted")
+
+    def grade(db: Session):
+        result = grade_quiz(db, current_user.id, request.quiz_id, answers)
+        if result is None:
+            # Submitted concurrently; the first submission stands
+            raise HTTPException(status_code=409, detail="Quiz already submitted")
+        xp_earned = gamification_service.record_activity(
+            db=db,
+            user_id=current_user.id,
+            xp_amount=settings.XP_PER_QUIZ,
+            action_type="quiz",
+            counters={"quizzes_completed": 1},
+            session_id=result.session_id
+        ).xp_earned
+        db.execute(update(StudySession).where(StudySession.id == result.session_id).values(
+            xp_earned=StudySession.xp_earned + xp_earned
+        ))
+        return result, xp_earned
+
+    try:
+        result, xp_earned = await write_queue.submit(db, grade)
+    except HTTPException:
+        await db.rollback()
+        raise
+
+    return QuizResultResponse(
+        quiz_id=request.quiz_id,
+        score=result.score,
+        correct_answers=result.correct_answers,
+        total_questions=result.total_questions,
+        xp_earned=xp_earned
+    )
 
 __all__ = ["router"]
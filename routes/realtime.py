@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+from database import get_async_db
+from services.event_bus import event_bus
+from services.metrics import metrics
+from utils.auth import get_current_principal
+
+router = APIRouter()
+
+@router.websocket("/ws/progress")
+async def progress_updates(
+    websocket: WebSocket,
+    token: str = Query(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Push XP, level and achievement updates to the user's open tab as they commit"""
+    # Browsers can't set headers on a WebSocket handshake, so the access token comes in the query
+    try:
+        principal = await get_current_principal(token=token, db=db)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        # Don't hold a pooled connection for the lifetime of the socket
+        await db.close()
+    
+    await websocket.accept()
+    subscription = event_bus.subscribe(principal.id)
+    metrics.inc("event_bus_connections_total")
+    
+    async def send_updates():
+        while True:
+            message = await subscription.queue.get()
+            await websocket.send_json(message)
+    
+    sender = asyncio.create_task(send_updates())
+    try:
+        # Nothing is expected from the client; reading just notices the disconnect
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        event_bus.unsubscribe(subscription)
+
+__all__ = ["router"]
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from typing import List
+from models.session import StudySession
+from services.rag_service import RAGService
+from utils.auth import UserPrincipal, get_current_principal, get_read_db
+
+router = APIRouter()
+rag_service = RAGService()
+
+class StudyPackRequest(BaseModel):
+    session_id: int
+    num_questions: int = 5
+    num_cards: int = 10
+    difficulty: str = "medium"
+    refresh: bool = False
+
+class StudyPackResponse(BaseModel):
+    session_id: int
+    summary: str
+    questions: List[dict]
+    flashcards: List[dict]
+
+@router.post("/study-pack/generate", response_model=StudyPackResponse)
+async def generate_study_pack(
+    request: StudyPackRequest,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Generate quiz questions, flashcards and a summary for a session in one LLM call"""
+    session = await db.scalar(select(StudySession.id).where(
+        StudySession.id == request.session_id,
+        StudySession.user_id == current_user.id
+    ))
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    pack = await rag_service.generate_study_pack(
+        session_id=request.session_id,
+        num_questions=request.num_questions,
+        num_cards=request.num_cards,
+        difficulty=request.difficulty,
+        refresh=request.refresh
+    )
+    
+    return StudyPackResponse(
+        session_id=request.session_id,
+        summary=pack["summary"],
+        questions=pack["questions"][:request.num_questions],
+        flashcards=pack["flashcards"][:request.num_cards]
+    )
+
+__all__ = ["router"]
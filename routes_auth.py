@@ -1,12 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 # Use plain str for email to avoid requiring the 'email-validator' package in dev
 # (production: prefer EmailStr and install 'pydantic[email]')
-from database import get_db
+from database import get_async_db, read_router
 from models.user import User
-from utils.auth import verify_password, get_password_hash, create_access_token
+from utils.auth import verify_password_async, get_password_hash_async, create_access_token
+from services.refresh_tokens import (
+    RefreshTokenError,
+    issue_refresh_token,
+    refresh_token_purger,
+    revoke_refresh_token,
+    rotate_refresh_token,
+)
+from services.write_queue import write_queue
+from typing import Optional
 from datetime import timedelta
 from config import settings
 
@@ -20,99 +31,144 @@ class UserRegister(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+def _access_token(user_id: int) -> str:
+    return create_access_token(
+        data={"sub": str(user_id)},
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+def _tokens(user_id: int, refresh_token: str) -> dict:
+    refresh_token_purger.ensure_scheduled()
+    return {
+        "access_token": _access_token(user_id),
+        "token_type": "bearer",
+        "refresh_token": refresh_token
+    }
+
+def _create_user(name: str, email: str, hashed_password: str):
+    """Write unit: insert the user and start its first login; returns (user_id, refresh_token)."""
+    def create(db: Session):
+        user = User(name=name, email=email, hashed_password=hashed_password)
+        db.add(user)
+        db.flush()
+        read_router.stick_on_commit(db, int(user.id))  # type: ignore
+        return int(user.id), issue_refresh_token(db, int(user.id))  # type: ignore
+    return create
+
+async def _issue_tokens(db: AsyncSession, user_id: int, new_hash: Optional[str] = None) -> dict:
+    """Access token plus the first refresh token of a new login."""
+    def start_login(db: Session) -> str:
+        if new_hash:
+            db.execute(update(User).where(User.id == user_id).values(hashed_password=new_hash))
+        return issue_refresh_token(db, user_id)
+    
+    return _tokens(user_id, await write_queue.submit(db, start_login))
 
 @router.post("/register", response_model=Token)
-async def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, db: AsyncSession = Depends(get_async_db)):
     # Check if user exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = (await db.execute(select(User).where(User.email == user_data.email))).scalar_one_or_none()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    # Create new user
-    hashed_password = get_password_hash(user_data.password)
-    new_user = User(
-        name=user_data.name,
-        email=user_data.email,
-        hashed_password=hashed_password
-    )
-    
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    
-    # Create token
-    access_token = create_access_token(
-        data={"sub": str(new_user.id)},
-        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    # Create new user and its tokens
+    hashed_password = await get_password_hash_async(user_data.password)
+    user_id, refresh_token = await write_queue.submit(
+        db, _create_user(user_data.name, user_data.email, hashed_password)
     )
-    
-    return {"access_token": access_token, "token_type": "bearer"}
+    return _tokens(user_id, refresh_token)
 
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).filter(User.email == form_data.username).first()
+    user = (await db.execute(select(User).where(User.email == form_data.username))).scalar_one_or_none()
     
-    if not user or not verify_password(form_data.password, str(user.hashed_password)):
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await verify_password_async(form_data.password, str(user.hashed_password))
+    
+    if not user or not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = create_access_token(
-        data={"sub": str(user.id)},
-        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
+    # Rehash transparently when the configured bcrypt cost has changed
+    return await _issue_tokens(db, int(user.id), new_hash)  # type: ignore
+
+@router.post("/refresh", response_model=Token)
+async def refresh(request: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    """Rotate a refresh token and mint a new access token (no password, no bcrypt)."""
+    try:
+        # Commits by itself, also when it revokes a reused token's family
+        user_id, refresh_token = await write_queue.submit(
+            db, lambda db: rotate_refresh_token(db, request.refresh_token), alone=True
+        )
+    except RefreshTokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
-    return {"access_token": access_token, "token_type": "bearer"}
+    return _tokens(user_id, refresh_token)
+
+@router.post("/logout")
+async def logout(request: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    """Revoke the refresh token and every token rotated from the same login."""
+    await write_queue.submit(db, lambda db: revoke_refresh_token(db, request.refresh_token), alone=True)
+    return {"message": "Logged out"}
 
 # Dev-only: Allow login with any password for testing
 @router.post("/dev-login", response_model=Token)
 async def dev_login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """DEV ONLY: Login with any password. Creates user if doesn't exist."""
     email = form_data.username
     print(f"[DEV] Attempting dev-login for email: {email}")
     
     try:
-        user = db.query(User).filter(User.email == email).first()
+        user = (await db.execute(select(User).where(User.email == email))).scalar_one_or_none()
         
         if not user:
             # Create user on first login for dev convenience
             print(f"[DEV] Creating new user: {email}")
             try:
-                hashed_password = get_password_hash(form_data.password)
+                hashed_password = await get_password_hash_async(form_data.password)
+            except HTTPException:
+                raise
             except Exception as e:
                 # If password hashing fails (e.g., bcrypt issue), use plaintext for dev
                 print(f"[DEV] Password hashing failed ({e}), using plaintext for dev")
                 hashed_password = form_data.password
             
-            user = User(
-                email=email,
-                name=email.split('@')[0],
-                hashed_password=hashed_password
+            user_id, refresh_token = await write_queue.submit(
+                db, _create_user(email.split('@')[0], email, hashed_password)
             )
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            print(f"[DEV] User created successfully: {user.id}")
-        
-        access_token = create_access_token(
-            data={"sub": str(user.id)},
-            expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        )
+            print(f"[DEV] User created successfully: {user_id}")
+            tokens = _tokens(user_id, refresh_token)
+        else:
+            user_id = int(user.id)  # type: ignore
+            tokens = await _issue_tokens(db, user_id)
         
-        print(f"[DEV] Token generated for user {user.id}")
-        return {"access_token": access_token, "token_type": "bearer"}
+        print(f"[DEV] Token generated for user {user_id}")
+        return tokens
     
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[DEV] Login error: {e}")
         raise HTTPException(status_code=500, detail=f"Login error: {str(e)}")
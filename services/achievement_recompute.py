@@ -0,0 +1,171 @@
+"""
+Offline re-evaluation of the whole achievement catalog against every user.
+
+``GamificationService.check_achievements`` only looks at thresholds crossed
+by an activity, so a new or re-tuned achievement reaches nobody until their
+next XP event, and users who already passed the threshold never get it. This
+job grants everything the catalog says users have earned, with set-based SQL
+over chunks of user ids. No user row is loaded into Python.
+
+Per chunk, in one transaction:
+
+1. ``INSERT INTO user_achievements ... SELECT`` over users joined to every
+   achievement whose criteria they meet and that they don't hold yet, stamped
+   with this pass's ``earned_at``;
+2. ``INSERT INTO xp_events ... SELECT`` an ``achievement`` ledger event for
+   each grant with a reward;
+3. a bulk ``UPDATE`` adding the stamped grants to ``badges_earned`` and their
+   rewards to ``total_xp`` and ``total_points``, as the live grant does.
+
+Rewards can lift users past further XP thresholds, so steps 1-3 repeat until
+a pass grants nothing. Then ``current_level`` is recomputed from
+``total_xp`` for the whole chunk. Achievements are never revoked, and changed
+rewards aren't applied to past grants. ``daily_user_activity`` isn't touched;
+``python -m services.xp_ledger rebuild`` folds the reward events into it.
+
+    python -m services.achievement_recompute [--chunk-size 10000] [--dry-run]
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+import argparse
+import time
+
+from sqlalchemy import and_, exists, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from models.user import User
+from models.gamification import Achievement, UserAchievement, XPEvent
+from gamification_service import CRITERIA_STATS
+from services.upsert import dialect_insert
+
+
+def _earned_criteria():
+    """Join condition: the user meets the achievement's criteria."""
+    return and_(
+        Achievement.criteria_value.isnot(None),
+        or_(*(
+            and_(Achievement.criteria_type == criteria_type, getattr(User, column) >= Achievement.criteria_value)
+            for criteria_type, column in CRITERIA_STATS.items()
+        ))
+    )
+
+
+def _missing_grants(low: int, high: int):
+    """(user_id, achievement_id) pairs earned by users ``low..high`` but not granted yet."""
+    held = exists().where(UserAchievement.user_id == User.id, UserAchievement.achievement_id == Achievement.id)
+    return select(User.id, Achievement.id).select_from(User).join(Achievement, _earned_criteria()).where(
+        User.id.between(low, high), ~held
+    )
+
+
+def _grant_pass(db: Session, low: int, high: int, stamp: datetime) -> int:
+    grants = _missing_grants(low, high).add_columns(literal(stamp))
+    # A grant made by a request since the select loses to the unique key; rowcount
+    # and the stamp then cover only the rows this pass inserted
+    upsert = dialect_insert(db)
+    statement = (upsert or insert)(UserAchievement).from_select(["user_id", "achievement_id", "earned_at"], grants)
+    if upsert is not None:
+        statement = statement.on_conflict_do_nothing(index_elements=["user_id", "achievement_id"])
+    granted = db.execute(statement).rowcount
+    if not granted:
+        return 0
+
+    stamped = and_(UserAchievement.earned_at == stamp, UserAchievement.user_id.between(low, high))
+    db.execute(insert(XPEvent).from_select(
+        ["user_id", "action_type", "amount", "created_at"],
+        select(UserAchievement.user_id, literal("achievement"), Achievement.xp_reward, literal(stamp)).join(
+            Achievement, Achievement.id == UserAchievement.achievement_id
+        ).where(stamped, Achievement.xp_reward > 0)
+    ))
+
+    own = and_(stamped, UserAchievement.user_id == User.id)
+    new_badges = select(func.count()).select_from(UserAchievement).where(own).scalar_subquery()
+    new_xp = select(func.coalesce(func.sum(Achievement.xp_reward), 0)).select_from(UserAchievement).join(
+        Achievement, Achievement.id == UserAchievement.achievement_id
+    ).where(own).scalar_subquery()
+    db.execute(
+        update(User).where(User.id.between(low, high), exists().where(own)).values(
+            badges_earned=func.coalesce(User.badges_earned, 0) + new_badges,
+            total_xp=func.coalesce(User.total_xp, 0) + new_xp,
+            total_points=func.coalesce(User.total_points, 0) + new_xp,
+        ).execution_options(synchronize_session=False)
+    )
+    return granted
+
+
+def recompute(
+    db: Session,
+    chunk_size: int = 10000,
+    dry_run: bool = False,
+    progress: Optional[Callable[[Dict], None]] = None
+) -> Dict[str, int]:
+    """Grant every earned achievement and fix levels; commits once per chunk."""
+    low_id, high_id = db.query(func.min(User.id), func.max(User.id)).one()
+    totals = {"users": 0, "granted": 0, "levels": 0}
+    if low_id is None:
+        return totals
+
+    started = datetime.utcnow()
+    passes = 0
+    for low in range(low_id, high_id + 1, chunk_size):
+        high = min(low + chunk_size - 1, high_id)
+        chunk = {"from_id": low, "to_id": high, "granted": 0, "levels": 0}
+
+        if dry_run:
+            chunk["granted"] = db.execute(
+                select(func.count()).select_from(_missing_grants(low, high).subquery())
+            ).scalar()
+        else:
+            while True:
+                # A distinct earned_at per pass identifies the rows that pass inserted
+                passes += 1
+                granted = _grant_pass(db, low, high, started + timedelta(microseconds=passes))
+                chunk["granted"] += granted
+                if not granted:
+                    break
+            level = func.coalesce(User.total_xp, 0) // 1000 + 1
+            chunk["levels"] = db.execute(
+                update(User).where(
+                    User.id.between(low, high),
+                    or_(User.current_level.is_(None), User.current_level != level)
+                ).values(current_level=level).execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+
+        totals["users"] += db.query(func.count(User.id)).filter(User.id.between(low, high)).scalar()
+        totals["granted"] += chunk["granted"]
+        totals["levels"] += chunk["levels"]
+        if progress is not None:
+            progress(dict(chunk, done_to_id=high, last_id=high_id))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grant achievements earned under the current catalog")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="user ids per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="only count the missing grants")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    start = time.perf_counter()
+
+    def report(chunk: Dict) -> None:
+        print(
+            f"users {chunk['from_id']}-{chunk['to_id']} of {chunk['last_id']}: "
+            f"{chunk['granted']} achievements{' missing' if args.dry_run else ' granted'}, "
+            f"{chunk['levels']} levels fixed ({time.perf_counter() - start:.1f}s)"
+        )
+
+    try:
+        totals = recompute(db, args.chunk_size, args.dry_run, report)
+    finally:
+        db.close()
+    print(f"Done: {totals['users']} users, {totals['granted']} achievements, {totals['levels']} levels")
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ["recompute"]
@@ -0,0 +1,242 @@
+"""
+Keyset-paged chat history and cold archival of old messages.
+
+A session's history is read newest first, in pages keyed on
+``(timestamp, id)`` within the session. ``history_page`` takes the position
+of the oldest message the client already has and returns the ones before
+it. Every page is one range read on
+``ix_chat_messages_session_timestamp_id``, however far back the client has
+scrolled, where ``OFFSET`` would skip over every newer row first.
+
+A scheduled job moves messages older than ``CHAT_ARCHIVE_AFTER_DAYS`` out of
+``chat_messages``. It packs each session's old messages, in history order,
+into ``chat_archive_segments`` rows of up to ``CHAT_ARCHIVE_SEGMENT_SIZE``
+messages, stored as zlib-compressed JSON. Messages keep their ids and
+timestamps. Archived messages are always older than a session's hot ones.
+``history_page`` therefore reads the hot table first, then continues into
+the segments, newest first, with the same cursor.
+
+Each batch inserts its segments and deletes the archived rows in one
+transaction. If the delete removes fewer rows than were packed, another
+worker archived them first, and the batch is rolled back.
+
+    python -m services.chat_archive [--days 30]
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import zlib
+
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.session import ChatArchiveSegment, ChatMessage
+from services.metrics import metrics
+from services.scheduler import scheduler
+from services.write_queue import write_queue
+
+ARCHIVE_JOB = "chat_archive"
+
+# Position of a message in its session's history
+Cursor = Tuple[datetime, int]
+
+
+def _message(id: int, message_type: str, content: str, timestamp: datetime) -> Dict:
+    return {"id": id, "message_type": message_type, "content": content, "timestamp": timestamp}
+
+
+def pack_segment(messages: List[Dict]) -> bytes:
+    return zlib.compress(json.dumps([
+        [m["id"], m["message_type"], m["content"], m["timestamp"].isoformat()] for m in messages
+    ]).encode("utf-8"))
+
+
+def unpack_segment(payload: bytes) -> List[Dict]:
+    return [
+        _message(id, message_type, content, datetime.fromisoformat(timestamp))
+        for id, message_type, content, timestamp in json.loads(zlib.decompress(payload))
+    ]
+
+
+def history_page(
+    db: Session,
+    session_id: int,
+    limit: int,
+    before: Optional[Cursor] = None
+) -> Tuple[List[Dict], bool]:
+    """
+    Up to ``limit`` of the session's messages older than ``before`` (the
+    newest ones if ``None``), newest first, from the hot table and then the
+    archive. The flag says whether there are older messages still.
+    """
+    wanted = limit + 1
+    query = select(
+        ChatMessage.id, ChatMessage.message_type, ChatMessage.content, ChatMessage.timestamp
+    ).where(ChatMessage.session_id == session_id)
+    if before is not None:
+        query = query.where(tuple_(ChatMessage.timestamp, ChatMessage.id) < before)
+    messages = [
+        _message(*row)
+        for row in db.execute(query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(wanted))
+    ]
+
+    cursor = (messages[-1]["timestamp"], messages[-1]["id"]) if messages else before
+    while len(messages) < wanted:
+        # Segments don't overlap, so the next one back is the newest that starts before the cursor
+        query = select(ChatArchiveSegment).where(ChatArchiveSegment.session_id == session_id)
+        if cursor is not None:
+            query = query.where(tuple_(ChatArchiveSegment.first_timestamp, ChatArchiveSegment.first_id) < cursor)
+        segment = db.execute(query.order_by(
+            ChatArchiveSegment.first_timestamp.desc(), ChatArchiveSegment.first_id.desc()
+        ).limit(1)).scalar_one_or_none()
+        if segment is None:
+            break
+        messages.extend(
+            m for m in reversed(unpack_segment(segment.payload))  # type: ignore
+            if cursor is None or (m["timestamp"], m["id"]) < cursor
+        )
+        cursor = (segment.first_timestamp, segment.first_id)  # type: ignore
+    return messages[:limit], len(messages) > limit
+
+
+def archive_messages(
+    db: Session,
+    before: datetime,
+    segment_size: int = 200,
+    batch_size: int = 5000
+) -> Optional[Tuple[int, int]]:
+    """
+    Move up to ``batch_size`` messages older than ``before`` into archive
+    segments; returns (messages, segments). Returns ``None`` if another
+    worker archived some of them first; the caller then rolls back, and
+    otherwise commits.
+    """
+    rows = db.execute(
+        select(ChatMessage.id, ChatMessage.session_id, ChatMessage.message_type, ChatMessage.content, ChatMessage.timestamp)
+        .where(ChatMessage.timestamp < before)
+        .order_by(ChatMessage.session_id, ChatMessage.timestamp, ChatMessage.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0, 0
+
+    by_session: Dict[int, List[Dict]] = {}
+    for id, session_id, message_type, content, timestamp in rows:
+        by_session.setdefault(session_id, []).append(_message(id, message_type, content, timestamp))
+    segments = []
+    for session_id, messages in by_session.items():
+        for start in range(0, len(messages), segment_size):
+            run = messages[start:start + segment_size]
+            segments.append({
+                "session_id": session_id,
+                "first_timestamp": run[0]["timestamp"],
+                "first_id": run[0]["id"],
+                "last_timestamp": run[-1]["timestamp"],
+                "last_id": run[-1]["id"],
+                "message_count": len(run),
+                "payload": pack_segment(run),
+                "created_at": datetime.utcnow(),
+            })
+
+    deleted = db.execute(
+        delete(ChatMessage).where(ChatMessage.id.in_([row.id for row in rows])).execution_options(synchronize_session=False)
+    ).rowcount
+    if deleted != len(rows):
+        return None
+    db.execute(insert(ChatArchiveSegment), segments)
+    return len(rows), len(segments)
+
+
+class ChatArchiver:
+    """Runs ``archive_messages`` from the scheduler until nothing is past the retention window."""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        after_days: float = 30,
+        segment_size: int = 200,
+        batch_size: int = 5000,
+        interval_seconds: float = 3600,
+    ):
+        self.session_factory = session_factory
+        self.after_days = after_days
+        self.segment_size = segment_size
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.archived = 0
+        self.segments = 0
+        self.conflicts = 0
+        self._scheduled = False
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def ensure_scheduled(self) -> None:
+        if not self._scheduled:
+            self._scheduled = True
+            scheduler.add_job(ARCHIVE_JOB, self.interval_seconds, self.run, run_at_exit=False)
+
+    def run(self, now: Optional[datetime] = None) -> int:
+        """Archive every message older than the retention window; returns the number moved."""
+        before = (now or datetime.utcnow()) - timedelta(days=self.after_days)
+        moved = 0
+        while True:
+            db = self._session()
+            try:
+                with write_queue.exclusive():
+                    result = archive_messages(db, before, self.segment_size, self.batch_size)
+                    if result is None:
+                        db.rollback()
+                    else:
+                        db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+            if result is None:
+                self.conflicts += 1
+                metrics.inc("chat_archive_conflicts_total")
+                return moved
+            messages, segments = result
+            moved += messages
+            self.archived += messages
+            self.segments += segments
+            metrics.inc("chat_archive_messages_total", messages)
+            if messages < self.batch_size:
+                return moved
+
+    def stats(self) -> Dict:
+        return {"archived": self.archived, "segments": self.segments, "conflicts": self.conflicts}
+
+
+chat_archiver = ChatArchiver(
+    after_days=settings.CHAT_ARCHIVE_AFTER_DAYS,
+    segment_size=settings.CHAT_ARCHIVE_SEGMENT_SIZE,
+    batch_size=settings.CHAT_ARCHIVE_BATCH_SIZE,
+    interval_seconds=settings.CHAT_ARCHIVE_INTERVAL_SECONDS,
+)
+metrics.register_gauge("chat_archive", chat_archiver.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old chat messages into compressed archive segments")
+    parser.add_argument("--days", type=float, default=settings.CHAT_ARCHIVE_AFTER_DAYS, help="retention window")
+    args = parser.parse_args()
+
+    chat_archiver.after_days = args.days
+    moved = chat_archiver.run()
+    print(f"Archived {moved} messages into {chat_archiver.segments} segments")
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ["ChatArchiver", "chat_archiver", "history_page", "archive_messages", "pack_segment", "unpack_segment"]
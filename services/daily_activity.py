@@ -0,0 +1,123 @@
+"""
+Daily activity rollups and the midnight rollover.
+
+``GamificationService`` keeps one ``daily_user_activity`` row per user and
+day (xp, minutes, chats, quizzes, uploads) up to date as activity is
+recorded, so "last N days" charts read N rows per user and never scan
+``study_sessions`` or ``chat_messages``.
+
+The per-user "today" columns on ``users`` are reset by ``rollover`` once per
+UTC day, in two bulk ``UPDATE`` statements rather than per user on their next
+visit:
+
+* ``study_time_today`` goes back to 0 unless its ``study_day`` is today.
+  Every writer stamps ``study_day`` with the minutes (heartbeat flushes
+  don't touch ``last_active_date``), and a writer on a new day starts from
+  its own minutes, so nothing depends on the rollover having run first;
+* ``current_streak`` goes to 0 for everyone whose last activity is before
+  yesterday, i.e. who missed a whole day.
+
+The scheduler checks for a new day every ``ROLLOVER_CHECK_SECONDS``, and
+each worker also runs the rollover once at start. Both statements only
+touch rows from earlier days, so a run in the middle of the day, from any
+worker, changes nothing that belongs to today.
+"""
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.user import User
+from models.gamification import DailyUserActivity
+from services.metrics import metrics
+from services.scheduler import scheduler
+from services.write_queue import write_queue
+
+ROLLOVER_JOB = "daily_rollover"
+ACTIVITY_COLUMNS = ("xp", "minutes", "chats", "quizzes", "uploads")
+
+
+def rollover(db: Session, today: Optional[date] = None) -> Dict[str, int]:
+    """Reset the per-day user columns for ``today``; returns rows updated per column. The caller commits."""
+    today = today or datetime.utcnow().date()
+    midnight = datetime(today.year, today.month, today.day)
+    study_time = db.execute(
+        update(User).where(
+            User.study_time_today != 0,
+            or_(User.study_day.is_(None), User.study_day < today)
+        ).values(study_time_today=0).execution_options(synchronize_session=False)
+    ).rowcount
+    streaks = db.execute(
+        update(User).where(
+            User.current_streak > 0,
+            User.last_active_date < midnight - timedelta(days=1)
+        ).values(current_streak=0).execution_options(synchronize_session=False)
+    ).rowcount
+    return {"study_time_today": study_time, "current_streak": streaks}
+
+
+class DailyRollover:
+    """Runs ``rollover`` once per UTC day from the scheduler."""
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None, check_seconds: float = 60):
+        self.session_factory = session_factory
+        self.check_seconds = check_seconds
+        self.last_day: Optional[date] = None
+        self._scheduled = False
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def ensure_scheduled(self) -> None:
+        if not self._scheduled:
+            self._scheduled = True
+            scheduler.add_job(ROLLOVER_JOB, self.check_seconds, self.run, run_at_exit=False)
+            # Catch up straight away if the process starts after a missed midnight
+            scheduler.run_soon(ROLLOVER_JOB)
+
+    def run(self) -> None:
+        today = datetime.utcnow().date()
+        if self.last_day == today:
+            return
+        db = self._session()
+        try:
+            with write_queue.exclusive():
+                counts = rollover(db, today)
+                db.commit()
+        finally:
+            db.close()
+        self.last_day = today
+        for column, count in counts.items():
+            metrics.inc("daily_rollover_rows_total", count, {"column": column})
+
+
+def activity_history(db: Session, user_id: int, days: int = 7, today: Optional[date] = None) -> List[Dict]:
+    """The user's rollups for the last ``days`` days, oldest first, with zeros for idle days."""
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    rows = {
+        row.day: row
+        for row in db.query(DailyUserActivity).filter(
+            DailyUserActivity.user_id == user_id,
+            DailyUserActivity.day >= start,
+            DailyUserActivity.day <= today
+        )
+    }
+    history = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = rows.get(day)
+        entry = {"day": day.isoformat()}
+        entry.update((column, getattr(row, column) if row is not None else 0) for column in ACTIVITY_COLUMNS)
+        history.append(entry)
+    return history
+
+
+daily_rollover = DailyRollover(check_seconds=settings.ROLLOVER_CHECK_SECONDS)
+
+__all__ = ["DailyRollover", "activity_history", "daily_rollover", "rollover"]
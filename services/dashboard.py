@@ -0,0 +1,232 @@
+"""
+Precomputed per-user dashboard snapshots.
+
+The performance dashboard is fetched on every page load and combines the
+user row, session and quiz aggregates, recent achievements, the last week of
+``daily_user_activity`` and the leaderboard rank. Building it is five small
+queries, so it's built once and cached as serialized JSON with an ETag.
+Repeat loads cost one dictionary lookup and, when the client sends
+``If-None-Match``, a bodiless 304.
+
+A snapshot is marked stale when a transaction that recorded activity for its
+user commits (``GamificationService`` calls ``invalidate_on_commit``). Stale
+snapshots of users who have viewed their dashboard are rebuilt in the
+background every ``DASHBOARD_REFRESH_SECONDS``, and a read that finds its
+snapshot stale rebuilds it first. Snapshots also expire after
+``DASHBOARD_SNAPSHOT_TTL_SECONDS``, which bounds staleness from other worker
+processes and from the live rank.
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional, Set
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.user import User
+from models.session import Quiz, StudySession
+from models.gamification import Achievement, UserAchievement
+from services.daily_activity import activity_history
+from services.leaderboard import leaderboards
+from services.metrics import metrics
+from services.scheduler import scheduler
+
+REFRESH_JOB = "dashboard_refresh"
+_PENDING_KEY = "dashboard_pending"
+
+_USER_COLUMNS = (
+    "name", "total_xp", "total_points", "current_level", "current_streak", "global_rank",
+    "study_time_today", "quizzes_completed", "badges_earned", "materials_uploaded",
+    "study_sessions", "quiz_accuracy",
+)
+
+
+class DashboardSnapshot(NamedTuple):
+    etag: str
+    body: bytes
+    expires_at: float
+    stale: bool = False
+
+
+def build_snapshot(db: Session, user_id: int) -> Optional[Dict]:
+    """Everything the dashboard shows for ``user_id``, or None if the user doesn't exist."""
+    row = db.query(*(getattr(User, column) for column in _USER_COLUMNS)).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    snapshot: Dict = {"user_id": user_id}
+    snapshot.update(zip(_USER_COLUMNS, row))
+    snapshot["global_rank"] = leaderboards.board(db).rank(user_id) or snapshot["global_rank"]
+
+    sessions = db.query(
+        StudySession.session_type, func.count(StudySession.id), func.coalesce(func.sum(StudySession.duration_minutes), 0)
+    ).filter(StudySession.user_id == user_id).group_by(StudySession.session_type).all()
+    snapshot["sessions"] = {
+        "total": sum(count for _, count, _ in sessions),
+        "total_minutes": float(sum(minutes for _, _, minutes in sessions)),
+        "by_type": {session_type: count for session_type, count, _ in sessions},
+    }
+
+    quizzes, average_score = db.query(func.count(Quiz.id), func.avg(Quiz.score)).join(
+        StudySession, StudySession.id == Quiz.session_id
+    ).filter(StudySession.user_id == user_id, Quiz.completed.is_(True)).one()
+    snapshot["quizzes"] = {
+        "completed": quizzes,
+        "average_score": round(float(average_score), 1) if average_score is not None else None,
+    }
+
+    snapshot["recent_achievements"] = [
+        {"name": name, "icon": icon, "earned_at": earned_at.isoformat() if earned_at else None}
+        for name, icon, earned_at in db.query(Achievement.name, Achievement.icon, UserAchievement.earned_at).join(
+            UserAchievement, UserAchievement.achievement_id == Achievement.id
+        ).filter(UserAchievement.user_id == user_id).order_by(UserAchievement.earned_at.desc()).limit(5)
+    ]
+    snapshot["activity"] = activity_history(db, user_id, days=7)
+    return snapshot
+
+
+class DashboardCache:
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        ttl_seconds: float = 60,
+        max_entries: int = 10000,
+        refresh_seconds: float = 5,
+    ):
+        self.session_factory = session_factory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.refresh_seconds = refresh_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, DashboardSnapshot]" = OrderedDict()
+        self._stale: Set[int] = set()
+        # Bumped by invalidate(); a build that started under an older generation
+        # is stored stale, so an invalidation that lands mid-build isn't lost
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def _build(self, db: Session, user_id: int) -> Optional[DashboardSnapshot]:
+        start = time.perf_counter()
+        with self._lock:
+            generation = self._generations.setdefault(user_id, 0)
+        try:
+            data = build_snapshot(db, user_id)
+        except Exception:
+            self._forget_generation(user_id)
+            raise
+        if data is None:
+            self._forget_generation(user_id)
+            return None
+        body = json.dumps(data, separators=(",", ":"), default=str).encode()
+        with self._lock:
+            stale = self._generations.get(user_id, 0) != generation
+            snapshot = DashboardSnapshot(
+                etag='"' + hashlib.sha1(body).hexdigest() + '"',
+                body=body,
+                expires_at=time.monotonic() + self.ttl_seconds,
+                stale=stale,
+            )
+            self._entries[user_id] = snapshot
+            self._entries.move_to_end(user_id)
+            if stale:
+                self._stale.add(user_id)
+            else:
+                self._stale.discard(user_id)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._stale.discard(evicted)
+                self._generations.pop(evicted, None)
+        metrics.observe("dashboard_build_seconds", time.perf_counter() - start)
+        return snapshot
+
+    def get(self, db: Session, user_id: int) -> Optional[DashboardSnapshot]:
+        """The user's snapshot, rebuilt first if missing, stale or expired."""
+        with self._lock:
+            snapshot = self._entries.get(user_id)
+            if snapshot is not None and not snapshot.stale and snapshot.expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+        if not self._scheduled:
+            self._scheduled = True
+            scheduler.add_job(REFRESH_JOB, self.refresh_seconds, self.refresh, run_at_exit=False)
+        return self._build(db, user_id)
+
+    def _forget_generation(self, user_id: int) -> None:
+        with self._lock:
+            if user_id not in self._entries:
+                self._generations.pop(user_id, None)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            # Only users with a snapshot or a build in flight have a generation
+            if user_id in self._generations:
+                self._generations[user_id] += 1
+            snapshot = self._entries.get(user_id)
+            if snapshot is not None:
+                self._entries[user_id] = snapshot._replace(stale=True)
+                self._stale.add(user_id)
+
+    def invalidate_on_commit(self, db: Session, user_id: int) -> None:
+        """Mark ``user_id``'s snapshot stale once ``db`` commits."""
+        db.info.setdefault(_PENDING_KEY, set()).add(user_id)
+
+    def _on_commit(self, db: Session) -> None:
+        for user_id in db.info.pop(_PENDING_KEY, ()):
+            self.invalidate(user_id)
+
+    def _on_rollback(self, db: Session) -> None:
+        db.info.pop(_PENDING_KEY, None)
+
+    def refresh(self) -> int:
+        """Rebuild stale snapshots ahead of their next read; returns how many were rebuilt."""
+        with self._lock:
+            user_ids = list(self._stale)
+        if not user_ids:
+            return 0
+        db = self._session()
+        try:
+            for user_id in user_ids:
+                if self._build(db, user_id) is None:
+                    with self._lock:
+                        self._entries.pop(user_id, None)
+                        self._stale.discard(user_id)
+                        self._generations.pop(user_id, None)
+        finally:
+            db.close()
+        return len(user_ids)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "stale": len(self._stale),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else None,
+        }
+
+
+dashboards = DashboardCache(
+    ttl_seconds=settings.DASHBOARD_SNAPSHOT_TTL_SECONDS,
+    max_entries=settings.DASHBOARD_CACHE_SIZE,
+    refresh_seconds=settings.DASHBOARD_REFRESH_SECONDS,
+)
+metrics.register_gauge("dashboard_cache", dashboards.stats)
+
+event.listen(Session, "after_commit", dashboards._on_commit)
+event.listen(Session, "after_rollback", dashboards._on_rollback)
+
+__all__ = ["DashboardCache", "DashboardSnapshot", "build_snapshot", "dashboards"]
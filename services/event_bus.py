@@ -0,0 +1,145 @@
+"""
+In-process pub/sub for live progress updates.
+
+``GamificationService`` publishes each user's XP, level and new achievements
+when the transaction that applied them commits. Every open WebSocket of that
+user (``/ws/progress``, one per tab) subscribes here. Publishing is
+thread-safe, since commits happen in request threads and in the XP ledger's
+flush thread. Delivery happens on the subscriber's event loop.
+
+Bursts are coalesced. Updates reaching a subscriber within
+``EVENT_BUS_COALESCE_MS`` of each other are merged into one message: XP
+deltas are summed, totals and level come from the latest update, and
+achievements are concatenated. A flush of 500 chat awards is one message
+per tab, not 500. ``event_bus_fanout_seconds`` measures publish to hand-off
+to the socket.
+
+Subscriptions are per process: a user's sockets only hear about commits
+made by the worker they are connected to, and the XP ledger flush happens
+in that same worker.
+"""
+from typing import Dict, List, Optional, Set
+import asyncio
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import settings
+from services.metrics import metrics
+
+_PENDING_KEY = "event_bus_pending"
+
+
+class Subscription:
+    """One connection's mailbox; only touched on its own event loop."""
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop, coalesce_seconds: float):
+        self.user_id = user_id
+        self.loop = loop
+        self.coalesce_seconds = coalesce_seconds
+        self.queue: "asyncio.Queue[Dict]" = asyncio.Queue(maxsize=100)
+        self._pending: Optional[Dict] = None
+        self._first_published = 0.0
+
+    def offer(self, update: Dict, published_at: float) -> None:
+        if self._pending is None:
+            self._pending = {
+                "type": "progress",
+                "xp_delta": 0,
+                "total_xp": None,
+                "current_level": None,
+                "current_streak": None,
+                "level_up": False,
+                "achievements": [],
+            }
+            self._first_published = published_at
+            self.loop.call_later(self.coalesce_seconds, self._flush)
+        else:
+            metrics.inc("event_bus_coalesced_total")
+        pending = self._pending
+        pending["xp_delta"] += update.get("xp_delta", 0)
+        for key in ("total_xp", "current_level", "current_streak"):
+            if update.get(key) is not None:
+                pending[key] = update[key]
+        pending["level_up"] = pending["level_up"] or update.get("level_up", False)
+        pending["achievements"].extend(update.get("achievements", ()))
+
+    def _flush(self) -> None:
+        message, self._pending = self._pending, None
+        if message is None:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A stuck client: drop rather than buffer without bound
+            metrics.inc("event_bus_dropped_total")
+            return
+        metrics.observe("event_bus_fanout_seconds", time.monotonic() - self._first_published)
+
+
+class EventBus:
+    def __init__(self, coalesce_ms: float = 250):
+        self.coalesce_seconds = coalesce_ms / 1000
+        self.published = 0
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """Register a connection of ``user_id``; call from the connection's event loop."""
+        subscription = Subscription(user_id, asyncio.get_running_loop(), self.coalesce_seconds)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id: int, update: Dict) -> int:
+        """Send ``update`` to every connection of ``user_id``; returns how many there are."""
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        published_at = time.monotonic()
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, update, published_at)
+            except RuntimeError:
+                # Event loop already closed (server shutting down)
+                self.unsubscribe(subscription)
+        self.published += 1
+        return len(subscriptions)
+
+    def has_subscribers(self, user_id: int) -> bool:
+        return user_id in self._subscribers
+
+    def publish_on_commit(self, db: Session, user_id: int, update: Dict) -> None:
+        """Publish ``update`` once ``db`` commits; nothing is sent if it rolls back."""
+        if user_id in self._subscribers:
+            db.info.setdefault(_PENDING_KEY, []).append((user_id, update))
+
+    def _on_commit(self, db: Session) -> None:
+        for user_id, update in db.info.pop(_PENDING_KEY, ()):
+            self.publish(user_id, update)
+
+    def _on_rollback(self, db: Session) -> None:
+        db.info.pop(_PENDING_KEY, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            connections: List[int] = [len(subscriptions) for subscriptions in self._subscribers.values()]
+        return {"users": len(connections), "connections": sum(connections), "published": self.published}
+
+
+event_bus = EventBus(coalesce_ms=settings.EVENT_BUS_COALESCE_MS)
+metrics.register_gauge("event_bus", event_bus.stats)
+
+event.listen(Session, "after_commit", event_bus._on_commit)
+event.listen(Session, "after_rollback", event_bus._on_rollback)
+
+__all__ = ["EventBus", "Subscription", "event_bus"]
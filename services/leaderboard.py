@@ -0,0 +1,419 @@
+"""
+In-memory XP leaderboards with O(log n) rank queries.
+
+``ORDER BY total_xp`` over every user on each profile view doesn't scale, so
+each process keeps the ordering in memory: a bucketed sorted list of
+``(-xp, user_id)`` keys plus a Fenwick tree over bucket sizes. Finding a key's
+position, the key at a position, inserting and removing are all O(log n)
+(plus an O(bucket) list insert). There is one global board over
+``users.total_xp`` and one board per study-session language, scored by XP
+earned in sessions of that language.
+
+Boards are loaded from the database on first use and updated incrementally
+with the XP deltas of committed transactions (``GamificationService`` records
+them). Deltas committed by other worker processes only show up at the next
+periodic reload (``LEADERBOARD_RELOAD_SECONDS``). Global ranks are written
+back to ``users.global_rank`` every ``LEADERBOARD_PERSIST_SECONDS``, and only
+rows whose rank changed are updated.
+
+Ranks use competition ranking: users with equal XP share a rank (1, 2, 2, 4).
+"""
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import threading
+
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.user import User
+from models.session import StudySession
+from models.gamification import XPEvent
+from services.metrics import metrics
+from services.scheduler import scheduler
+from services.write_queue import write_queue
+
+Key = Tuple[int, int]  # (-score, user_id): ascending key order is leaderboard order
+_PENDING_KEY = "leaderboard_pending"
+
+
+class LeaderboardEntry(NamedTuple):
+    rank: int
+    user_id: int
+    score: int
+
+
+class OrderStatisticList:
+    """
+    Sorted list of keys supporting rank (``bisect_left``) and select
+    (``__getitem__``) in O(log n). Keys live in buckets of ``load`` to
+    ``2 * load`` items; a Fenwick tree over the bucket lengths turns a bucket
+    index into a global position and back.
+    """
+
+    def __init__(self, keys: Iterable[Key] = (), load: int = 1000):
+        self._load = load
+        keys = sorted(keys)
+        self._lists: List[List[Key]] = [keys[i:i + load] for i in range(0, len(keys), load)]
+        self._maxes: List[Key] = [bucket[-1] for bucket in self._lists]
+        self._len = len(keys)
+        self._build_tree()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _build_tree(self) -> None:
+        size = len(self._lists)
+        tree = [0] * (size + 1)
+        for i, bucket in enumerate(self._lists, start=1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, bucket: int, delta: int) -> None:
+        i = bucket + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket: int) -> int:
+        """Number of keys in buckets before ``bucket``."""
+        total = 0
+        while bucket > 0:
+            total += self._tree[bucket]
+            bucket -= bucket & -bucket
+        return total
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        """(bucket, offset) of the key at global position ``index``."""
+        bucket = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = bucket + step
+            if nxt < len(self._tree) and self._tree[nxt] <= index:
+                bucket = nxt
+                index -= self._tree[nxt]
+            step >>= 1
+        return bucket, index
+
+    def add(self, key: Key) -> None:
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._build_tree()
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._lists[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._lists[i], key)
+        self._len += 1
+        bucket = self._lists[i]
+        if len(bucket) > 2 * self._load:
+            half = len(bucket) // 2
+            self._lists[i:i + 1] = [bucket[:half], bucket[half:]]
+            self._maxes[i:i + 1] = [bucket[half - 1], bucket[-1]]
+            self._build_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def remove(self, key: Key) -> None:
+        i = bisect_left(self._maxes, key)
+        bucket = self._lists[i] if i < len(self._lists) else []
+        j = bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            raise KeyError(key)
+        del bucket[j]
+        self._len -= 1
+        if not bucket:
+            del self._lists[i]
+            del self._maxes[i]
+            self._build_tree()
+        else:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+
+    def bisect_left(self, key: Key) -> int:
+        """Number of keys ordered before ``key``."""
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return self._len
+        return self._prefix(i) + bisect_left(self._lists[i], key)
+
+    def __getitem__(self, index: int) -> Key:
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        bucket, offset = self._locate(index)
+        return self._lists[bucket][offset]
+
+    def islice(self, start: int, stop: int) -> Iterator[Key]:
+        stop = min(stop, self._len)
+        if start >= stop:
+            return
+        bucket, offset = self._locate(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self._lists[bucket][offset:offset + remaining]
+            yield from chunk
+            remaining -= len(chunk)
+            bucket, offset = bucket + 1, 0
+
+
+class Leaderboard:
+    """Scores for one scope, ordered by XP descending then user id."""
+
+    def __init__(self, scores: Optional[Dict[int, int]] = None):
+        self._scores: Dict[int, int] = dict(scores or {})
+        self._order = OrderStatisticList((-score, user_id) for user_id, score in self._scores.items())
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def score(self, user_id: int) -> Optional[int]:
+        return self._scores.get(user_id)
+
+    def set(self, user_id: int, score: int) -> None:
+        with self._lock:
+            old = self._scores.get(user_id)
+            if old == score:
+                return
+            if old is not None:
+                self._order.remove((-old, user_id))
+            self._scores[user_id] = score
+            self._order.add((-score, user_id))
+
+    def add(self, user_id: int, delta: int) -> None:
+        with self._lock:
+            old = self._scores.get(user_id)
+            if old is not None:
+                if not delta:
+                    return
+                self._order.remove((-old, user_id))
+            score = (old or 0) + delta
+            self._scores[user_id] = score
+            self._order.add((-score, user_id))
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            old = self._scores.pop(user_id, None)
+            if old is not None:
+                self._order.remove((-old, user_id))
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based competition rank, or None if the user isn't on this board."""
+        with self._lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return None
+            # Everyone with a strictly higher score is ahead; user ids are positive
+            return self._order.bisect_left((-score, 0)) + 1
+
+    def _entries(self, start: int, stop: int) -> List[LeaderboardEntry]:
+        entries: List[LeaderboardEntry] = []
+        for position, (negated, user_id) in enumerate(self._order.islice(start, stop), start=start):
+            if entries and entries[-1].score == -negated:
+                rank = entries[-1].rank
+            elif entries:
+                rank = position + 1
+            else:
+                rank = self._order.bisect_left((negated, 0)) + 1
+            entries.append(LeaderboardEntry(rank, user_id, -negated))
+        return entries
+
+    def top(self, limit: int = 10) -> List[LeaderboardEntry]:
+        with self._lock:
+            return self._entries(0, limit)
+
+    def around(self, user_id: int, radius: int = 5) -> List[LeaderboardEntry]:
+        """The user's entry with up to ``radius`` neighbours on each side."""
+        with self._lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return []
+            position = self._order.bisect_left((-score, user_id))
+            return self._entries(max(0, position - radius), position + radius + 1)
+
+    def ranks(self) -> Iterator[Tuple[int, int]]:
+        """``(user_id, rank)`` for every user, in leaderboard order."""
+        with self._lock:
+            keys = list(self._order.islice(0, len(self._order)))
+        rank, previous = 0, None
+        for position, (negated, user_id) in enumerate(keys, start=1):
+            if negated != previous:
+                rank, previous = position, negated
+            yield user_id, rank
+
+
+class LeaderboardService:
+    """Global and per-language boards of this process, plus their upkeep jobs."""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        persist_seconds: float = 60,
+        reload_seconds: float = 900,
+    ):
+        self.session_factory = session_factory
+        self.persist_seconds = persist_seconds
+        self.reload_seconds = reload_seconds
+        self._global: Optional[Leaderboard] = None
+        self._languages: Dict[str, Leaderboard] = {}
+        self._persisted: Dict[int, int] = {}
+        self._load_lock = threading.Lock()
+        # While a load runs, committed deltas are also collected here and replayed
+        # onto the new boards before they replace the old ones
+        self._reload_deltas: Optional[List[Tuple[int, int, Optional[str]]]] = None
+        self._delta_lock = threading.Lock()
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    @property
+    def loaded(self) -> bool:
+        return self._global is not None
+
+    @staticmethod
+    def _read_boards(db: Session) -> Tuple[Leaderboard, Dict[str, Leaderboard]]:
+        scores = {
+            user_id: int(total_xp or 0)
+            for user_id, total_xp in db.query(User.id, User.total_xp).yield_per(10000)
+        }
+        per_language: Dict[str, Dict[int, int]] = {}
+        rows = db.query(StudySession.language, XPEvent.user_id, func.sum(XPEvent.amount)).join(
+            StudySession, StudySession.id == XPEvent.session_id
+        ).filter(StudySession.language.isnot(None)).group_by(StudySession.language, XPEvent.user_id)
+        for language, user_id, total in rows:
+            per_language.setdefault(language, {})[user_id] = int(total or 0)
+        return Leaderboard(scores), {language: Leaderboard(board) for language, board in per_language.items()}
+
+    @staticmethod
+    def _apply(
+        global_board: Leaderboard,
+        languages: Dict[str, Leaderboard],
+        deltas: Iterable[Tuple[int, int, Optional[str]]],
+    ) -> None:
+        for user_id, delta, language in deltas:
+            if language is None:
+                global_board.add(user_id, delta)
+            else:
+                languages.setdefault(language, Leaderboard()).add(user_id, delta)
+
+    def load(self, db: Session) -> None:
+        """(Re)build every board from the database."""
+        # Collecting starts just before the reads. A delta that commits in between
+        # is both read and replayed until the next reload; one that commits while
+        # the reads run is no longer dropped by the swap.
+        with self._delta_lock:
+            self._reload_deltas = []
+        try:
+            new_global, new_languages = self._read_boards(db)
+        except Exception:
+            with self._delta_lock:
+                self._reload_deltas = None
+            raise
+        with self._delta_lock:
+            self._apply(new_global, new_languages, self._reload_deltas)
+            self._reload_deltas = None
+            self._global, self._languages = new_global, new_languages
+        if not self._persisted:
+            self._persisted = {
+                user_id: rank for user_id, rank in db.query(User.id, User.global_rank).filter(User.global_rank > 0)
+            }
+        scheduler.add_job("leaderboard_persist", self.persist_seconds, self.persist_ranks)
+        scheduler.add_job("leaderboard_reload", self.reload_seconds, self.reload, run_at_exit=False)
+
+    def reload(self) -> None:
+        db = self._session()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+    def board(self, db: Session, language: Optional[str] = None) -> Leaderboard:
+        """The global board, or ``language``'s (empty if nobody has XP in it yet)."""
+        if self._global is None:
+            with self._load_lock:
+                if self._global is None:
+                    self.load(db)
+        if language is None:
+            return self._global
+        board = self._languages.get(language)
+        # Unknown languages get a throwaway board: storing it would let any query string grow the map
+        return board if board is not None else Leaderboard()
+
+    def record(self, db: Session, user_id: int, delta: int, language: Optional[str] = None) -> None:
+        """Queue an XP delta; it reaches the boards when ``db`` commits."""
+        if delta:
+            db.info.setdefault(_PENDING_KEY, []).append((user_id, delta, language))
+
+    def _on_commit(self, db: Session) -> None:
+        pending = db.info.pop(_PENDING_KEY, None)
+        if not pending:
+            return
+        with self._delta_lock:
+            if self._reload_deltas is not None:
+                self._reload_deltas.extend(pending)
+            if self._global is None:
+                # Not loaded yet: the first load reads the committed totals
+                return
+            self._apply(self._global, self._languages, pending)
+
+    def _on_rollback(self, db: Session) -> None:
+        db.info.pop(_PENDING_KEY, None)
+
+    def persist_ranks(self) -> int:
+        """Write changed global ranks to ``users.global_rank``; returns the number of rows updated."""
+        if self._global is None:
+            return 0
+        changed = [
+            {"id": user_id, "global_rank": rank}
+            for user_id, rank in self._global.ranks()
+            if self._persisted.get(user_id) != rank
+        ]
+        if not changed:
+            return 0
+        db = self._session()
+        try:
+            with write_queue.exclusive():
+                for start in range(0, len(changed), 5000):
+                    db.execute(update(User), changed[start:start + 5000])
+                db.commit()
+        finally:
+            db.close()
+        self._persisted.update((row["id"], row["global_rank"]) for row in changed)
+        metrics.inc("leaderboard_ranks_persisted_total", len(changed))
+        return len(changed)
+
+    def stats(self) -> Dict:
+        return {
+            "loaded": self.loaded,
+            "users": len(self._global) if self._global is not None else 0,
+            "languages": len(self._languages),
+        }
+
+
+leaderboards = LeaderboardService(
+    persist_seconds=settings.LEADERBOARD_PERSIST_SECONDS,
+    reload_seconds=settings.LEADERBOARD_RELOAD_SECONDS,
+)
+metrics.register_gauge("leaderboard", leaderboards.stats)
+
+event.listen(Session, "after_commit", leaderboards._on_commit)
+event.listen(Session, "after_rollback", leaderboards._on_rollback)
+
+__all__ = [
+    "Leaderboard",
+    "LeaderboardEntry",
+    "LeaderboardService",
+    "OrderStatisticList",
+    "leaderboards",
+]
@@ -0,0 +1,266 @@
+"""
+Extracted-text sidecar persisted next to each uploaded study material.
+
+Parsing a PDF is by far the most expensive part of ingestion, so it should
+happen once per upload. The sidecar keeps everything later jobs need
+(normalized text, page offsets, chunk boundaries and chunk hashes) in a single
+compact file that re-chunking and re-embedding jobs read through ``mmap``
+without touching the original document again.
+
+File layout (all integers little-endian)::
+
+    b"AQSC" | u16 version | u16 reserved | u32 header_len | header JSON | UTF-8 text
+
+Pages are separated by a form feed in the text. All offsets stored in the
+header are byte offsets into the text section, so a page or chunk is a plain
+slice of the mapped file.
+"""
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import unicodedata
+
+SIDECAR_SUFFIX = ".aqs"
+SIDECAR_VERSION = 1
+PAGE_SEPARATOR = "\f"
+
+_MAGIC = b"AQSC"
+_PREFIX = struct.Struct("<4sHHI")
+_TRAILING_SPACE = re.compile(r"[ \t]+\n")
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+def sidecar_path(file_path: str) -> str:
+    """Return the sidecar location for an uploaded file."""
+    return file_path + SIDECAR_SUFFIX
+
+
+def normalize_text(text: str) -> str:
+    """Normalize extracted page text so offsets and hashes are stable."""
+    text = unicodedata.normalize("NFC", text)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = text.replace("\x00", "").replace(PAGE_SEPARATOR, "\n")
+    text = _TRAILING_SPACE.sub("\n", text)
+    text = _BLANK_RUNS.sub("\n\n", text)
+    return text.strip()
+
+
+def chunk_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _source_fingerprint(file_path: str) -> Dict:
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _char_to_byte_offsets(text: str, char_offsets: Sequence[int]) -> List[int]:
+    """Translate sorted-or-not char offsets into UTF-8 byte offsets in one pass."""
+    if text.isascii():
+        return list(char_offsets)
+    order = sorted(set(char_offsets))
+    mapping = {}
+    byte_pos = 0
+    char_pos = 0
+    for target in order:
+        byte_pos += len(text[char_pos:target].encode("utf-8"))
+        char_pos = target
+        mapping[target] = byte_pos
+    return [mapping[offset] for offset in char_offsets]
+
+
+def write_sidecar(
+    file_path: str,
+    pages: Sequence[str],
+    chunks: Sequence[Tuple],
+    splitter: Optional[Dict] = None,
+) -> str:
+    """
+    Persist the sidecar for ``file_path``.
+
+    Args:
+        file_path: Path of the original upload; the sidecar is written next to it
+        pages: Normalized page texts, in order
+        chunks: ``(start, end)`` or ``(start, end, heading)`` character
+            offsets into the page texts joined with ``PAGE_SEPARATOR``
+        splitter: Description of the splitter settings that produced ``chunks``
+
+    Returns:
+        Path of the written sidecar
+    """
+    text = PAGE_SEPARATOR.join(pages)
+    page_starts = []
+    position = 0
+    for page in pages:
+        page_starts.append(position)
+        position += len(page) + len(PAGE_SEPARATOR)
+
+    flat = [offset for chunk in chunks for offset in chunk[:2]]
+    byte_offsets = _char_to_byte_offsets(text, page_starts + flat)
+    text_bytes = text.encode("utf-8")
+    page_byte_starts = byte_offsets[:len(page_starts)]
+    chunk_bytes = byte_offsets[len(page_starts):]
+
+    chunk_entries = []
+    for i, chunk in enumerate(chunks):
+        start, end = chunk_bytes[2 * i], chunk_bytes[2 * i + 1]
+        entry = [start, end, chunk_hash(text_bytes[start:end])]
+        if len(chunk) > 2 and chunk[2]:
+            entry.append(chunk[2])
+        chunk_entries.append(entry)
+
+    header = {
+        "source": _source_fingerprint(file_path),
+        "text_bytes": len(text_bytes),
+        "text_sha1": chunk_hash(text_bytes),
+        "pages": page_byte_starts,
+        "chunks": chunk_entries,
+        "splitter": splitter or {},
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    path = sidecar_path(file_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREFIX.pack(_MAGIC, SIDECAR_VERSION, 0, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(text_bytes)
+    os.replace(tmp_path, path)
+    return path
+
+
+class MaterialSidecar:
+    """Read-only, memory-mapped view over a sidecar file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Zero-length files cannot be mapped; treat them as corrupt.
+            self._file.close()
+            raise ValueError(f"Empty sidecar: {path}")
+
+        magic, version, _, header_len = _PREFIX.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != SIDECAR_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported sidecar: {path}")
+
+        header_start = _PREFIX.size
+        self._text_start = header_start + header_len
+        self.header = json.loads(self._map[header_start:self._text_start])
+        self._page_starts: List[int] = self.header["pages"]
+        self._chunks: List[List] = self.header["chunks"]
+
+    def __enter__(self) -> "MaterialSidecar":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if getattr(self, "_map", None) is not None and not self._map.closed:
+            self._map.close()
+        self._file.close()
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_starts)
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self._chunks)
+
+    @property
+    def splitter(self) -> Dict:
+        return self.header.get("splitter", {})
+
+    def _slice(self, start: int, end: int) -> str:
+        base = self._text_start
+        return self._map[base + start:base + end].decode("utf-8")
+
+    def text(self) -> str:
+        return self._slice(0, self.header["text_bytes"])
+
+    def page(self, index: int) -> str:
+        start = self._page_starts[index]
+        if index + 1 < len(self._page_starts):
+            end = self._page_starts[index + 1] - len(PAGE_SEPARATOR.encode("utf-8"))
+        else:
+            end = self.header["text_bytes"]
+        return self._slice(start, end)
+
+    def pages(self) -> List[str]:
+        return [self.page(i) for i in range(self.page_count)]
+
+    def page_of(self, byte_offset: int) -> int:
+        """Return the zero-based page that contains ``byte_offset``."""
+        low, high = 0, len(self._page_starts) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self._page_starts[mid] <= byte_offset:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+    def chunk(self, index: int) -> str:
+        start, end = self._chunks[index][:2]
+        return self._slice(start, end)
+
+    def iter_chunks(self) -> Iterator[Tuple[str, Dict]]:
+        """Yield ``(text, metadata)`` for every stored chunk."""
+        for index, entry in enumerate(self._chunks):
+            start, end, digest = entry[:3]
+            yield self._slice(start, end).replace(PAGE_SEPARATOR, "\n"), {
+                "chunk": index,
+                "page": self.page_of(start),
+                "start": start,
+                "end": end,
+                "hash": digest,
+                "heading": entry[3] if len(entry) > 3 else None,
+            }
+
+    def is_fresh_for(self, file_path: str) -> bool:
+        """True when the sidecar was built from the current version of ``file_path``."""
+        try:
+            return self.header.get("source") == _source_fingerprint(file_path)
+        except OSError:
+            return False
+
+
+def open_sidecar(file_path: str) -> Optional[MaterialSidecar]:
+    """
+    Open the sidecar for ``file_path`` if it exists and still matches the upload.
+
+    Returns None when there is no usable sidecar, in which case the caller
+    should parse the original file and write a new one.
+    """
+    path = sidecar_path(file_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        sidecar = MaterialSidecar(path)
+    except (ValueError, OSError, struct.error) as e:
+        print(f"Ignoring unreadable sidecar {path}: {e}")
+        return None
+    if not sidecar.is_fresh_for(file_path):
+        sidecar.close()
+        return None
+    return sidecar
+
+
+__all__ = [
+    "SIDECAR_SUFFIX",
+    "PAGE_SEPARATOR",
+    "MaterialSidecar",
+    "normalize_text",
+    "open_sidecar",
+    "sidecar_path",
+    "write_sidecar",
+]
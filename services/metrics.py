@@ -0,0 +1,138 @@
+"""
+In-process metrics registry.
+
+Histograms use fixed cumulative buckets (Prometheus style) so observing a
+value is O(buckets) with no per-sample storage. Everything lives in memory
+for the lifetime of the worker process and is exposed as JSON by
+``routes/metrics.py``.
+"""
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import bisect
+import threading
+
+# Seconds, roughly log-spaced from 1ms to 5 minutes
+DEFAULT_TIME_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+# Counts and sizes (pages, chunks, tokens, bytes), powers of 4
+DEFAULT_SIZE_BUCKETS: Tuple[float, ...] = tuple(float(4 ** i) for i in range(16))
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                buckets[f"{bound:g}"] = cumulative
+            buckets["+Inf"] = self.count
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else None,
+                "min": self.min,
+                "max": self.max,
+                "buckets": buckets,
+            }
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    return ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, Callable[[], object]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(
+        self,
+        name: str,
+        labels: Optional[Dict[str, str]] = None,
+        buckets: Iterable[float] = DEFAULT_TIME_BUCKETS,
+    ) -> Histogram:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            return series[key]
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Optional[Dict[str, str]] = None,
+        buckets: Iterable[float] = DEFAULT_TIME_BUCKETS,
+    ) -> None:
+        self.histogram(name, labels, buckets).observe(value)
+
+    def inc(self, name: str, amount: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def register_gauge(self, name: str, fn: Callable[[], object]) -> None:
+        """Register a callable evaluated on every snapshot (e.g. cache hit ratio)."""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = dict(self._gauges)
+
+        gauge_values = {}
+        for name, fn in gauges.items():
+            try:
+                gauge_values[name] = fn()
+            except Exception as e:
+                gauge_values[name] = f"error: {e}"
+
+        return {
+            "histograms": {
+                name: {key: hist.snapshot() for key, hist in series.items()}
+                for name, series in histograms.items()
+            },
+            "counters": counters,
+            "gauges": gauge_values,
+        }
+
+
+# Module-level singleton shared by every router and service in the process
+metrics = MetricsRegistry()
+
+__all__ = [
+    "DEFAULT_SIZE_BUCKETS",
+    "DEFAULT_TIME_BUCKETS",
+    "Histogram",
+    "MetricsRegistry",
+    "metrics",
+]
@@ -0,0 +1,85 @@
+"""
+Password hashing off the event loop.
+
+bcrypt costs 100-300ms of CPU per call by design. Running it inline in an
+``async def`` handler stalls every other request on the worker, so hashes
+and verifications run on a small dedicated thread pool instead (bcrypt
+releases the GIL while it works). The pool is bounded twice: ``max_workers``
+caps the CPU spent on hashing, and ``max_pending`` caps how many calls may
+wait for a worker. Beyond that, callers get ``PasswordHasherBusy`` right away
+instead of queueing unbounded work during a login storm.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import os
+import time
+
+from passlib.context import CryptContext
+
+from services.metrics import metrics
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+class PasswordHasher:
+    def __init__(self, context: CryptContext, max_workers: Optional[int] = None, max_pending: int = 32):
+        self.context = context
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending
+        self.inflight = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pwhash")
+        return self._executor
+
+    async def _run(self, operation: str, fn, *args):
+        # Admission control runs on the event loop thread, so the counter
+        # needs no lock.
+        if self.inflight >= self.max_workers + self.max_pending:
+            self.rejected += 1
+            metrics.inc("password_hash_rejected_total", labels={"op": operation})
+            raise PasswordHasherBusy("Too many concurrent password operations")
+
+        self.inflight += 1
+        queued_at = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                labels = {"op": operation}
+                metrics.observe("password_hash_wait_seconds", started - queued_at, labels)
+                metrics.observe("password_hash_seconds", time.perf_counter() - started, labels)
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), timed)
+        finally:
+            self.inflight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify ``password`` and return ``(ok, new_hash)``.
+
+        ``new_hash`` is set when the stored hash was made with a different
+        cost (or a deprecated scheme) and should be saved in its place.
+        """
+        return await self._run("verify", self.context.verify_and_update, password, hashed)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+__all__ = ["PasswordHasher", "PasswordHasherBusy"]
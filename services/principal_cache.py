@@ -0,0 +1,96 @@
+"""
+Cache of authenticated principals.
+
+Resolving a bearer token used to cost a ``SELECT`` on ``users`` for every
+request, and handed back an ORM object bound to the request's session. Most
+endpoints only need to know *who* is calling, so a verified token now
+resolves to an immutable ``UserPrincipal`` that is cached per
+``(user_id, token id)`` for a short TTL. Entries for a user are dropped as
+soon as that user's identity columns change or the row is deleted (see the
+mapper hooks in ``auth.py``).
+"""
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+import threading
+import time
+
+
+class UserPrincipal(NamedTuple):
+    id: int
+    email: str
+    name: str
+
+
+_Key = Tuple[int, Optional[str]]
+
+
+class PrincipalCache:
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[_Key, Tuple[float, UserPrincipal]]" = OrderedDict()
+        self._by_user: Dict[int, Set[_Key]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, token_id: Optional[str]) -> Optional[UserPrincipal]:
+        key = (user_id, token_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, token_id: Optional[str], principal: UserPrincipal) -> None:
+        key = (principal.id, token_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(key)
+            self._by_user.setdefault(principal.id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: _Key) -> None:
+        self._entries.pop(key, None)
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Drop every cached token of ``user_id``."""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def invalidate_token(self, user_id: int, token_id: Optional[str]) -> None:
+        with self._lock:
+            self._remove((user_id, token_id))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    @property
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+        }
+
+
+__all__ = ["PrincipalCache", "UserPrincipal"]
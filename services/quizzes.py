@@ -0,0 +1,114 @@
+"""
+Quiz persistence and set-based grading.
+
+``create_quiz`` writes a generated quiz with one ``INSERT`` for the quiz row
+and one multi-row ``INSERT ... RETURNING`` for all of its questions.
+
+``grade_quiz`` never loads a question into Python. It runs three statements,
+however many questions the quiz has:
+
+1. one ``UPDATE quiz_questions`` sets ``user_answer`` and ``is_correct`` for
+   the whole quiz. The submitted answers come in as a ``CASE`` on the
+   question id, and unanswered questions count as wrong. Nothing is
+   written to a quiz that is already completed;
+2. one ``UPDATE quizzes`` counts the correct answers and the questions with
+   subqueries, then stores the score and marks the quiz completed. It only
+   matches a quiz that isn't completed yet, so a second submission of the
+   same quiz changes nothing and gets ``None``;
+3. one ``UPDATE users`` recomputes ``quiz_accuracy`` over all the user's
+   completed quizzes.
+
+Answers are stored in the same form as ``correct_answer``, "Option A" to
+"Option D". The caller awards XP and ``quizzes_completed`` through
+``GamificationService.record_activity`` in the same transaction.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from models.user import User
+from models.session import Quiz, QuizQuestion, StudySession
+
+OPTIONS = ("A", "B", "C", "D")
+
+
+class QuizResult(NamedTuple):
+    session_id: int
+    correct_answers: int
+    total_questions: int
+    score: float
+
+
+def normalize_answer(answer: str) -> Optional[str]:
+    """"A", "a", "Option A" -> "Option A"; ``None`` for anything else."""
+    letter = answer.strip().upper().replace("OPTION", "").strip()
+    return f"Option {letter}" if letter in OPTIONS else None
+
+
+def create_quiz(db: Session, session_id: int, questions: List[Dict]) -> Tuple[int, List[int]]:
+    """Insert a quiz and its questions; returns (quiz_id, question ids in order). The caller commits."""
+    quiz_id = db.execute(
+        insert(Quiz).values(session_id=session_id, total_questions=len(questions)).returning(Quiz.id)
+    ).scalar_one()
+    question_ids = db.execute(
+        insert(QuizQuestion).returning(QuizQuestion.id, sort_by_parameter_order=True),
+        [
+            {
+                "quiz_id": quiz_id,
+                "question_text": q["question"],
+                "option_a": q["option_a"],
+                "option_b": q["option_b"],
+                "option_c": q["option_c"],
+                "option_d": q["option_d"],
+                "correct_answer": normalize_answer(q["correct"]) or q["correct"],
+            }
+            for q in questions
+        ]
+    ).scalars().all()
+    return quiz_id, list(question_ids)
+
+
+def grade_quiz(db: Session, user_id: int, quiz_id: int, answers: Dict[int, str]) -> Optional[QuizResult]:
+    """
+    Record ``answers`` (question id -> normalized answer) and score the quiz.
+    Returns ``None`` if the quiz is already completed. The caller commits.
+    """
+    questions = QuizQuestion.__table__
+    quizzes = Quiz.__table__
+    pending = select(quizzes.c.id).where(quizzes.c.id == quiz_id, quizzes.c.completed.isnot(True))
+    answer = case(answers, value=questions.c.id) if answers else None
+    db.execute(
+        update(questions).where(questions.c.quiz_id.in_(pending)).values(
+            user_answer=answer,
+            is_correct=func.coalesce(questions.c.correct_answer == answer, False) if answers else False,
+        )
+    )
+
+    correct = select(func.count()).where(
+        questions.c.quiz_id == quiz_id, questions.c.is_correct.is_(True)
+    ).scalar_subquery()
+    total = select(func.count()).where(questions.c.quiz_id == quiz_id).scalar_subquery()
+    row = db.execute(
+        update(quizzes).where(quizzes.c.id == quiz_id, quizzes.c.completed.isnot(True)).values(
+            completed=True,
+            correct_answers=correct,
+            total_questions=total,
+            score=func.coalesce(correct * 100.0 / func.nullif(total, 0), 0.0),
+        ).returning(quizzes.c.session_id, quizzes.c.correct_answers, quizzes.c.total_questions, quizzes.c.score)
+    ).first()
+    if row is None:
+        return None
+
+    accuracy = select(
+        func.coalesce(func.sum(quizzes.c.correct_answers) * 100.0 / func.nullif(func.sum(quizzes.c.total_questions), 0), 0.0)
+    ).select_from(quizzes.join(StudySession.__table__, StudySession.id == quizzes.c.session_id)).where(
+        StudySession.user_id == user_id, quizzes.c.completed.is_(True)
+    ).scalar_subquery()
+    db.execute(
+        update(User).where(User.id == user_id).values(quiz_accuracy=accuracy).execution_options(synchronize_session=False)
+    )
+    return QuizResult(row.session_id, row.correct_answers, row.total_questions, float(row.score))
+
+
+__all__ = ["QuizResult", "create_quiz", "grade_quiz", "normalize_answer"]
@@ -2,12 +2,35 @@
 Enhanced RAG Service with Document Q&A, Quiz, and Flashcard Generation
 """
 from typing import List, Dict, Optional
+from collections import OrderedDict
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from config import settings
+from services.summary_tree import is_broad_question, summary_context
+import json
 import os
+import time
+
+# Per-session caches shared by every RAGService instance (the chat, language,
+# flashcard and quiz routers each construct their own service).
+_MAX_CACHED_SESSIONS = 256
+_vectorstores: "OrderedDict[int, Chroma]" = OrderedDict()
+_study_packs: "OrderedDict[int, Dict]" = OrderedDict()
+
+
+def _cache_put(cache: OrderedDict, key: int, value) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _MAX_CACHED_SESSIONS:
+        cache.popitem(last=False)
+
+
+def invalidate_session_cache(session_id: int) -> None:
+    """Forget cached vector store handles and study packs after new material is indexed."""
+    _vectorstores.pop(session_id, None)
+    _study_packs.pop(session_id, None)
 
 
 class RAGService:
@@ -50,12 +73,6 @@ class RAGService:
             if not self.embeddings or not self.llm:
                 return "🤖 I'm here to help! Unfortunately, OpenAI API is not configured. Please check your settings to enable AI-powered responses. In the meantime, upload materials and I'll do my best! 💖"
             
-            # Load vectorstore
-            vectorstore = Chroma(
-                persist_directory=vectorstore_path,
-                embedding_function=self.embeddings
-            )
-            
             # Create custom prompt
             prompt_template = """You are Aurora, a friendly and enthusiastic study companion AI! 🌟
             
@@ -74,6 +91,16 @@ Your helpful answer:"""
                 input_variables=["context", "question"]
             )
             
+            # Broad questions are answered from the summary tree with a fixed-size prompt
+            if is_broad_question(query):
+                context = summary_context(session_id, query, settings.SUMMARY_PROMPT_CHARS)
+                if context:
+                    response = self.llm.invoke(PROMPT.format(context=context, question=query))
+                    return response.content if hasattr(response, 'content') else str(response)
+            
+            # Load vectorstore
+            vectorstore = self._get_vectorstore(session_id)
+            
             # Create QA chain
             qa_chain = RetrievalQA.from_chain_type(
                 llm=self.llm,
@@ -91,109 +118,165 @@ Your helpful answer:"""
             print(f"RAG response error: {e}")
             return f"I encountered an error while processing your question. Please try again! 🥺 (Error: {str(e)})"
     
-    async def generate_quiz(
+    def _get_vectorstore(self, session_id: int) -> Optional[Chroma]:
+        """Open (once per process) the Chroma collection for a session"""
+        vectorstore = _vectorstores.get(session_id)
+        if vectorstore is not None:
+            _vectorstores.move_to_end(session_id)
+            return vectorstore
+        
+        vectorstore_path = f"{settings.CHROMA_PERSIST_DIR}/session_{session_id}"
+        if not os.path.exists(vectorstore_path) or not self.embeddings:
+            return None
+        
+        vectorstore = Chroma(
+            persist_directory=vectorstore_path,
+            embedding_function=self.embeddings
+        )
+        _cache_put(_vectorstores, session_id, vectorstore)
+        return vectorstore
+    
+    async def generate_study_pack(
         self,
         session_id: int,
         num_questions: int = 5,
-        difficulty: str = "medium"
-    ) -> List[Dict]:
-        """Generate quiz questions from uploaded documents"""
+        num_cards: int = 10,
+        difficulty: str = "medium",
+        refresh: bool = False
+    ) -> Dict:
+        """
+        Generate quiz questions, flashcards and a summary in a single LLM call.
+        
+        The context is retrieved once and the parsed pack is cached per session,
+        so follow-up quiz and flashcard requests are answered from the cache.
+        """
+        cached = _study_packs.get(session_id)
+        if (
+            cached
+            and not refresh
+            and cached["difficulty"] == difficulty
+            and cached["num_questions"] >= num_questions
+            and cached["num_cards"] >= num_cards
+            and time.time() - cached["created_at"] < settings.STUDY_PACK_TTL_MINUTES * 60
+        ):
+            _study_packs.move_to_end(session_id)
+            return cached
+        
+        if cached and not refresh:
+            # Never shrink a pack that a follow-up request might still need
+            num_questions = max(num_questions, cached["num_questions"])
+            num_cards = max(num_cards, cached["num_cards"])
+        
         try:
-            vectorstore_path = f"{settings.CHROMA_PERSIST_DIR}/session_{session_id}"
-            
-            if not os.path.exists(vectorstore_path) or not self.embeddings or not self.llm:
-                return self._get_sample_questions(num_questions)
+            vectorstore = self._get_vectorstore(session_id)
+            if vectorstore is None or not self.llm:
+                return self._get_sample_pack(session_id, num_questions, num_cards, difficulty)
             
-            # Load vectorstore
-            vectorstore = Chroma(
-                persist_directory=vectorstore_path,
-                embedding_function=self.embeddings
-            )
-            
-            # Get diverse chunks from materials
+            # One retrieval covers every artifact
             retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-            docs = retriever.get_relevant_documents("Generate diverse questions covering main concepts")
+            docs = retriever.get_relevant_documents("Main concepts, key terms, definitions and important facts")
             
             if not docs:
-                return self._get_sample_questions(num_questions)
+                return self._get_sample_pack(session_id, num_questions, num_cards, difficulty)
             
-            # Combine content
-            context = "\n\n".join([doc.page_content for doc in docs[:5]])
+            context = "\n\n".join([doc.page_content for doc in docs])
             
-            # Generate questions using LLM
-            prompt = f"""Based on the following study materials, create {num_questions} multiple-choice questions at {difficulty} difficulty level.
+            prompt = f"""Based on the following study materials, create a study pack.
 
 Study Materials:
 {context[:3000]}
 
-Generate EXACTLY {num_questions} questions. For each question, provide:
-1. A clear question
-2. Four distinct options (A, B, C, D)
-3. The correct answer (must be one of: "Option A", "Option B", "Option C", or "Option D")
-4. A brief explanation
+Create:
+1. A short summary of the materials (3-5 sentences)
+2. EXACTLY {num_questions} multiple-choice questions at {difficulty} difficulty level, each with four distinct options and one correct answer
+3. EXACTLY {num_cards} flashcards covering the most important concepts
 
-Format each question EXACTLY like this:
-QUESTION: [question text]
-OPTION_A: [first option]
-OPTION_B: [second option]
-OPTION_C: [third option]
-OPTION_D: [fourth option]
-CORRECT: [Option A, Option B, Option C, or Option D]
----END---
-
-Make sure to end each question with ---END--- marker."""
+Respond with ONLY a JSON object in exactly this shape:
+{{
+  "summary": "...",
+  "questions": [
+    {{"question": "...", "option_a": "...", "option_b": "...", "option_c": "...", "option_d": "...", "correct": "Option A"}}
+  ],
+  "flashcards": [
+    {{"front": "...", "back": "..."}}
+  ]
+}}
+"correct" must be one of "Option A", "Option B", "Option C" or "Option D"."""
             
             response = self.llm.invoke(prompt)
             content = response.content if hasattr(response, 'content') else str(response)
             
-            # Parse response
-            questions = self._parse_quiz_response(content, num_questions)
-            
-            return questions if questions else self._get_sample_questions(num_questions)
+            pack = self._parse_study_pack(content, num_questions, num_cards)
+            if not pack["questions"] or not pack["flashcards"]:
+                return self._get_sample_pack(session_id, num_questions, num_cards, difficulty)
+            
+            pack.update({
+                "session_id": session_id,
+                "difficulty": difficulty,
+                "num_questions": num_questions,
+                "num_cards": num_cards,
+                "created_at": time.time()
+            })
+            _cache_put(_study_packs, session_id, pack)
+            return pack
         
         except Exception as e:
-            print(f"Quiz generation error: {e}")
-            return self._get_sample_questions(num_questions)
+            print(f"Study pack generation error: {e}")
+            return self._get_sample_pack(session_id, num_questions, num_cards, difficulty)
     
-    def _parse_quiz_response(self, content: str, num_questions: int) -> List[Dict]:
-        """Parse LLM response into quiz questions"""
-        questions = []
+    def _parse_study_pack(self, content: str, num_questions: int, num_cards: int) -> Dict:
+        """Parse the JSON study pack, tolerating code fences or chatter around it"""
+        pack = {"summary": "", "questions": [], "flashcards": []}
         
         try:
-            # Split by question markers
-            question_blocks = content.split('---END---')
-            
-            for block in question_blocks[:num_questions]:
-                if not block.strip():
-                    continue
-                
-                lines = block.strip().split('\n')
-                question_data = {}
-                
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith('QUESTION:'):
-                        question_data['question'] = line.replace('QUESTION:', '').strip()
-                    elif line.startswith('OPTION_A:'):
-                        question_data['option_a'] = line.replace('OPTION_A:', '').strip()
-                    elif line.startswith('OPTION_B:'):
-                        question_data['option_b'] = line.replace('OPTION_B:', '').strip()
-                    elif line.startswith('OPTION_C:'):
-                        question_data['option_c'] = line.replace('OPTION_C:', '').strip()
-                    elif line.startswith('OPTION_D:'):
-                        question_data['option_d'] = line.replace('OPTION_D:', '').strip()
-                    elif line.startswith('CORRECT:'):
-                        question_data['correct'] = line.replace('CORRECT:', '').strip()
-                
-                # Validate question has all required fields
-                if all(key in question_data for key in ['question', 'option_a', 'option_b', 'option_c', 'option_d', 'correct']):
-                    questions.append(question_data)
-            
-            return questions
+            data = json.loads(content[content.index('{'):content.rindex('}') + 1])
+        except (ValueError, TypeError) as e:
+            print(f"Study pack parse error: {e}")
+            return pack
         
-        except Exception as e:
-            print(f"Parse error: {e}")
-            return []
+        question_keys = ['question', 'option_a', 'option_b', 'option_c', 'option_d', 'correct']
+        for item in data.get("questions") or []:
+            # Validate question has all required fields
+            if isinstance(item, dict) and all(item.get(key) for key in question_keys):
+                pack["questions"].append({key: str(item[key]).strip() for key in question_keys})
+        
+        for item in data.get("flashcards") or []:
+            if isinstance(item, dict) and item.get("front") and item.get("back"):
+                pack["flashcards"].append({"front": str(item["front"]).strip(), "back": str(item["back"]).strip()})
+        
+        pack["summary"] = str(data.get("summary") or "").strip()
+        pack["questions"] = pack["questions"][:num_questions]
+        pack["flashcards"] = pack["flashcards"][:num_cards]
+        return pack
+    
+    def _get_sample_pack(self, session_id: int, num_questions: int, num_cards: int, difficulty: str) -> Dict:
+        """Fallback study pack (never cached)"""
+        return {
+            "session_id": session_id,
+            "difficulty": difficulty,
+            "num_questions": num_questions,
+            "num_cards": num_cards,
+            "summary": "Upload your study materials to get a personalized summary! ✨",
+            "questions": self._get_sample_questions(num_questions),
+            "flashcards": self._get_sample_flashcards(num_cards),
+            "created_at": time.time()
+        }
+    
+    async def generate_quiz(
+        self,
+        session_id: int,
+        num_questions: int = 5,
+        difficulty: str = "medium"
+    ) -> List[Dict]:
+        """Generate quiz questions from uploaded documents (served from the study pack)"""
+        cached = _study_packs.get(session_id)
+        pack = await self.generate_study_pack(
+            session_id=session_id,
+            num_questions=num_questions,
+            num_cards=cached["num_cards"] if cached else 10,
+            difficulty=difficulty
+        )
+        return pack["questions"][:num_questions]
     
     def _get_sample_questions(self, num: int) -> List[Dict]:
         """Fallback sample questions"""
@@ -214,93 +297,16 @@ Make sure to end each question with ---END--- marker."""
         session_id: int,
         num_cards: int = 10
     ) -> List[Dict]:
-        """Generate flashcards from uploaded documents"""
-        try:
-            vectorstore_path = f"{settings.CHROMA_PERSIST_DIR}/session_{session_id}"
-            
-            if not os.path.exists(vectorstore_path) or not self.embeddings or not self.llm:
-                return self._get_sample_flashcards(num_cards)
-            
-            # Load vectorstore
-            vectorstore = Chroma(
-                persist_directory=vectorstore_path,
-                embedding_function=self.embeddings
-            )
-            
-            # Get diverse chunks
-            retriever = vectorstore.as_retriever(search_kwargs={"k": 8})
-            docs = retriever.get_relevant_documents("Key concepts, definitions, important terms")
-            
-            if not docs:
-                return self._get_sample_flashcards(num_cards)
-            
-            # Combine content
-            context = "\n\n".join([doc.page_content for doc in docs])
-            
-            # Generate flashcards
-            prompt = f"""Based on the following study materials, create {num_cards} flashcards for studying.
-
-Study Materials:
-{context[:3000]}
-
-For each flashcard, provide:
-- FRONT: A key concept, term, or question
-- BACK: The answer, definition, or explanation
-
-Format EXACTLY like this:
-FRONT: [concept/question]
-BACK: [answer/explanation]
----END---
-
-Create {num_cards} flashcards covering the most important concepts."""
-            
-            response = self.llm.invoke(prompt)
-            content = response.content if hasattr(response, 'content') else str(response)
-            
-            # Parse response
-            flashcards = self._parse_flashcards(content, num_cards)
-            
-            return flashcards if flashcards else self._get_sample_flashcards(num_cards)
-        
-        except Exception as e:
-            print(f"Flashcard generation error: {e}")
-            return self._get_sample_flashcards(num_cards)
-    
-    def _parse_flashcards(self, content: str, num_cards: int) -> List[Dict]:
-        """Parse LLM response into flashcards"""
-        flashcards = []
-        
-        try:
-            card_blocks = content.split('---END---')
-            
-            for block in card_blocks[:num_cards]:
-                if not block.strip():
-                    continue
-                
-                lines = block.strip().split('\n')
-                card_data = {}
-                
-                current_section = None
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith('FRONT:'):
-                        current_section = 'front'
-                        card_data['front'] = line.replace('FRONT:', '').strip()
-                    elif line.startswith('BACK:'):
-                        current_section = 'back'
-                        card_data['back'] = line.replace('BACK:', '').strip()
-                    elif current_section and line:
-                        # Continuation of previous section
-                        card_data[current_section] += ' ' + line
-                
-                if 'front' in card_data and 'back' in card_data:
-                    flashcards.append(card_data)
-            
-            return flashcards
-        
-        except Exception as e:
-            print(f"Flashcard parse error: {e}")
-            return []
+        """Generate flashcards from uploaded documents (served from the study pack)"""
+        cached = _study_packs.get(session_id)
+        pack = await self.generate_study_pack(
+            session_id=session_id,
+            num_questions=cached["num_questions"] if cached else 5,
+            num_cards=num_cards,
+            # Reuse whatever difficulty the session's quiz was generated at
+            difficulty=cached["difficulty"] if cached else "medium"
+        )
+        return pack["flashcards"][:num_cards]
     
     def _get_sample_flashcards(self, num: int) -> List[Dict]:
         """Fallback sample flashcards"""
@@ -332,10 +338,7 @@ Create {num_cards} flashcards covering the most important concepts."""
             context = ""
             if has_materials and self.embeddings:
                 try:
-                    vectorstore = Chroma(
-                        persist_directory=vectorstore_path,
-                        embedding_function=self.embeddings
-                    )
+                    vectorstore = self._get_vectorstore(session_id)
                     retriever = vectorstore.as_retriever(search_kwargs={"k": 2})
                     docs = retriever.get_relevant_documents(query)
                     if docs:
@@ -0,0 +1,235 @@
+"""
+Rotating refresh tokens with server-side revocation.
+
+A refresh token is an opaque random string. Only its SHA-256 is stored, so a
+lookup is a single indexed equality match and no bcrypt is involved. Every
+use rotates the token: the presented row is revoked and linked to its
+replacement, which shares the row's ``family_id``. If a revoked token is ever
+presented again it has been stolen or replayed, and the whole family is
+revoked, which signs out every device that descends from that login.
+
+Two tabs share one refresh token, so they can both present it at once, or
+one can present it just after the other rotated it. For
+``REFRESH_TOKEN_REUSE_GRACE_SECONDS`` after a rotation, the rotated-away
+token therefore gets a sibling in the same family instead of revoking the
+family, as long as the family still has a live token. That holds for a lost
+conditional claim too. Each rotated token gets at most one sibling (claimed
+through ``grace_used_at``), so replaying a stolen token inside the window
+can't mint more: a second replay is reuse and revokes everything, as is any
+reuse outside the window.
+
+Expired rows are deleted by a scheduled job, started on the first token
+issued.
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+import hashlib
+import secrets
+import uuid
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from services.metrics import metrics
+from services.scheduler import scheduler
+from services.write_queue import write_queue
+from user import RefreshToken
+
+PURGE_JOB = "refresh_token_purge"
+
+
+class RefreshTokenError(Exception):
+    pass
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _new_row(user_id: int, family_id: str) -> Tuple[str, RefreshToken]:
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    row = RefreshToken(
+        user_id=user_id,
+        token_hash=_hash(token),
+        family_id=family_id,
+        issued_at=now,
+        expires_at=now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    return token, row
+
+
+def issue_refresh_token(db: Session, user_id: int) -> str:
+    """Start a new token family for a fresh login. The caller commits."""
+    token, row = _new_row(user_id, uuid.uuid4().hex)
+    db.add(row)
+    return token
+
+
+def _revoke_family(db: Session, family_id: str, now: datetime) -> None:
+    db.query(RefreshToken).filter(
+        RefreshToken.family_id == family_id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({"revoked_at": now}, synchronize_session=False)
+
+
+def _within_grace(db: Session, row: RefreshToken, now: datetime) -> bool:
+    """True for a token rotated moments ago whose family still has a live token (another tab, a retry)."""
+    grace = timedelta(seconds=settings.REFRESH_TOKEN_REUSE_GRACE_SECONDS)
+    if row.replaced_by_id is None or row.revoked_at is None or row.revoked_at < now - grace:  # type: ignore
+        return False
+    return db.query(RefreshToken.id).filter(
+        RefreshToken.family_id == row.family_id,
+        RefreshToken.revoked_at.is_(None),
+        RefreshToken.expires_at > now
+    ).first() is not None
+
+
+def _sibling(db: Session, row: RefreshToken, now: datetime) -> Optional[Tuple[int, str]]:
+    """The one sibling a rotated token may get; ``None`` if it already had it."""
+    claimed = db.query(RefreshToken).filter(
+        RefreshToken.id == row.id,
+        RefreshToken.grace_used_at.is_(None)
+    ).update({"grace_used_at": now}, synchronize_session=False)
+    if not claimed:
+        return None
+    new_token, new_row = _new_row(int(row.user_id), str(row.family_id))  # type: ignore
+    db.add(new_row)
+    db.commit()
+    return int(row.user_id), new_token  # type: ignore
+
+
+def _reused(db: Session, row: RefreshToken, now: datetime) -> Tuple[int, str]:
+    """A revoked token came back: a sibling within the grace window, else revoke the family."""
+    if _within_grace(db, row, now):
+        sibling = _sibling(db, row, now)
+        if sibling is not None:
+            return sibling
+    _revoke_family(db, str(row.family_id), now)
+    db.commit()
+    raise RefreshTokenError("Refresh token reuse detected")
+
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[int, str]:
+    """
+    Exchange ``token`` for a new one in the same family.
+
+    Returns ``(user_id, new_token)``; commits on success, on a grace-window
+    reuse and on reuse detection.
+    """
+    now = datetime.utcnow()
+    row: Optional[RefreshToken] = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == _hash(token)
+    ).first()
+    if row is None:
+        raise RefreshTokenError("Invalid refresh token")
+
+    if row.revoked_at is not None:
+        return _reused(db, row, now)
+
+    if row.expires_at <= now:  # type: ignore
+        raise RefreshTokenError("Refresh token expired")
+
+    # Conditional update so two concurrent refreshes can't both win
+    claimed = db.query(RefreshToken).filter(
+        RefreshToken.id == row.id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({"revoked_at": now}, synchronize_session=False)
+    if not claimed:
+        # A concurrent refresh won; see what it left
+        db.refresh(row)
+        return _reused(db, row, now)
+
+    new_token, new_row = _new_row(int(row.user_id), str(row.family_id))  # type: ignore
+    db.add(new_row)
+    db.flush()
+    row.replaced_by_id = new_row.id  # type: ignore
+    db.commit()
+    return int(row.user_id), new_token  # type: ignore
+
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """Log out: revoke the token's whole family. Returns False for unknown tokens."""
+    row = db.query(RefreshToken).filter(RefreshToken.token_hash == _hash(token)).first()
+    if row is None:
+        return False
+    _revoke_family(db, str(row.family_id), datetime.utcnow())
+    db.commit()
+    return True
+
+
+def purge_expired_refresh_tokens(db: Session, older_than_days: int = 30) -> int:
+    """Delete rows that expired more than ``older_than_days`` ago."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    # Break replaced_by links into the rows being deleted first
+    expired_ids = db.query(RefreshToken.id).filter(RefreshToken.expires_at < cutoff)
+    db.query(RefreshToken).filter(
+        RefreshToken.replaced_by_id.in_(expired_ids.scalar_subquery())
+    ).update({"replaced_by_id": None}, synchronize_session=False)
+    deleted = db.query(RefreshToken).filter(
+        RefreshToken.expires_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+class RefreshTokenPurger:
+    """Runs ``purge_expired_refresh_tokens`` from the scheduler."""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        older_than_days: int = 30,
+        interval_seconds: float = 3600,
+    ):
+        self.session_factory = session_factory
+        self.older_than_days = older_than_days
+        self.interval_seconds = interval_seconds
+        self.purged = 0
+        self._scheduled = False
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def ensure_scheduled(self) -> None:
+        if not self._scheduled:
+            self._scheduled = True
+            scheduler.add_job(PURGE_JOB, self.interval_seconds, self.run, run_at_exit=False)
+
+    def run(self) -> int:
+        db = self._session()
+        try:
+            with write_queue.exclusive():
+                deleted = purge_expired_refresh_tokens(db, self.older_than_days)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.purged += deleted
+        metrics.inc("refresh_tokens_purged_total", deleted)
+        return deleted
+
+    def stats(self) -> Dict:
+        return {"purged": self.purged}
+
+
+refresh_token_purger = RefreshTokenPurger(
+    older_than_days=settings.REFRESH_TOKEN_PURGE_AFTER_DAYS,
+    interval_seconds=settings.REFRESH_TOKEN_PURGE_SECONDS,
+)
+metrics.register_gauge("refresh_token_purge", refresh_token_purger.stats)
+
+
+__all__ = [
+    "RefreshTokenError",
+    "RefreshTokenPurger",
+    "issue_refresh_token",
+    "purge_expired_refresh_tokens",
+    "refresh_token_purger",
+    "revoke_refresh_token",
+    "rotate_refresh_token",
+]
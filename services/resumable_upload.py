@@ -0,0 +1,294 @@
+"""
+Resumable, chunked uploads for large study materials.
+
+A client creates an upload with the final size, then PUTs byte ranges in any
+order (or in parallel). Each part is verified against its SHA-256 and written
+straight to its offset in a preallocated file, so nothing is buffered or
+re-sent after a dropped connection: the client asks which ranges are still
+missing and continues from there. Completed uploads are handed back to the
+caller for ingestion; abandoned ones are garbage-collected after a TTL.
+
+State lives on disk next to the partial file (``<id>.json`` + ``<id>.part``)
+so uploads survive a server restart.
+"""
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import aiofiles
+
+
+class ResumableUploadError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """Merge half-open ``[start, end)`` ranges into a sorted, disjoint list."""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(received: List[List[int]], total_size: int) -> List[List[int]]:
+    missing = []
+    position = 0
+    for start, end in received:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < total_size:
+        missing.append([position, total_size])
+    return missing
+
+
+def parse_content_range(header: Optional[str]) -> Tuple[int, int, int]:
+    """Parse ``bytes start-end/total`` (inclusive end) into ``(start, end_exclusive, total)``."""
+    try:
+        unit, spec = header.strip().split(" ", 1)  # type: ignore
+        span, total = spec.split("/")
+        start, end = span.split("-")
+        if unit != "bytes":
+            raise ValueError(unit)
+        return int(start), int(end) + 1, int(total)
+    except (AttributeError, ValueError):
+        raise ResumableUploadError("Content-Range must look like 'bytes <start>-<end>/<total>'")
+
+
+def _preallocate(path: str, size: int) -> None:
+    with open(path, "wb") as f:
+        if size and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, size)
+        else:
+            f.truncate(size)
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResumableUploadStore:
+    def __init__(self, root: str, ttl_hours: float, max_file_size: int, max_part_size: int):
+        self.root = root
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_file_size = max_file_size
+        self.max_part_size = max_part_size
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last_gc = 0.0
+
+    def _paths(self, upload_id: str) -> Tuple[str, str]:
+        if not upload_id.isalnum():
+            raise ResumableUploadError("Upload not found", 404)
+        return (
+            os.path.join(self.root, f"{upload_id}.json"),
+            os.path.join(self.root, f"{upload_id}.part"),
+        )
+
+    def _lock(self, upload_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    def _save(self, state: Dict) -> None:
+        manifest_path, _ = self._paths(state["upload_id"])
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, manifest_path)
+
+    def _load(self, upload_id: str, user_id: int) -> Dict:
+        manifest_path, _ = self._paths(upload_id)
+        try:
+            with open(manifest_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            raise ResumableUploadError("Upload not found", 404)
+        if state["user_id"] != user_id:
+            raise ResumableUploadError("Upload not found", 404)
+        return state
+
+    def status(self, state: Dict) -> Dict:
+        missing = missing_ranges(state["received"], state["total_size"])
+        return {
+            "upload_id": state["upload_id"],
+            "filename": state["filename"],
+            "total_size": state["total_size"],
+            "received": state["received"],
+            "missing": missing,
+            "complete": not missing,
+            "max_part_size": self.max_part_size,
+            "expires_at": datetime.utcfromtimestamp(state["updated_at"] + self.ttl_seconds).isoformat(),
+        }
+
+    def create(self, user_id: int, filename: str, total_size: int, sha256: Optional[str] = None) -> Dict:
+        if total_size <= 0 or total_size > self.max_file_size:
+            raise ResumableUploadError(f"File size must be between 1 and {self.max_file_size} bytes", 413)
+
+        self.maybe_collect_garbage()
+        os.makedirs(self.root, exist_ok=True)
+
+        upload_id = uuid.uuid4().hex
+        _, part_path = self._paths(upload_id)
+        _preallocate(part_path, total_size)
+
+        now = time.time()
+        state = {
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "filename": filename,
+            "total_size": total_size,
+            "sha256": sha256.lower() if sha256 else None,
+            "received": [],
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._save(state)
+        return state
+
+    def get(self, upload_id: str, user_id: int) -> Dict:
+        return self._load(upload_id, user_id)
+
+    async def write_part(
+        self,
+        upload_id: str,
+        user_id: int,
+        start: int,
+        end: int,
+        total: int,
+        data: bytes,
+        sha256: Optional[str],
+    ) -> Dict:
+        state = self._load(upload_id, user_id)
+        if total != state["total_size"] or not 0 <= start < end <= total:
+            raise ResumableUploadError("Content-Range does not match the upload", 416)
+        if len(data) != end - start:
+            raise ResumableUploadError("Body length does not match Content-Range")
+        if len(data) > self.max_part_size:
+            raise ResumableUploadError(f"Parts may be at most {self.max_part_size} bytes", 413)
+        if not sha256 or hashlib.sha256(data).hexdigest() != sha256.lower():
+            raise ResumableUploadError("Part SHA-256 missing or mismatched", 422)
+
+        # The write happens under the upload's lock, like verify() and complete(),
+        # so no byte changes after the hash pass or lands in a file that was
+        # already moved away. The part was hashed above, outside the lock.
+        async with self._lock(upload_id):
+            state = self._load(upload_id, user_id)
+            _, part_path = self._paths(upload_id)
+            async with aiofiles.open(part_path, "r+b") as f:
+                await f.seek(start)
+                await f.write(data)
+            state["received"] = merge_ranges(state["received"] + [[start, end]])
+            state["updated_at"] = time.time()
+            state["verified"] = False
+            self._save(state)
+        return state
+
+    async def verify(self, upload_id: str, user_id: int) -> Dict:
+        """Check that every byte arrived and, if given at creation, the whole-file hash."""
+        async with self._lock(upload_id):
+            state = self._load(upload_id, user_id)
+            if missing_ranges(state["received"], state["total_size"]):
+                raise ResumableUploadError("Upload is incomplete", 409)
+
+            if state["sha256"] and not state.get("verified"):
+                _, part_path = self._paths(upload_id)
+                digest = await asyncio.to_thread(_file_sha256, part_path)
+                if digest != state["sha256"]:
+                    raise ResumableUploadError("File SHA-256 mismatch", 422)
+            state["verified"] = True
+            self._save(state)
+        return state
+
+    async def complete(
+        self,
+        upload_id: str,
+        user_id: int,
+        destination: Callable[[Dict], Awaitable[str]]
+    ) -> Dict:
+        """
+        Move a verified upload to the path ``destination(state)`` returns and
+        forget about it. ``destination`` runs under the upload's lock, once the
+        upload is known to be complete, so whatever it creates for the file
+        (the study session) is never orphaned by a racing PUT or abort.
+        """
+        async with self._lock(upload_id):
+            state = self._load(upload_id, user_id)
+            if not state.get("verified"):
+                raise ResumableUploadError("Upload has not been verified", 409)
+
+            path = await destination(state)
+            manifest_path, part_path = self._paths(upload_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(part_path, path)
+            os.remove(manifest_path)
+        self._locks.pop(upload_id, None)
+        return state
+
+    async def abort(self, upload_id: str, user_id: int) -> None:
+        async with self._lock(upload_id):
+            self._load(upload_id, user_id)
+            self._discard(upload_id)
+
+    def _discard(self, upload_id: str) -> None:
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._locks.pop(upload_id, None)
+
+    def collect_garbage(self, now: Optional[float] = None) -> int:
+        """Delete uploads that have not received a part within the TTL."""
+        now = now or time.time()
+        removed = 0
+        if not os.path.isdir(self.root):
+            return 0
+        for name in os.listdir(self.root):
+            upload_id, ext = os.path.splitext(name)
+            path = os.path.join(self.root, name)
+            if ext == ".json":
+                try:
+                    with open(path) as f:
+                        updated_at = json.load(f)["updated_at"]
+                except (OSError, ValueError, KeyError):
+                    updated_at = os.path.getmtime(path)
+            elif ext == ".part" and not os.path.exists(os.path.join(self.root, upload_id + ".json")):
+                # Orphaned data file (manifest lost); age it by mtime.
+                try:
+                    updated_at = os.path.getmtime(path)
+                except OSError:
+                    continue  # already removed together with its manifest
+            else:
+                continue
+            if now - updated_at > self.ttl_seconds:
+                self._discard(upload_id)
+                removed += 1
+        return removed
+
+    def maybe_collect_garbage(self) -> None:
+        """Run ``collect_garbage`` at most every few minutes from request paths."""
+        now = time.time()
+        if now - self._last_gc > min(self.ttl_seconds, 300):
+            self._last_gc = now
+            self.collect_garbage(now)
+
+
+__all__ = [
+    "ResumableUploadError",
+    "ResumableUploadStore",
+    "merge_ranges",
+    "missing_ranges",
+    "parse_content_range",
+]
@@ -0,0 +1,320 @@
+"""
+Retention for stale study sessions, their uploads and their vector stores.
+
+Every ``/upload`` leaves a ``study_sessions`` row with its materials, chat
+history and quizzes, plus two directories: ``UPLOAD_DIR/session_{id}``
+(the files and their sidecars) and ``CHROMA_PERSIST_DIR/session_{id}`` (the
+vector store and summary tree). A session expires once nothing has happened
+in it for ``SESSION_RETENTION_DAYS``. That means its ``end_time`` (or
+``start_time`` if it never ended) is older than the cutoff, and so is every
+chat message (hot or archived), quiz and material in it.
+
+A scheduled job deletes expired sessions ``RETENTION_BATCH_SIZE`` at a time.
+Each batch picks the sessions and deletes their rows in one transaction.
+The deletes go bottom-up (quiz questions, quizzes, materials, chat messages,
+archive segments, then the sessions) as set-based statements. XP events
+keep their rows, with ``session_id`` cleared, so the ledger still adds up.
+The session rows are selected ``FOR UPDATE`` where the database supports
+it, so a chat message racing into an expiring session fails its foreign
+key instead of being orphaned. The directories are removed only after the
+commit, and their sizes are added up as reclaimed bytes. A failed removal
+is counted and left for the orphan sweep.
+
+The orphan sweep removes ``session_{id}`` directories whose row no longer
+exists. This covers leftovers from failed removals and from sessions
+deleted by hand. The directories are listed before the ids are looked up.
+A session's row is always committed before its directories are created,
+so a session that is still being uploaded is never mistaken for an orphan.
+
+A dry run makes the same selection, counts the rows and bytes that would
+go, and changes nothing.
+
+    python -m services.retention [--days 180] [--dry-run]
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+import argparse
+import os
+import re
+import shutil
+
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.gamification import XPEvent
+from models.session import ChatArchiveSegment, ChatMessage, Quiz, QuizQuestion, StudyMaterial, StudySession
+from services.metrics import metrics
+from services.rag_service import invalidate_session_cache
+from services.scheduler import scheduler
+from services.write_queue import write_queue
+
+RETENTION_JOB = "session_retention"
+
+_SESSION_DIR = re.compile(r"^session_(\d+)$")
+
+
+def session_dirs(session_id: int) -> List[str]:
+    """The upload directory and vector store directory of a session."""
+    return [
+        os.path.join(settings.UPLOAD_DIR, f"session_{session_id}"),
+        os.path.join(settings.CHROMA_PERSIST_DIR, f"session_{session_id}"),
+    ]
+
+
+def dir_size(path: str) -> int:
+    """Total size in bytes of the files under ``path``; 0 if it doesn't exist."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def expired_sessions(db: Session, cutoff: datetime, limit: int, after_id: int = 0, lock: bool = False) -> List[int]:
+    """Ids of up to ``limit`` sessions idle since before ``cutoff``, above ``after_id``, in id order."""
+    query = select(StudySession.id).where(
+        StudySession.id > after_id,
+        func.coalesce(StudySession.end_time, StudySession.start_time) < cutoff,
+        ~exists().where(ChatMessage.session_id == StudySession.id, ChatMessage.timestamp >= cutoff),
+        # Chat older than CHAT_ARCHIVE_AFTER_DAYS lives in the archive, and still counts as activity
+        ~exists().where(ChatArchiveSegment.session_id == StudySession.id, ChatArchiveSegment.last_timestamp >= cutoff),
+        ~exists().where(Quiz.session_id == StudySession.id, Quiz.created_at >= cutoff),
+        ~exists().where(StudyMaterial.session_id == StudySession.id, StudyMaterial.upload_time >= cutoff),
+    ).order_by(StudySession.id).limit(limit)
+    if lock:
+        query = query.with_for_update(of=StudySession, skip_locked=True)
+    return list(db.execute(query).scalars().all())
+
+
+def _owned_by(ids: List[int]) -> Dict:
+    """Table -> condition selecting the rows that belong to the sessions ``ids``."""
+    return {
+        "quiz_questions": (QuizQuestion, QuizQuestion.quiz_id.in_(select(Quiz.id).where(Quiz.session_id.in_(ids)))),
+        "quizzes": (Quiz, Quiz.session_id.in_(ids)),
+        "study_materials": (StudyMaterial, StudyMaterial.session_id.in_(ids)),
+        "chat_messages": (ChatMessage, ChatMessage.session_id.in_(ids)),
+        "chat_archive_segments": (ChatArchiveSegment, ChatArchiveSegment.session_id.in_(ids)),
+        "study_sessions": (StudySession, StudySession.id.in_(ids)),
+    }
+
+
+def count_session_rows(db: Session, ids: List[int]) -> Dict[str, int]:
+    """Rows that ``purge_sessions`` would delete (or detach, for ``xp_events``), per table."""
+    counts = {
+        table: db.execute(select(func.count()).select_from(model).where(condition)).scalar_one()
+        for table, (model, condition) in _owned_by(ids).items()
+    }
+    counts["xp_events"] = db.execute(
+        select(func.count()).select_from(XPEvent).where(XPEvent.session_id.in_(ids))
+    ).scalar_one()
+    return counts
+
+
+def purge_sessions(db: Session, ids: List[int]) -> Dict[str, int]:
+    """
+    Delete the sessions ``ids`` and everything that belongs to them, and
+    detach their XP events; returns rows affected per table. The caller
+    commits.
+    """
+    counts = {
+        "xp_events": db.execute(
+            update(XPEvent).where(XPEvent.session_id.in_(ids)).values(session_id=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    }
+    for table, (model, condition) in _owned_by(ids).items():
+        counts[table] = db.execute(
+            delete(model).where(condition).execution_options(synchronize_session=False)
+        ).rowcount
+    return counts
+
+
+def remove_dirs(paths: Iterable[str], dry_run: bool = False) -> Dict[str, int]:
+    """Remove ``paths`` (or only measure them, for a dry run); returns directories, bytes and failures."""
+    removed = {"directories": 0, "bytes": 0, "failures": 0}
+    for path in paths:
+        if not os.path.isdir(path):
+            continue
+        size = dir_size(path)
+        if not dry_run:
+            try:
+                shutil.rmtree(path)
+            except OSError as e:
+                print(f"Could not remove {path}: {e}")
+                removed["failures"] += 1
+                continue
+        removed["directories"] += 1
+        removed["bytes"] += size
+    return removed
+
+
+def orphan_dirs(db: Session) -> List[str]:
+    """``session_{id}`` directories under the upload and vector store roots whose session is gone."""
+    found: Dict[int, List[str]] = {}
+    for root in (settings.UPLOAD_DIR, settings.CHROMA_PERSIST_DIR):
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            match = _SESSION_DIR.match(name)
+            if match and os.path.isdir(os.path.join(root, name)):
+                found.setdefault(int(match.group(1)), []).append(os.path.join(root, name))
+    if not found:
+        return []
+    # Listed first: a live session's row is committed before its directories exist
+    ids = sorted(found)
+    alive = set()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        alive.update(db.execute(select(StudySession.id).where(StudySession.id.in_(chunk))).scalars())
+    return [path for session_id in ids if session_id not in alive for path in found[session_id]]
+
+
+def _add(total: Dict[str, int], counts: Dict[str, int]) -> None:
+    for key, value in counts.items():
+        total[key] = total.get(key, 0) + value
+
+
+class SessionRetention:
+    """Runs the retention policy from the scheduler, a batch of expired sessions per transaction."""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        retention_days: float = 180,
+        batch_size: int = 100,
+        interval_seconds: float = 3600,
+    ):
+        self.session_factory = session_factory
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.sessions = 0
+        self.bytes_reclaimed = 0
+        self.orphans = 0
+        self.failures = 0
+        self.last_run: Optional[Dict] = None
+        self._scheduled = False
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def ensure_scheduled(self) -> None:
+        if not self._scheduled and self.retention_days > 0:
+            self._scheduled = True
+            scheduler.add_job(RETENTION_JOB, self.interval_seconds, self.run, run_at_exit=False)
+
+    def run(self, now: Optional[datetime] = None, dry_run: bool = False) -> Dict:
+        """
+        Apply the policy once; returns the report: sessions, rows per table,
+        directories, bytes and failures, plus orphan directories and bytes.
+        """
+        report: Dict = {"dry_run": dry_run, "sessions": 0, "rows": {}, "directories": 0, "bytes": 0, "failures": 0}
+        if self.retention_days <= 0:
+            return report
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+
+        after_id = 0
+        while True:
+            db = self._session()
+            try:
+                if dry_run:
+                    ids = expired_sessions(db, cutoff, self.batch_size, after_id)
+                    counts = count_session_rows(db, ids) if ids else {}
+                else:
+                    with write_queue.exclusive():
+                        ids = expired_sessions(db, cutoff, self.batch_size, after_id, lock=True)
+                        counts = purge_sessions(db, ids) if ids else {}
+                        db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            if not ids:
+                break
+
+            after_id = ids[-1]
+            report["sessions"] += len(ids)
+            _add(report["rows"], counts)
+            for session_id in ids:
+                if not dry_run:
+                    invalidate_session_cache(session_id)
+                removed = remove_dirs(session_dirs(session_id), dry_run)
+                report["failures"] += removed.pop("failures")
+                _add(report, removed)
+            if not dry_run:
+                metrics.inc("retention_sessions_deleted_total", len(ids))
+            if len(ids) < self.batch_size:
+                break
+
+        db = self._session()
+        try:
+            orphans = orphan_dirs(db)
+        finally:
+            db.close()
+        removed = remove_dirs(orphans, dry_run)
+        report["failures"] += removed["failures"]
+        report["orphan_directories"] = removed["directories"]
+        report["orphan_bytes"] = removed["bytes"]
+
+        if not dry_run:
+            reclaimed = report["bytes"] + report["orphan_bytes"]
+            self.sessions += report["sessions"]
+            self.bytes_reclaimed += reclaimed
+            self.orphans += report["orphan_directories"]
+            self.failures += report["failures"]
+            metrics.inc("retention_bytes_reclaimed_total", reclaimed)
+            if report["failures"]:
+                metrics.inc("retention_failures_total", report["failures"])
+        self.last_run = report
+        return report
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": self.sessions,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "orphans": self.orphans,
+            "failures": self.failures,
+        }
+
+
+session_retention = SessionRetention(
+    retention_days=settings.SESSION_RETENTION_DAYS,
+    batch_size=settings.RETENTION_BATCH_SIZE,
+    interval_seconds=settings.RETENTION_INTERVAL_SECONDS,
+)
+metrics.register_gauge("session_retention", session_retention.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete expired study sessions with their uploads and vector stores")
+    parser.add_argument("--days", type=float, default=settings.SESSION_RETENTION_DAYS, help="retention window")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be deleted, change nothing")
+    args = parser.parse_args()
+
+    session_retention.retention_days = args.days
+    report = session_retention.run(dry_run=args.dry_run)
+    verb = "Would delete" if args.dry_run else "Deleted"
+    print(f"{verb} {report['sessions']} sessions, {report['directories']} directories, {report['bytes']} bytes")
+    for table, count in sorted(report["rows"].items()):
+        print(f"  {table}: {count} {'detached' if table == 'xp_events' else 'rows'}")
+    print(f"Orphan directories: {report.get('orphan_directories', 0)}, {report.get('orphan_bytes', 0)} bytes")
+    if report["failures"]:
+        print(f"Failed to remove {report['failures']} directories")
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = [
+    "SessionRetention", "session_retention", "expired_sessions", "purge_sessions",
+    "count_session_rows", "orphan_dirs", "remove_dirs", "session_dirs",
+]
@@ -0,0 +1,129 @@
+"""
+In-process background job runner.
+
+Jobs are plain callables run on one daemon thread at a fixed interval. A job
+that raises is logged and retried at its next tick. Run times are published
+as ``scheduler_job_seconds`` histograms. Every worker process runs its own
+scheduler, so jobs must be safe to run concurrently across workers (the
+write-behind flushes are, since each worker only flushes its own buffer).
+"""
+from typing import Callable, Dict, Optional
+import atexit
+import threading
+import time
+
+from services.metrics import metrics
+
+
+class _Job:
+    def __init__(self, name: str, interval: float, fn: Callable[[], object], run_at_exit: bool):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.run_at_exit = run_at_exit
+        self.next_run = time.monotonic() + interval
+        self.runs = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+
+class Scheduler:
+    def __init__(self, tick_seconds: float = 0.5):
+        self.tick_seconds = tick_seconds
+        self._jobs: Dict[str, _Job] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._atexit_registered = False
+
+    def add_job(
+        self,
+        name: str,
+        interval_seconds: float,
+        fn: Callable[[], object],
+        run_at_exit: bool = True
+    ) -> None:
+        """
+        Register (or replace) a job and make sure the scheduler thread is
+        running. ``run_at_exit=False`` skips the job's final run in ``stop``.
+        """
+        with self._lock:
+            self._jobs[name] = _Job(name, interval_seconds, fn, run_at_exit)
+        self.start()
+
+    def remove_job(self, name: str) -> None:
+        with self._lock:
+            self._jobs.pop(name, None)
+
+    def run_soon(self, name: str) -> None:
+        """Run a job at the next tick instead of waiting for its interval."""
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is not None:
+                job.next_run = 0
+        self._wake.set()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                # Give write-behind jobs a final run on interpreter shutdown
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self, run_pending: bool = True) -> None:
+        """Stop the thread; with ``run_pending`` jobs run one last time (e.g. final flushes)."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        if run_pending:
+            for job in self._due(force=True):
+                if job.run_at_exit:
+                    self._run(job)
+
+    def _due(self, force: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            return [job for job in self._jobs.values() if force or job.next_run <= now]
+
+    def _run(self, job: _Job) -> None:
+        start = time.perf_counter()
+        try:
+            job.fn()
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            print(f"Scheduled job {job.name} failed: {e}")
+        finally:
+            job.runs += 1
+            job.next_run = time.monotonic() + job.interval
+            metrics.observe("scheduler_job_seconds", time.perf_counter() - start, {"job": job.name})
+
+    def _loop(self) -> None:
+        while not self._stopping.is_set():
+            for job in self._due():
+                self._run(job)
+            self._wake.wait(self.tick_seconds)
+            self._wake.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                job.name: {"runs": job.runs, "failures": job.failures, "last_error": job.last_error}
+                for job in self._jobs.values()
+            }
+
+
+# Module-level singleton shared by every service in the process
+scheduler = Scheduler()
+metrics.register_gauge("scheduler_jobs", scheduler.stats)
+
+__all__ = ["Scheduler", "scheduler"]
@@ -0,0 +1,212 @@
+"""
+Study-session heartbeats.
+
+Open tabs ping ``POST /sessions/{id}/heartbeat`` every ~30 seconds. A
+heartbeat only touches an in-memory clock for its session. The time since
+the previous heartbeat counts as time on task, unless the gap exceeds
+``HEARTBEAT_IDLE_GAP_SECONDS`` (tab closed, laptop asleep). Every
+``HEARTBEAT_FLUSH_SECONDS`` the scheduler writes the accumulated time in one
+transaction:
+
+* ``study_sessions.duration_minutes`` / ``end_time``, one executemany
+  ``UPDATE`` over every session that advanced;
+* ``users.study_time_today``, summed per user and stamped with its day in
+  ``study_day`` (restarting from zero on a new day);
+* ``daily_user_activity.minutes``, one upsert.
+
+A session that has been idle for longer than the gap is flushed a last time
+and dropped from memory: it's closed, with ``end_time`` at its last
+heartbeat. A later heartbeat simply reopens it.
+
+Clocks are per process. A session's heartbeats should reach one worker
+(sticky sessions); otherwise each worker only sees part of the gaps and
+under-counts.
+"""
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+
+from sqlalchemy import bindparam, case, func, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.user import User
+from models.session import StudySession
+from models.gamification import DailyUserActivity
+from services.metrics import metrics
+from services.scheduler import scheduler
+from services.upsert import upsert_add
+from services.write_queue import write_queue
+
+FLUSH_JOB = "session_heartbeat_flush"
+
+
+class _SessionClock:
+    __slots__ = ("user_id", "last_seen", "pending_seconds", "pending_since", "flushed_end")
+
+    def __init__(self, user_id: int, now: datetime):
+        self.user_id = user_id
+        self.last_seen = now
+        self.pending_seconds = 0.0
+        # First heartbeat not yet written to the database (for the lag metric)
+        self.pending_since: Optional[datetime] = now
+        self.flushed_end: Optional[datetime] = None
+
+
+class SessionHeartbeats:
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        idle_gap_seconds: float = 120,
+        flush_seconds: float = 15,
+    ):
+        self.session_factory = session_factory
+        self.idle_gap_seconds = idle_gap_seconds
+        self.flush_seconds = flush_seconds
+        self._clocks: Dict[int, _SessionClock] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._scheduled = False
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def owner(self, session_id: int) -> Optional[int]:
+        """The user of an open session, so repeat heartbeats skip the ownership query."""
+        clock = self._clocks.get(session_id)
+        return clock.user_id if clock is not None else None
+
+    def beat(self, session_id: int, user_id: int, now: Optional[datetime] = None) -> None:
+        now = now or datetime.utcnow()
+        with self._lock:
+            clock = self._clocks.get(session_id)
+            if clock is None:
+                self._clocks[session_id] = _SessionClock(user_id, now)
+            else:
+                gap = (now - clock.last_seen).total_seconds()
+                if 0 < gap <= self.idle_gap_seconds:
+                    clock.pending_seconds += gap
+                if now > clock.last_seen:
+                    clock.last_seen = now
+                if clock.pending_since is None:
+                    clock.pending_since = now
+        metrics.inc("heartbeats_total")
+        if not self._scheduled:
+            self._scheduled = True
+            scheduler.add_job(FLUSH_JOB, self.flush_seconds, self.flush)
+
+    def _drain(self, now: datetime, close_all: bool) -> Tuple[List[Tuple[int, _SessionClock, float]], int]:
+        """Take the pending time of every advanced session and drop the idle ones."""
+        batch = []
+        closed = 0
+        with self._lock:
+            for session_id, clock in list(self._clocks.items()):
+                idle = close_all or (now - clock.last_seen).total_seconds() > self.idle_gap_seconds
+                if clock.pending_seconds or clock.flushed_end != clock.last_seen:
+                    batch.append((session_id, clock, clock.pending_seconds))
+                    clock.pending_seconds = 0.0
+                    clock.pending_since = None
+                    clock.flushed_end = clock.last_seen
+                if idle:
+                    del self._clocks[session_id]
+                    closed += 1
+        return batch, closed
+
+    def _restore(self, batch: List[Tuple[int, _SessionClock, float]]) -> None:
+        with self._lock:
+            for session_id, clock, seconds in batch:
+                current = self._clocks.setdefault(session_id, clock)
+                current.pending_seconds += seconds
+                current.flushed_end = None
+
+    def flush(self, close_all: bool = False) -> int:
+        """Write accumulated time on task; returns the number of sessions written."""
+        from services.dashboard import dashboards
+
+        now = datetime.utcnow()
+        with self._flush_lock:
+            with self._lock:
+                oldest = min((c.pending_since for c in self._clocks.values() if c.pending_since), default=None)
+            batch, closed = self._drain(now, close_all)
+            if not batch:
+                return 0
+
+            minutes_by_user: Dict[Tuple[int, date], float] = {}
+            for _, clock, seconds in batch:
+                if seconds:
+                    key = (clock.user_id, clock.last_seen.date())
+                    minutes_by_user[key] = minutes_by_user.get(key, 0.0) + seconds / 60
+
+            db = self._session()
+            try:
+                with write_queue.exclusive():
+                    sessions = StudySession.__table__
+                    db.execute(
+                        update(sessions).where(sessions.c.id == bindparam("b_id")).values(
+                            duration_minutes=sessions.c.duration_minutes + bindparam("b_minutes"),
+                            end_time=bindparam("b_end"),
+                        ),
+                        [
+                            {"b_id": session_id, "b_minutes": seconds / 60, "b_end": clock.last_seen}
+                            for session_id, clock, seconds in batch
+                        ],
+                    )
+                    if minutes_by_user:
+                        # study_time_today holds the user's latest day; earlier days only go to the rollups
+                        per_user: Dict[int, Tuple[date, float]] = {}
+                        for (user_id, day), minutes in sorted(minutes_by_user.items()):
+                            per_user[user_id] = (day, minutes)
+                        users = User.__table__
+                        db.execute(
+                            update(users).where(users.c.id == bindparam("b_id")).values(
+                                study_time_today=case(
+                                    (users.c.study_day == bindparam("b_day"),
+                                     func.coalesce(users.c.study_time_today, 0) + bindparam("b_minutes")),
+                                    else_=bindparam("b_minutes"),
+                                ),
+                                study_day=bindparam("b_day"),
+                            ),
+                            [
+                                {"b_id": user_id, "b_day": day, "b_minutes": minutes}
+                                for user_id, (day, minutes) in per_user.items()
+                            ],
+                        )
+                        upsert_add(db, DailyUserActivity, ("user_id", "day"), [
+                            {"user_id": user_id, "day": day, "minutes": minutes}
+                            for (user_id, day), minutes in minutes_by_user.items()
+                        ], ("minutes",))
+                        for user_id in per_user:
+                            dashboards.invalidate_on_commit(db, user_id)
+                    db.commit()
+            except Exception:
+                db.rollback()
+                self._restore(batch)
+                raise
+            finally:
+                db.close()
+
+        metrics.observe("heartbeat_flush_sessions", len(batch), buckets=(1, 10, 50, 100, 500, 1000, 5000))
+        if oldest is not None:
+            metrics.observe("heartbeat_flush_lag_seconds", (now - oldest).total_seconds())
+        if closed:
+            metrics.inc("study_sessions_closed_total", closed)
+        return len(batch)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "open_sessions": len(self._clocks),
+                "pending_seconds": sum(c.pending_seconds for c in self._clocks.values()),
+            }
+
+
+heartbeats = SessionHeartbeats(
+    idle_gap_seconds=settings.HEARTBEAT_IDLE_GAP_SECONDS,
+    flush_seconds=settings.HEARTBEAT_FLUSH_SECONDS,
+)
+metrics.register_gauge("session_heartbeats", heartbeats.stats)
+
+__all__ = ["SessionHeartbeats", "heartbeats"]
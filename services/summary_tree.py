@@ -0,0 +1,318 @@
+"""
+Hierarchical summary tree built for every material at ingest time.
+
+Broad questions ("what is this document about?", "summarize chapter 3")
+can't be answered from a handful of retrieved chunks, and stuffing more
+chunks into the prompt is slow and expensive. Instead, after a material is
+indexed we summarize it bottom-up from its sidecar:
+
+    chunk summaries -> section summaries (by heading) -> document summary
+
+Every LLM call sees at most ``max_prompt_chars`` of input, so building the
+tree costs a bounded number of small calls, and answering from it needs a
+single prompt of fixed size. Trees for all materials of a session live in
+``summary_tree.json`` inside the session's Chroma directory, keyed by the
+hash of the material's extracted text.
+"""
+from typing import Callable, Dict, List, Optional
+import json
+import os
+import re
+import threading
+
+from config import settings
+from services.material_sidecar import open_sidecar
+
+TREE_FILENAME = "summary_tree.json"
+TREE_VERSION = 1
+
+# Documents without headings are grouped into sections of this many chunks
+FALLBACK_SECTION_CHUNKS = 8
+
+_BROAD_QUESTION = re.compile(
+    r"\b(?:summar(?:y|ize|ise|ies)|overview|outline|recap|tl;?dr|gist"
+    r"|what(?:'s| is| are)\s+(?:this|these|the|my)\s+(?:\w+\s+)?"
+    r"(?:document|material|book|file|pdf|notes?|chapter|section|text|slides?|lecture)s?\s+about"
+    r"|main\s+(?:ideas?|points?|topics?|themes?|concepts?)"
+    r"|key\s+(?:points?|takeaways?|ideas?|concepts?))\b",
+    re.IGNORECASE,
+)
+_SECTION_REFERENCE = re.compile(
+    r"\b(chapter|section|part|unit|lesson|module|appendix)\s+([\dIVXLC]+(?:\.\d+)*)\b",
+    re.IGNORECASE,
+)
+_NUMBERED_LINE = re.compile(r"^\s*\[?(\d+)[\].):]\s*(.+)$")
+_WORD = re.compile(r"\w+")
+
+_write_lock = threading.Lock()
+
+# Reduce rounds per summary before falling back to joining and truncating
+MAX_REDUCE_ROUNDS = 8
+
+
+def tree_path(session_id: int) -> str:
+    return os.path.join(settings.CHROMA_PERSIST_DIR, f"session_{session_id}", TREE_FILENAME)
+
+
+def is_broad_question(query: str) -> bool:
+    """True for questions about a whole document or section rather than a fact."""
+    return bool(_BROAD_QUESTION.search(query))
+
+
+def load_tree(session_id: int) -> Optional[Dict]:
+    try:
+        with open(tree_path(session_id)) as f:
+            tree = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return tree if tree.get("version") == TREE_VERSION else None
+
+
+def _save_material(session_id: int, key: str, material: Dict) -> None:
+    # Several materials of one session may finish at the same time
+    with _write_lock:
+        tree = load_tree(session_id) or {"version": TREE_VERSION, "materials": {}}
+        tree["materials"][key] = material
+        path = tree_path(session_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(tree, f)
+        os.replace(tmp_path, path)
+
+
+def _batches(texts: List[str], max_chars: int) -> List[List[int]]:
+    """Group consecutive text indexes so each group fits in ``max_chars``."""
+    groups: List[List[int]] = []
+    size = 0
+    for index, text in enumerate(texts):
+        if groups and size + len(text) <= max_chars:
+            groups[-1].append(index)
+            size += len(text)
+        else:
+            groups.append([index])
+            size = len(text)
+    return groups
+
+
+def _first_sentence(text: str, limit: int = 200) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence[:limit]
+
+
+class SummaryTreeBuilder:
+    """
+    Builds the tree for one material.
+
+    ``complete`` is any ``prompt -> text`` callable; by default the chat model
+    configured in settings is used.
+    """
+
+    def __init__(self, complete: Optional[Callable[[str], str]] = None, max_prompt_chars: Optional[int] = None):
+        self.complete = complete or _default_completion()
+        self.max_prompt_chars = max_prompt_chars or settings.SUMMARY_PROMPT_CHARS
+
+    def _summarize_chunks(self, chunks: List[str]) -> List[str]:
+        """One short summary per chunk, several chunks per call."""
+        summaries = [_first_sentence(chunk) for chunk in chunks]
+        for group in _batches(chunks, self.max_prompt_chars):
+            numbered = "\n\n".join(
+                f"[{n + 1}] {chunks[i][:self.max_prompt_chars]}" for n, i in enumerate(group)
+            )
+            prompt = f"""Summarize each numbered passage below in one or two sentences.
+Answer with one line per passage, formatted as "[number] summary".
+
+{numbered}"""
+            try:
+                for line in self.complete(prompt).splitlines():
+                    match = _NUMBERED_LINE.match(line)
+                    if match and 0 < int(match.group(1)) <= len(group):
+                        summaries[group[int(match.group(1)) - 1]] = match.group(2).strip()
+            except Exception as e:
+                # Keep the extractive fallback for this group
+                print(f"Chunk summary error: {e}")
+        return summaries
+
+    def _reduce(self, texts: List[str], what: str) -> str:
+        """Summarize ``texts`` into one summary, recursing while they don't fit one prompt."""
+        texts = [t for t in texts if t]
+        if not texts:
+            return ""
+        if len(texts) == 1:
+            return texts[0]
+        # Every output is cut to a quarter prompt, so each round at least halves the count;
+        # the round cap only guards against a budget too small for that
+        budget = self.max_prompt_chars // 4
+        for _ in range(MAX_REDUCE_ROUNDS):
+            groups = _batches(texts, self.max_prompt_chars)
+            reduced = []
+            for group in groups:
+                joined = "\n".join(f"- {texts[i]}" for i in group)[:self.max_prompt_chars]
+                prompt = f"""The notes below summarize consecutive parts of {what}.
+Write a concise summary (at most five sentences) of the whole.
+
+{joined}"""
+                try:
+                    reduced.append(self.complete(prompt).strip()[:budget])
+                except Exception as e:
+                    print(f"Summary reduce error: {e}")
+                    reduced.append(" ".join(texts[i] for i in group)[:budget])
+            if len(reduced) == 1:
+                return reduced[0]
+            texts = reduced
+        return " ".join(texts)[:budget]
+
+    def build(self, file_path: str) -> Optional[Dict]:
+        sidecar = open_sidecar(file_path)
+        if sidecar is None:
+            return None
+        with sidecar:
+            chunks = [(text, meta) for text, meta in sidecar.iter_chunks()]
+            text_sha1 = sidecar.header["text_sha1"]
+        if not chunks:
+            return None
+
+        chunk_summaries = self._summarize_chunks([text for text, _ in chunks])
+
+        # Consecutive chunks under the same heading form a section
+        sections: List[Dict] = []
+        for index, (_, meta) in enumerate(chunks):
+            heading = meta["heading"]
+            current = sections[-1] if sections else None
+            if (
+                current is None
+                or current["heading"] != heading
+                or (heading is None and len(current["chunks"]) >= FALLBACK_SECTION_CHUNKS)
+            ):
+                current = {"heading": heading, "page": meta["page"], "chunks": []}
+                sections.append(current)
+            current["chunks"].append(index)
+
+        filename = os.path.basename(file_path)
+        for section in sections:
+            section["chunk_summaries"] = [chunk_summaries[i] for i in section["chunks"]]
+            title = f'the section "{section["heading"]}"' if section["heading"] else "a document section"
+            section["summary"] = self._reduce(section["chunk_summaries"], f"{title} of {filename}")
+            section["chunks"] = [section["chunks"][0], section["chunks"][-1] + 1]
+
+        return {
+            "source": filename,
+            "text_sha1": text_sha1,
+            "chunk_count": len(chunks),
+            "summary": self._reduce([s["summary"] for s in sections], f"the document {filename}"),
+            "sections": sections,
+        }
+
+
+def _default_completion() -> Callable[[str], str]:
+    from langchain_openai import ChatOpenAI
+
+    llm = ChatOpenAI(
+        openai_api_key=settings.OPENAI_API_KEY,
+        model_name=getattr(settings, 'OPENAI_MODEL', 'gpt-3.5-turbo'),
+        temperature=0.2
+    )
+
+    def complete(prompt: str) -> str:
+        response = llm.invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
+
+    return complete
+
+
+def build_summary_tree(file_path: str, session_id: int) -> bool:
+    """
+    Build and persist the summary tree for an indexed material.
+
+    Meant to run as a background task after ingestion; errors are logged and
+    never propagate.
+    """
+    if not settings.SUMMARY_TREE_ENABLED or not settings.OPENAI_API_KEY:
+        return False
+    try:
+        sidecar = open_sidecar(file_path)
+        if sidecar is None:
+            return False
+        with sidecar:
+            key = sidecar.header["text_sha1"]
+        existing = (load_tree(session_id) or {}).get("materials", {}).get(key)
+        if existing:
+            return True  # same text already summarized
+
+        material = SummaryTreeBuilder().build(file_path)
+        if material is None:
+            return False
+        _save_material(session_id, key, material)
+        return True
+    except Exception as e:
+        print(f"Summary tree error: {e}")
+        return False
+
+
+def _match_section(materials: List[Dict], query: str) -> Optional[Dict]:
+    reference = _SECTION_REFERENCE.search(query)
+    query_words = set(_WORD.findall(query.lower()))
+    best, best_score = None, 0.0
+    for material in materials:
+        for section in material["sections"]:
+            heading = (section["heading"] or "").lower()
+            if not heading:
+                continue
+            if reference:
+                kind, number = reference.group(1).lower(), reference.group(2).lower()
+                if re.match(rf"(?:{kind}\s+)?{re.escape(number)}\b", heading):
+                    return section
+                continue
+            # Otherwise the heading's words must (almost) all appear in the question
+            heading_words = set(_WORD.findall(heading))
+            if len(heading_words) < 2:
+                continue
+            score = len(heading_words & query_words) / len(heading_words)
+            if score > best_score and score >= 0.75:
+                best, best_score = section, score
+    return best
+
+
+def summary_context(session_id: int, query: str, max_chars: Optional[int] = None) -> Optional[str]:
+    """
+    Pick the tree level that answers a broad question and render it as
+    prompt context of at most ``max_chars`` characters.
+
+    Returns None when the session has no summary tree yet.
+    """
+    tree = load_tree(session_id)
+    if not tree or not tree.get("materials"):
+        return None
+    max_chars = max_chars or settings.SUMMARY_PROMPT_CHARS
+    materials = list(tree["materials"].values())
+
+    section = _match_section(materials, query)
+    if section is not None:
+        # Section summary followed by the summaries of its chunks
+        parts = [f"Section: {section['heading']}", section["summary"], "Details:"]
+        parts += [f"- {summary}" for summary in section["chunk_summaries"]]
+    else:
+        # Document summaries followed by section outlines
+        parts = [f"Document: {m['source']}\n{m['summary']}" for m in materials]
+        for material in materials:
+            parts.append(f"Sections of {material['source']}:")
+            parts += [
+                f"- {s['heading'] or 'Untitled'}: {s['summary']}"
+                for s in material["sections"]
+            ]
+
+    context = ""
+    for part in parts:
+        if len(context) + len(part) + 1 > max_chars:
+            break
+        context += part + "\n"
+    return context.strip() or parts[0][:max_chars]
+
+
+__all__ = [
+    "SummaryTreeBuilder",
+    "build_summary_tree",
+    "is_broad_question",
+    "load_tree",
+    "summary_context",
+    "tree_path",
+]
@@ -0,0 +1,191 @@
+"""
+Structure-aware text splitter used for document ingestion.
+
+Unlike langchain's ``RecursiveCharacterTextSplitter`` this makes a single
+linear pass over the text, sizes chunks in tokens rather than characters,
+never lets a chunk straddle a heading, prefers to break at page boundaries
+and returns the source offsets of every chunk. There is no overlap between
+chunks: section-aligned boundaries keep related sentences together instead.
+
+Pages are expected to be separated by a form feed (see
+``services.material_sidecar.PAGE_SEPARATOR``).
+"""
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+import re
+
+_BLOCK = re.compile(r"\f|[^\f\n]+(?:\n[^\f\n]+)*")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE = re.compile(r"\s+")
+_HEADING = re.compile(
+    r"^(?:#{1,6}\s+\S"
+    r"|(?:chapter|section|part|unit|lesson|module|appendix)\s+[\dIVXLC]+\b"
+    r"|\d+(?:\.\d+)*\.?\s+[A-Z])",
+    re.IGNORECASE,
+)
+
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # tiktoken missing or its encoding files unavailable offline
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the OpenAI embedding tokenizer, or a close estimate without it."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # English prose averages about 0.75 words per BPE token
+    return (len(text.split()) * 4 + 2) // 3
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > 80 or line.endswith((".", ",", ";", ":")):
+        return False
+    if _HEADING.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 3 and line.isupper() and len(line.split()) <= 10
+
+
+class TextChunk(NamedTuple):
+    text: str
+    start: int  # character offset into the source text
+    end: int
+    page: int  # zero-based page where the chunk starts
+    heading: Optional[str]
+    tokens: int
+
+
+class StructuredTextSplitter:
+    def __init__(
+        self,
+        chunk_tokens: int = 256,
+        min_chunk_tokens: int = 64,
+        token_counter: Callable[[str], int] = count_tokens,
+    ):
+        if min_chunk_tokens > chunk_tokens:
+            raise ValueError("min_chunk_tokens must not exceed chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.count_tokens = token_counter
+
+    @property
+    def config(self) -> dict:
+        return {
+            "name": "structured",
+            "chunk_tokens": self.chunk_tokens,
+            "min_chunk_tokens": self.min_chunk_tokens,
+            "tokenizer": "cl100k_base" if _get_encoding() is not None else "regex",
+        }
+
+    def _blocks(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        """Yield ``(kind, start, end)`` for page breaks, headings and paragraphs."""
+        for match in _BLOCK.finditer(text):
+            start, end = match.span()
+            if match.group() == "\f":
+                yield "page", start, end
+                continue
+            first_line_end = text.find("\n", start, end)
+            first_line_end = end if first_line_end == -1 else first_line_end
+            if is_heading(text[start:first_line_end]):
+                yield "heading", start, first_line_end
+                if first_line_end < end:
+                    yield "paragraph", first_line_end + 1, end
+            else:
+                yield "paragraph", start, end
+
+    def _pieces(self, text: str, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+        """Break an oversized paragraph into sentence (or word-window) pieces."""
+        position = start
+        boundaries = [m.end() for m in _SENTENCE_END.finditer(text, start, end)] + [end]
+        for boundary in boundaries:
+            piece = text[position:boundary].rstrip()
+            if not piece:
+                position = boundary
+                continue
+            tokens = self.count_tokens(piece)
+            if tokens <= self.chunk_tokens:
+                yield position, position + len(piece), tokens
+            else:
+                # Cut on whitespace at a character width proportional to the budget
+                width = max(1, len(piece) * self.chunk_tokens // tokens)
+                cursor = position
+                stop = position + len(piece)
+                while cursor < stop:
+                    cut = min(stop, cursor + width)
+                    if cut < stop:
+                        space = text.rfind(" ", cursor + 1, cut)
+                        cut = space if space > cursor else cut
+                    window = text[cursor:cut]
+                    yield cursor, cut, self.count_tokens(window)
+                    cursor = cut
+                    while cursor < stop and text[cursor].isspace():
+                        cursor += 1
+            position = boundary
+
+    def split(self, text: str) -> List[TextChunk]:
+        chunks: List[TextChunk] = []
+        page = 0
+        heading: Optional[str] = None
+        # Open chunk state
+        chunk_start = chunk_end = -1
+        chunk_page = 0
+        chunk_tokens = 0
+
+        def flush():
+            nonlocal chunk_start, chunk_tokens
+            if chunk_start >= 0:
+                body = text[chunk_start:chunk_end].replace("\f", "\n")
+                chunks.append(TextChunk(body, chunk_start, chunk_end, chunk_page, heading, chunk_tokens))
+            chunk_start = -1
+            chunk_tokens = 0
+
+        def append(start: int, end: int, tokens: int):
+            nonlocal chunk_start, chunk_end, chunk_page, chunk_tokens
+            if chunk_start >= 0 and chunk_tokens + tokens > self.chunk_tokens:
+                flush()
+            if chunk_start < 0:
+                chunk_start = start
+                chunk_page = page
+            chunk_end = end
+            chunk_tokens += tokens
+
+        for kind, start, end in self._blocks(text):
+            if kind == "page":
+                page += 1
+                if chunk_tokens >= self.min_chunk_tokens:
+                    flush()
+                continue
+
+            if kind == "heading":
+                flush()
+                heading = _WHITESPACE.sub(" ", text[start:end].lstrip("# ").strip())
+
+            tokens = self.count_tokens(text[start:end])
+            if tokens <= self.chunk_tokens:
+                append(start, end, tokens)
+            else:
+                for piece_start, piece_end, piece_tokens in self._pieces(text, start, end):
+                    append(piece_start, piece_end, piece_tokens)
+
+        flush()
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        """Drop-in for ``TextSplitter.split_text`` when offsets aren't needed."""
+        return [chunk.text for chunk in self.split(text)]
+
+
+__all__ = ["StructuredTextSplitter", "TextChunk", "count_tokens", "is_heading"]
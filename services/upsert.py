@@ -0,0 +1,89 @@
+"""
+Dialect-aware "insert or add to" for counter rollup tables, and "insert
+unless present" for rows guarded by a unique key.
+
+PostgreSQL and SQLite (3.24+) both support ``INSERT ... ON CONFLICT``, so a
+batch of rollup increments or grants is a single statement. Other dialects
+fall back to an ``UPDATE`` per row followed by an ``INSERT`` for rows that
+didn't exist yet, or to an ``INSERT`` per row in its own savepoint.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import and_, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+
+def dialect_insert(db: Session) -> Optional[Callable]:
+    """``insert`` with ``on_conflict_*`` for ``db``'s dialect, or None if it has none."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        return postgresql_insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert
+    return None
+
+
+def upsert_add(db: Session, model, keys: Sequence[str], rows: Iterable[Dict], counters: Sequence[str]) -> None:
+    """
+    Insert ``rows`` into ``model``'s table, or add their ``counters`` to the
+    existing row with the same ``keys``.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    table = model.__table__
+    upsert = dialect_insert(db)
+
+    if upsert is not None:
+        statement = upsert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c[key] for key in keys],
+            set_={name: table.c[name] + statement.excluded[name] for name in counters},
+        )
+        db.execute(statement)
+        return
+
+    missing: List[Dict] = []
+    for row in rows:
+        result = db.execute(
+            update(table)
+            .where(and_(*(table.c[key] == row[key] for key in keys)))
+            .values({name: table.c[name] + row[name] for name in counters})
+        )
+        if not result.rowcount:
+            missing.append(row)
+    if missing:
+        db.execute(insert(table), missing)
+
+
+def insert_missing(db: Session, model, keys: Sequence[str], rows: Iterable[Dict]) -> Set[Tuple]:
+    """
+    Insert those of ``rows`` whose ``keys`` aren't in ``model``'s table yet;
+    returns the key tuples actually inserted. ``keys`` must be a unique key.
+    """
+    rows = list(rows)
+    if not rows:
+        return set()
+    table = model.__table__
+    key_columns = [table.c[key] for key in keys]
+    upsert = dialect_insert(db)
+
+    if upsert is not None:
+        statement = upsert(table).values(rows).on_conflict_do_nothing(index_elements=key_columns)
+        return {tuple(row) for row in db.execute(statement.returning(*key_columns))}
+
+    inserted: Set[Tuple] = set()
+    for row in rows:
+        try:
+            with db.begin_nested():
+                db.execute(insert(table).values(row))
+        except IntegrityError:
+            continue
+        inserted.add(tuple(row[key] for key in keys))
+    return inserted
+
+
+__all__ = ["dialect_insert", "insert_missing", "upsert_add"]
@@ -0,0 +1,245 @@
+"""
+Single writer with group commit, for SQLite mode.
+
+SQLite allows one writer at a time. When every request commits on its own
+pooled connection, concurrent chat and XP writes fight over the file lock.
+They wait out ``busy_timeout``. Or, when a transaction that has already
+read tries to take the write lock, SQLite gives up at once with "database is
+locked".
+
+In SQLite mode, handlers hand their writes to this queue as write units. A
+unit is a function that takes a ``Session``, makes its changes without
+committing, and returns a plain value such as a new row's id. One thread
+drains the queue. Each batch of up to ``SQLITE_WRITE_BATCH`` waiting units
+runs in one ``BEGIN IMMEDIATE`` transaction, each unit in its own savepoint,
+and the batch commits once. A unit that raises is rolled back to its
+savepoint, together with anything it left in ``Session.info`` for commit
+hooks, and only its caller sees the exception. Units are written to the
+database their request's session is bound to, so dependency overrides
+hold, and units for different databases never share a batch. Reads still
+go through each request's own session and run in parallel under WAL.
+
+Units that must commit by themselves (refresh-token rotation persists a
+revocation before raising) are submitted with ``alone=True`` and run in a
+transaction of their own. Background jobs that write in their own session
+(ledger flush, heartbeat flush, rank persistence, rollover) hold
+``exclusive()`` while they do, so they take turns with the queue instead of
+racing it.
+
+With another database, or with ``SQLITE_WRITE_QUEUE`` off, ``submit`` runs
+the unit on the request's session and commits it there.
+"""
+from collections import deque
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Deque, Dict, List, NamedTuple, Optional, TypeVar
+import asyncio
+import copy
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from config import settings
+from services.metrics import metrics
+
+T = TypeVar("T")
+
+
+class _Unit(NamedTuple):
+    fn: Callable[[Session], Any]
+    future: Future
+    url: URL
+    alone: bool
+    enqueued_at: float
+
+
+class WriteQueue:
+    def __init__(self, engine: Optional[Engine] = None, enabled: Optional[bool] = None, max_batch: int = 64):
+        # The database to write to; defaults to database.engine
+        self.engine = engine
+        self._enabled = enabled
+        self.max_batch = max_batch
+        self.batches = 0
+        self.units = 0
+        self.failed = 0
+        self._units: Deque[_Unit] = deque()
+        self._ready = threading.Condition()
+        self._lock = threading.RLock()
+        self._writers: Dict[str, Engine] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def _engine(self) -> Engine:
+        if self.engine is None:
+            from database import engine
+            self.engine = engine
+        return self.engine
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = settings.SQLITE_WRITE_QUEUE and self._engine().dialect.name == "sqlite"
+        return self._enabled
+
+    def _writer_url(self, db: AsyncSession) -> URL:
+        """The database ``db`` is bound to (so dependency overrides hold), with the sync driver."""
+        bind = db.bind
+        url = bind.url if bind is not None else self._engine().url
+        return url.set(drivername=url.get_backend_name())
+
+    def _writer_engine(self, url: URL) -> Engine:
+        """One connection per database, owned by the writer thread, that issues BEGIN IMMEDIATE itself."""
+        key = url.render_as_string(hide_password=False)
+        if key not in self._writers:
+            from database import configure_sqlite
+
+            writer = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+            configure_sqlite(writer)
+
+            @event.listens_for(writer, "connect")
+            def _driver_autocommit(dbapi_connection, connection_record):
+                # pysqlite would defer BEGIN to the first write and break savepoints
+                dbapi_connection.isolation_level = None
+
+            @event.listens_for(writer, "begin")
+            def _begin_immediate(connection):
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+            self._writers[key] = writer
+        return self._writers[key]
+
+    def _enqueue(self, fn: Callable[[Session], T], alone: bool, url: URL) -> "Future[T]":
+        future: "Future[T]" = Future()
+        with self._ready:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="write-queue", daemon=True)
+                self._thread.start()
+            self._units.append(_Unit(fn, future, url, alone, time.monotonic()))
+            self._ready.notify()
+        return future
+
+    async def submit(self, db: AsyncSession, fn: Callable[[Session], T], alone: bool = False) -> T:
+        """Run ``fn(session)`` as one write unit and wait until it commits; returns its result."""
+        url = self._writer_url(db)
+        if not self.enabled or url.get_backend_name() != "sqlite":
+            result = await db.run_sync(fn)
+            await db.commit()
+            return result
+        return await asyncio.wrap_future(self._enqueue(fn, alone, url))
+
+    def exclusive(self) -> ContextManager:
+        """Hold off the queue while a background job writes in its own transaction."""
+        return self._lock if self.enabled else nullcontext()
+
+    def _take(self) -> List[_Unit]:
+        with self._ready:
+            while not self._units:
+                self._ready.wait()
+            head = self._units[0]
+            if head.alone:
+                return [self._units.popleft()]
+            batch = []
+            while (
+                self._units and len(batch) < self.max_batch
+                and not self._units[0].alone and self._units[0].url == head.url
+            ):
+                batch.append(self._units.popleft())
+            return batch
+
+    @staticmethod
+    def _resolve(unit: _Unit, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if unit.future.done():
+            return
+        if error is not None:
+            unit.future.set_exception(error)
+        else:
+            unit.future.set_result(result)
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._take()
+            try:
+                with self._lock:
+                    if batch[0].alone:
+                        self._run_alone(batch[0])
+                    else:
+                        self._run_batch(batch)
+            except Exception as e:
+                # Never let one batch stop the writer; its callers get the error
+                print(f"Write queue batch failed: {e}")
+                self.failed += sum(not unit.future.done() for unit in batch)
+                for unit in batch:
+                    self._resolve(unit, error=e)
+
+    def _run_alone(self, unit: _Unit) -> None:
+        db = Session(self._writer_engine(unit.url), autoflush=False, expire_on_commit=False)
+        try:
+            result = unit.fn(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self.failed += 1
+            self._resolve(unit, error=e)
+            return
+        finally:
+            db.close()
+        self.units += 1
+        self._resolve(unit, result)
+
+    def _run_batch(self, batch: List[_Unit]) -> None:
+        db = Session(self._writer_engine(batch[0].url), autoflush=False, expire_on_commit=False)
+        outcomes = []
+        try:
+            for unit in batch:
+                # Commit hooks (ledger, dashboards, event bus) collect pending work in info
+                saved: Dict = {key: copy.copy(value) for key, value in db.info.items()}
+                try:
+                    with db.begin_nested():
+                        result = unit.fn(db)
+                        # Surface the unit's own flush errors here, not at the savepoint release
+                        db.flush()
+                except Exception as e:
+                    db.info.clear()
+                    db.info.update(saved)
+                    outcomes.append((unit, None, e))
+                    continue
+                outcomes.append((unit, result, None))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self.failed += len(batch)
+            for unit in batch:
+                self._resolve(unit, error=e)
+            return
+        finally:
+            db.close()
+
+        committed_at = time.monotonic()
+        self.batches += 1
+        metrics.observe("write_queue_batch_units", len(batch), buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+        for unit, result, error in outcomes:
+            metrics.observe("write_queue_wait_seconds", committed_at - unit.enqueued_at)
+            if error is not None:
+                self.failed += 1
+            else:
+                self.units += 1
+            self._resolve(unit, result, error)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self._enabled,
+            "queued": len(self._units),
+            "batches": self.batches,
+            "units": self.units,
+            "failed": self.failed,
+        }
+
+
+write_queue = WriteQueue(max_batch=settings.SQLITE_WRITE_BATCH)
+metrics.register_gauge("write_queue", write_queue.stats)
+
+__all__ = ["WriteQueue", "write_queue"]
@@ -0,0 +1,260 @@
+"""
+Write-behind XP ledger.
+
+Every XP award becomes a row in the append-only ``xp_events`` table, and
+``users.total_xp`` / ``daily_user_activity`` are folds over those rows. Awards
+made during a request are held on the request's session and only enter the
+in-process buffer once that transaction commits, so a rolled-back request
+never earns XP. The scheduler flushes the buffer in batches. Each batch inserts
+its events and folds them into user totals and daily rollups in one
+transaction, with one ``UPDATE`` per distinct user however many awards that
+user made. Hot users stop contending on their row for every chat message.
+
+Trade-off: awards buffered in a worker that dies before its next flush are
+lost (at most ``XP_LEDGER_FLUSH_SECONDS`` worth). Set
+``XP_LEDGER_WRITE_BEHIND=False`` to fold each award inside its request's
+transaction instead.
+
+Totals can be rebuilt exactly from the ledger::
+
+    python -m services.xp_ledger backfill   # opening balances for pre-ledger XP
+    python -m services.xp_ledger rebuild [--user ID ...]
+"""
+from collections import deque
+from datetime import date, datetime
+from typing import Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import argparse
+import threading
+
+from sqlalchemy import event, func, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.user import User
+from models.gamification import DailyUserActivity, XPEvent
+from services.metrics import metrics
+from services.write_queue import write_queue
+from services.scheduler import scheduler
+
+FLUSH_JOB = "xp_ledger_flush"
+_PENDING_KEY = "xp_ledger_pending"
+
+
+class XPEventRecord(NamedTuple):
+    user_id: int
+    action_type: str
+    amount: int
+    session_id: Optional[int]
+    created_at: datetime
+    # Whether this activity counts towards the daily streak
+    streak: bool = True
+    # Other daily_user_activity increments, e.g. (("chats", 1),)
+    rollup: Tuple[Tuple[str, float], ...] = ()
+
+
+class XPLedger:
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        batch_size: int = 500,
+        max_buffer: int = 10000,
+        flush_seconds: float = 1.0,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.flush_seconds = flush_seconds
+        self.flushed = 0
+        self.dropped = 0
+        self._buffer: Deque[XPEventRecord] = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._job_registered = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def enqueue(self, db: Session, record: XPEventRecord) -> None:
+        """Hold ``record`` on ``db``; it is buffered when that session's transaction commits."""
+        db.info.setdefault(_PENDING_KEY, []).append(record)
+
+    def _on_commit(self, db: Session) -> None:
+        records = db.info.pop(_PENDING_KEY, None)
+        if not records:
+            return
+        with self._lock:
+            self._buffer.extend(records)
+            backlog = len(self._buffer)
+        if not self._job_registered:
+            self._job_registered = True
+            scheduler.add_job(FLUSH_JOB, self.flush_seconds, self.flush)
+        if backlog >= min(self.batch_size, self.max_buffer):
+            scheduler.run_soon(FLUSH_JOB)
+
+    def _on_rollback(self, db: Session) -> None:
+        db.info.pop(_PENDING_KEY, None)
+
+    def _take(self) -> List[XPEventRecord]:
+        with self._lock:
+            count = min(self.batch_size, len(self._buffer))
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _requeue(self, batch: List[XPEventRecord]) -> None:
+        with self._lock:
+            self._buffer.extendleft(reversed(batch))
+
+    def _apply(self, batch: List[XPEventRecord]) -> None:
+        from gamification_service import GamificationService
+
+        db = self._session()
+        try:
+            with write_queue.exclusive():
+                GamificationService.apply_events(db, batch)
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def flush(self) -> int:
+        """Write and fold everything buffered so far; returns the number of events flushed."""
+        flushed = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    break
+                try:
+                    self._apply(batch)
+                except OperationalError:
+                    # Database unavailable or locked: keep the events for the next run
+                    self._requeue(batch)
+                    raise
+                except Exception as e:
+                    print(f"XP ledger batch failed ({e}); retrying events one by one")
+                    for record in batch:
+                        try:
+                            self._apply([record])
+                        except Exception as record_error:
+                            # e.g. the user was deleted in the meantime
+                            self.dropped += 1
+                            metrics.inc("xp_ledger_dropped_total")
+                            print(f"Dropping XP event {record}: {record_error}")
+                flushed += len(batch)
+                metrics.observe("xp_ledger_batch_events", len(batch), buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+        self.flushed += flushed
+        return flushed
+
+    def stats(self) -> Dict:
+        return {"pending": self.pending, "flushed": self.flushed, "dropped": self.dropped}
+
+
+xp_ledger = XPLedger(
+    batch_size=settings.XP_LEDGER_BATCH_SIZE,
+    max_buffer=settings.XP_LEDGER_MAX_BUFFER,
+    flush_seconds=settings.XP_LEDGER_FLUSH_SECONDS,
+)
+metrics.register_gauge("xp_ledger", xp_ledger.stats)
+
+event.listen(Session, "after_commit", xp_ledger._on_commit)
+event.listen(Session, "after_rollback", xp_ledger._on_rollback)
+
+
+def _as_date(value) -> date:
+    # func.date() comes back as a string on SQLite and a date on PostgreSQL
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def backfill_opening_balances(db: Session) -> int:
+    """Record each pre-ledger user's current ``total_xp`` as an opening balance event."""
+    has_events = db.query(XPEvent.id).filter(XPEvent.user_id == User.id).exists()
+    rows = [
+        {"user_id": user_id, "action_type": "opening_balance", "amount": total_xp, "created_at": datetime.utcnow()}
+        for user_id, total_xp in db.query(User.id, User.total_xp).filter(User.total_xp > 0, ~has_events)
+    ]
+    if rows:
+        db.execute(insert(XPEvent), rows)
+    db.commit()
+    return len(rows)
+
+
+def rebuild_totals(db: Session, user_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Recompute ``total_xp``, ``total_points``, ``current_level`` and the XP
+    columns of ``daily_user_activity`` from the ledger. Only users with ledger events
+    are touched; run ``backfill_opening_balances`` first on databases that
+    predate the ledger. Returns the number of users rebuilt.
+    """
+    query = db.query(XPEvent.user_id, func.sum(XPEvent.amount)).group_by(XPEvent.user_id)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        query = query.filter(XPEvent.user_id.in_(user_ids))
+    totals = query.all()
+
+    for user_id, total in totals:
+        db.query(User).filter(User.id == user_id).update(
+            # Every award adds to both totals, so both are the ledger sum
+            {"total_xp": total, "total_points": total, "current_level": total // 1000 + 1},
+            synchronize_session=False
+        )
+
+    day = func.date(XPEvent.created_at)
+    daily = db.query(
+        XPEvent.user_id,
+        day,
+        func.sum(XPEvent.amount),
+        func.count(XPEvent.id),
+    ).filter(XPEvent.action_type != "opening_balance").group_by(XPEvent.user_id, day)
+    rollups = db.query(DailyUserActivity)
+    if user_ids is not None:
+        daily = daily.filter(XPEvent.user_id.in_(user_ids))
+        rollups = rollups.filter(DailyUserActivity.user_id.in_(user_ids))
+
+    rebuilt = {(user_id, _as_date(d)): (xp, count) for user_id, d, xp, count in daily}
+    for rollup in rollups:
+        rollup.xp, rollup.events = rebuilt.pop((rollup.user_id, rollup.day), (0, 0))  # type: ignore
+    db.add_all(
+        DailyUserActivity(user_id=user_id, day=d, xp=xp, events=count)
+        for (user_id, d), (xp, count) in rebuilt.items()
+    )
+    db.commit()
+    return len(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="XP ledger maintenance")
+    parser.add_argument("command", choices=["backfill", "rebuild"])
+    parser.add_argument("--user", type=int, action="append", help="limit rebuild to these user ids")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if args.command == "backfill":
+            print(f"Opening balances written: {backfill_opening_balances(db)}")
+        else:
+            print(f"Users rebuilt: {rebuild_totals(db, args.user)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = [
+    "XPEventRecord",
+    "XPLedger",
+    "backfill_opening_balances",
+    "rebuild_totals",
+    "xp_ledger",
+]
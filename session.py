@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean, Text, JSON, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database_quest import Base
@@ -20,7 +20,12 @@ class StudySession(Base):
     user = relationship("User", back_populates="sessions")
     materials = relationship("StudyMaterial", back_populates="session", cascade="all, delete-orphan")
     chats = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    chat_archive = relationship("ChatArchiveSegment", back_populates="session", cascade="all, delete-orphan")
     quizzes = relationship("Quiz", back_populates="session", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_study_sessions_user_start", "user_id", start_time.desc()),
+    )
 
 
 class StudyMaterial(Base):
@@ -34,9 +39,14 @@ class StudyMaterial(Base):
     file_size = Column(Integer, default=0)
     upload_time = Column(DateTime, default=datetime.utcnow)
     processed = Column(Boolean, default=False)
+    ingest_metrics = Column(JSON, nullable=True)  # per-stage timings and counters
     
     # Relationships
     session = relationship("StudySession", back_populates="materials")
+    
+    __table_args__ = (
+        Index("ix_study_materials_session", "session_id"),
+    )
 
 
 class ChatMessage(Base):
@@ -50,6 +60,38 @@ class ChatMessage(Base):
     
     # Relationships
     session = relationship("StudySession", back_populates="chats")
+    
+    __table_args__ = (
+        # Keyset order of a session's history (see services/chat_archive.py)
+        Index("ix_chat_messages_session_timestamp_id", "session_id", "timestamp", "id"),
+    )
+
+
+class ChatArchiveSegment(Base):
+    """
+    A run of a session's old chat messages, moved out of ``chat_messages`` by
+    the archival job. ``payload`` is zlib-compressed JSON; the messages keep
+    their ids and timestamps, and ``first_*``/``last_*`` bound the run in
+    history order.
+    """
+    __tablename__ = "chat_archive_segments"
+    
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("study_sessions.id"), nullable=False)
+    first_timestamp = Column(DateTime, nullable=False)
+    first_id = Column(Integer, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    session = relationship("StudySession", back_populates="chat_archive")
+    
+    __table_args__ = (
+        Index("ix_chat_archive_segments_session_first", "session_id", "first_timestamp", "first_id"),
+    )
 
 
 class Quiz(Base):
@@ -66,6 +108,10 @@ class Quiz(Base):
     # Relationships
     session = relationship("StudySession", back_populates="quizzes")
     questions = relationship("QuizQuestion", back_populates="quiz", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_quizzes_session", "session_id"),
+    )
 
 
 class QuizQuestion(Base):
@@ -84,3 +130,7 @@ class QuizQuestion(Base):
     
     # Relationships
     quiz = relationship("Quiz", back_populates="questions")
+    
+    __table_args__ = (
+        Index("ix_quiz_questions_quiz", "quiz_id"),
+    )
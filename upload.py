@@ -1,42 +1,120 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, HTTPException, Header, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from pydantic import BaseModel
+from typing import Dict, List, Optional
 import os
 import aiofiles
-from database import get_db
-from models.user import User
+from database import get_async_db, read_router
 from models.session import StudySession, StudyMaterial
-from services.document_processor import DocumentProcessor
+from services.document_processor import DocumentProcessor, IngestMetrics
 from services.gamification_service import GamificationService
-from utils.auth import get_current_user
+from services.resumable_upload import ResumableUploadError, ResumableUploadStore, parse_content_range
+from services.retention import session_retention
+from services.summary_tree import build_summary_tree
+from services.write_queue import write_queue
+from utils.auth import UserPrincipal, get_current_principal
 from config import settings
 
 router = APIRouter()
 document_processor = DocumentProcessor()
 gamification_service = GamificationService()
+resumable_uploads = ResumableUploadStore(
+    root=settings.RESUMABLE_UPLOAD_DIR,
+    ttl_hours=settings.RESUMABLE_UPLOAD_TTL_HOURS,
+    max_file_size=settings.MAX_FILE_SIZE,
+    max_part_size=settings.RESUMABLE_MAX_PART_SIZE
+)
 
-@router.post("/upload")
-async def upload_files(
-    files: List[UploadFile] = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    try:
-        # Create study session
+class ResumableUploadCreate(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+
+async def _create_upload_session(db: AsyncSession, current_user: UserPrincipal) -> int:
+    # Create study session
+    def create_session(db: Session) -> int:
         session = StudySession(
             user_id=current_user.id,  # type: ignore
             session_type="upload"
         )
         db.add(session)
-        db.commit()
-        db.refresh(session)
+        db.flush()
+        read_router.stick_on_commit(db, current_user.id)
+        return int(session.id)  # type: ignore
+    
+    session_id = await write_queue.submit(db, create_session)
+    # Every upload adds a session and two directories; expired ones are deleted in the background
+    session_retention.ensure_scheduled()
+    return session_id
+
+def _session_dir(session_id: int) -> str:
+    session_dir = os.path.join(settings.UPLOAD_DIR, f"session_{session_id}")
+    os.makedirs(session_dir, exist_ok=True)
+    return session_dir
+
+async def _ingest_material(
+    background_tasks: BackgroundTasks,
+    session_id: int,
+    filename: str,
+    file_path: str,
+    file_size: int
+) -> StudyMaterial:
+    # Row to save once every file is processed
+    material = StudyMaterial(
+        session_id=session_id,
+        filename=filename,
+        file_path=file_path,
+        file_type=filename.split('.')[-1],
+        file_size=file_size
+    )
+    
+    # Process document for RAG
+    metrics = IngestMetrics(file_type=str(material.file_type))
+    success = await document_processor.process_document(file_path, session_id, metrics=metrics)
+    material.ingest_metrics = metrics.to_dict()  # type: ignore
+    metrics.publish()
+    
+    if success:
+        material.processed = True  # type: ignore
+        # Summaries for broad questions are built after the response is sent
+        background_tasks.add_task(build_summary_tree, file_path, session_id)
+    return material
+
+async def _save_upload(
+    db: AsyncSession,
+    current_user: UserPrincipal,
+    materials: List[StudyMaterial],
+    file_count: int
+) -> None:
+    def save(db: Session) -> None:
+        db.add_all(materials)
+        # Award XP, update streak and user stats in one atomic update
+        gamification_service.record_activity(
+            db=db,
+            user_id=current_user.id,
+            xp_amount=settings.XP_PER_UPLOAD,
+            action_type="upload",
+            counters={"materials_uploaded": file_count}
+        )
+    
+    await write_queue.submit(db, save)
+
+@router.post("/upload")
+async def upload_files(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        session_id = await _create_upload_session(db, current_user)
         
         # Create directory for session
-        session_id = int(session.id)  # type: ignore
-        session_dir = os.path.join(settings.UPLOAD_DIR, f"session_{session_id}")
-        os.makedirs(session_dir, exist_ok=True)
+        session_dir = _session_dir(session_id)
         
         uploaded_files = []
+        materials = []
         
         for file in files:
             # Validate filename
@@ -51,45 +129,139 @@ async def upload_files(
                 content = await file.read()
                 await f.write(content)
             
-            # Save to database
-            material = StudyMaterial(
-                session_id=session_id,
-                filename=filename,
-                file_path=file_path,
-                file_type=filename.split('.')[-1],
-                file_size=len(content)
-            )
-            db.add(material)
-            
-            # Process document for RAG
-            success = await document_processor.process_document(file_path, session_id)
-            
-            if success:
-                material.processed = True  # type: ignore
+            material = await _ingest_material(background_tasks, session_id, filename, file_path, len(content))
+            materials.append(material)
+            if material.processed:
                 uploaded_files.append(filename)
         
-        # Update user stats
-        current_user.materials_uploaded += len(files)  # type: ignore
+        await _save_upload(db, current_user, materials, len(files))
         
-        # Award XP
-        gamification_service.award_xp(
-            db=db,
-            user_id=int(current_user.id),  # type: ignore
-            xp_amount=settings.XP_PER_UPLOAD,
-            action_type="upload"
+        return {
+            "session_id": session_id,
+            "files": uploaded_files,
+            "message": "Files uploaded and processed successfully!"
+        }
+    
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ============= RESUMABLE UPLOADS =============
+#
+# POST   /uploads                 create, body: {filename, size, sha256?}
+# PUT    /uploads/{id}            one part; Content-Range: bytes a-b/size, X-Part-SHA256: <hex>
+# GET    /uploads/{id}            received / missing byte ranges
+# POST   /uploads/{id}/complete   verify, ingest and return the new session
+# DELETE /uploads/{id}            abort
+
+def _resumable_error(e: ResumableUploadError) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e))
+
+async def _read_part(request: Request, size: int) -> bytes:
+    """The request body, refused before it is read past the ``size`` bytes Content-Range announced."""
+    mismatch = ResumableUploadError("Body length does not match Content-Range")
+    content_length = request.headers.get("content-length")
+    if content_length is not None and (not content_length.isdigit() or int(content_length) != size):
+        raise mismatch
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > size:
+            raise mismatch
+    return bytes(data)
+
+@router.post("/uploads")
+async def create_resumable_upload(
+    request: ResumableUploadCreate,
+    current_user: UserPrincipal = Depends(get_current_principal)
+):
+    filename = os.path.basename(request.filename)
+    if os.path.splitext(filename)[1].lower() not in settings.ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    try:
+        state = resumable_uploads.create(int(current_user.id), filename, request.size, request.sha256)  # type: ignore
+    except ResumableUploadError as e:
+        raise _resumable_error(e)
+    return resumable_uploads.status(state)
+
+@router.put("/uploads/{upload_id}")
+async def put_upload_part(
+    upload_id: str,
+    request: Request,
+    content_range: Optional[str] = Header(None),
+    x_part_sha256: Optional[str] = Header(None),
+    current_user: UserPrincipal = Depends(get_current_principal)
+):
+    try:
+        start, end, total = parse_content_range(content_range)
+        if end - start > resumable_uploads.max_part_size:
+            raise ResumableUploadError(f"Parts may be at most {resumable_uploads.max_part_size} bytes", 413)
+        data = await _read_part(request, end - start)
+        state = await resumable_uploads.write_part(
+            upload_id, int(current_user.id), start, end, total, data, x_part_sha256  # type: ignore
         )
+    except ResumableUploadError as e:
+        raise _resumable_error(e)
+    return resumable_uploads.status(state)
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_status(
+    upload_id: str,
+    current_user: UserPrincipal = Depends(get_current_principal)
+):
+    try:
+        state = resumable_uploads.get(upload_id, int(current_user.id))  # type: ignore
+    except ResumableUploadError as e:
+        raise _resumable_error(e)
+    return resumable_uploads.status(state)
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        state = await resumable_uploads.verify(upload_id, int(current_user.id))  # type: ignore
+    except ResumableUploadError as e:
+        raise _resumable_error(e)
+    
+    placed: Dict = {}
+    
+    async def destination(state: Dict) -> str:
+        # Runs under the upload's lock, after the store has checked it is still complete
+        placed["session_id"] = await _create_upload_session(db, current_user)
+        placed["file_path"] = os.path.join(_session_dir(placed["session_id"]), state["filename"])
+        return placed["file_path"]
+    
+    try:
+        state = await resumable_uploads.complete(upload_id, int(current_user.id), destination)  # type: ignore
+        session_id, file_path = placed["session_id"], placed["file_path"]
         
-        # Update streak
-        gamification_service.update_streak(db, int(current_user.id))  # type: ignore
-        
-        db.commit()
+        material = await _ingest_material(background_tasks, session_id, state["filename"], file_path, state["total_size"])
+        await _save_upload(db, current_user, [material], 1)
         
         return {
-            "session_id": session.id,
-            "files": uploaded_files,
+            "session_id": session_id,
+            "files": [state["filename"]] if material.processed else [],
             "message": "Files uploaded and processed successfully!"
         }
     
+    except ResumableUploadError as e:
+        await db.rollback()
+        raise _resumable_error(e)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(
+    upload_id: str,
+    current_user: UserPrincipal = Depends(get_current_principal)
+):
+    try:
+        await resumable_uploads.abort(upload_id, int(current_user.id))  # type: ignore
+    except ResumableUploadError as e:
+        raise _resumable_error(e)
+    return {"upload_id": upload_id, "status": "aborted"}
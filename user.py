@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database_quest import Base
@@ -20,6 +20,7 @@ class User(Base):
     
     # Stats
     study_time_today = Column(Float, default=0)
+    study_day = Column(Date, nullable=True)  # UTC day study_time_today counts; stale days are reset
     quizzes_completed = Column(Integer, default=0)
     badges_earned = Column(Integer, default=0)
     materials_uploaded = Column(Integer, default=0)
@@ -34,3 +35,27 @@ class User(Base):
     # Relationships
     sessions = relationship("StudySession", back_populates="user", cascade="all, delete-orphan")
     achievements = relationship("UserAchievement", back_populates="user", cascade="all, delete-orphan")
+    refresh_tokens = relationship("RefreshToken", back_populates="user", cascade="all, delete-orphan")
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # SHA-256 of the opaque token; the token itself is never stored
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    # Every rotation of one login shares a family; reuse of a rotated token revokes it
+    family_id = Column(String(32), index=True, nullable=False)
+    issued_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+    replaced_by_id = Column(Integer, ForeignKey("refresh_tokens.id"), nullable=True)
+    # Set when a rotated token got its one grace-window sibling
+    grace_used_at = Column(DateTime, nullable=True)
+    
+    # Relationships
+    user = relationship("User", back_populates="refresh_tokens")
+    
+    __table_args__ = (
+        Index("ix_refresh_tokens_user_revoked", "user_id", "revoked_at"),
+    )
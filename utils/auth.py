@@ -1,13 +1,23 @@
 from auth import (
     verify_password,
     get_password_hash,
+    verify_password_async,
+    get_password_hash_async,
     create_access_token,
     get_current_user,
+    get_current_principal,
+    get_read_db,
 )
+from services.principal_cache import UserPrincipal
 
 __all__ = [
     "verify_password",
     "get_password_hash",
+    "verify_password_async",
+    "get_password_hash_async",
     "create_access_token",
     "get_current_user",
+    "get_current_principal",
+    "get_read_db",
+    "UserPrincipal",
 ]